@@ -0,0 +1,40 @@
+# modules/arf/deblurganv2/inference.py
+#
+# DeblurGAN-v2 แบบ inference: ผลเหมือน model.train(True) ของ predict.py แต่ไม่แก้ buffer ของโมเดล
+#
+# predict.py รันใน train mode เพราะ norm layer ทุกตัวต้องใช้สถิติของภาพที่กำลังรัน
+#   - BatchNorm2d ใน backbone (inceptionresnetv2): train mode ใช้ mean/var ของ batch
+#     → batch 1 ภาพ = mean/var ต่อ channel ของภาพนั้น แต่แก้ running_mean/var ทุก forward
+#   - InstanceNorm2d(track_running_stats=True) ใน FPN: train mode ใช้สถิติต่อภาพ
+#     แต่ก็แก้ running stats ทุก forward เช่นกัน (eval mode จะใช้ running stats แทน → ผลเพี้ยน)
+# to_inference() แทน norm ทั้งสองแบบด้วย InstanceStatsNorm ซึ่งคำนวณสถิติต่อภาพต่อ channel
+# ตรง ๆ (F.instance_norm) โดยใช้ weight/bias เดิม → ผลเท่ากับ train mode ที่ batch 1 ภาพ
+# ไม่มี buffer ให้เขียน จึงเรียกใต้ torch.inference_mode() พร้อมกันหลาย thread ได้
+# และรวมหลายภาพเป็น batch ได้ (สถิติไม่ปนกันระหว่างภาพ)
+
+import torch.nn as nn
+import torch.nn.functional as F
+
+class InstanceStatsNorm(nn.Module):
+    """normalize ด้วย mean/var ของแต่ละภาพแต่ละ channel (biased var) แล้ว affine ด้วย weight/bias เดิม"""
+
+    def __init__(self, norm):
+        super().__init__()
+        self.weight = norm.weight   # Parameter เดิม (None ถ้า affine=False)
+        self.bias   = norm.bias
+        self.eps    = norm.eps
+
+    def forward(self, x):
+        return F.instance_norm(x, None, None, self.weight, self.bias, True, 0.0, self.eps)
+
+def to_inference(model: nn.Module) -> nn.Module:
+    """
+    แปลงโมเดลที่โหลด weight แล้ว (in-place): BatchNorm2d / InstanceNorm2d → InstanceStatsNorm
+    แล้วตั้ง eval mode (Dropout = identity) และปิด requires_grad ของทุก parameter
+    """
+    for parent in list(model.modules()):
+        for name, child in parent.named_children():
+            if isinstance(child, (nn.BatchNorm2d, nn.InstanceNorm2d)):
+                setattr(parent, name, InstanceStatsNorm(child))
+    model.requires_grad_(False)
+    return model.eval()
@@ -26,6 +26,7 @@ ROOT = Path(__file__).resolve().parent
 sys.path.insert(0, str(ROOT))     # ให้ import aug.py กับ models.* ได้
 
 from aug import get_normalize
+from inference import to_inference
 from models.networks import get_generator
 
 def main():
@@ -55,7 +56,8 @@ def main():
     # บางไฟล์ weight เก็บใต้ key 'model'
     state_dict = state.get('model', state) if isinstance(state, dict) else state
     model.load_state_dict(state_dict, strict=False)
-    model.train(True)  # DeblurGAN-v2 ต้องใช้ train mode
+    # ผลเท่ากับ train mode (norm ใช้สถิติของภาพนี้) แต่ไม่แก้ running stats (ดู inference.py)
+    model = to_inference(model)
 
     # ─── เตรียม normalize fn ────────────────────────────────────────
     normalize = get_normalize()
@@ -83,7 +85,7 @@ def main():
     x = torch.from_numpy(img_pad.transpose(2, 0, 1)[None]).float().to(device)
 
     # ─── inference ─────────────────────────────────────────────────────
-    with torch.no_grad():
+    with torch.inference_mode():
         pred = model(x)[0].cpu().numpy()
 
     # ─── denorm และ crop กลับสัดส่วนเดิม ─────────────────────────────
@@ -23,8 +23,8 @@ parser.add_argument('--template', default='.',
 # ─── Data specifications ──────────────────────────────────────────────
 parser.add_argument('--dir_data', type=str, default='../../../dataset',
                     help='dataset directory (overridden below)')
-parser.add_argument('--dir_demo', type=str, default='../test',
-                    help='demo image directory (overridden below)')
+parser.add_argument('--dir_demo', type=str, default='',
+                    help='demo image directory (default: data/<data_test>)')
 parser.add_argument('--data_train', type=str, default='DIV2K',
                     help='train dataset name')
 parser.add_argument('--data_test', type=str, default='Demo',
@@ -157,7 +157,8 @@ args.data_test  = args.data_test.split('+')
 base_dir        = os.path.abspath(os.path.dirname(__file__))
 args.dir_data   = os.path.join(base_dir, 'data')
 demo_name       = args.data_test[0]
-args.dir_demo   = os.path.join(base_dir, 'data', demo_name)
+if not args.dir_demo:
+    args.dir_demo = os.path.join(base_dir, 'data', demo_name)
 
 # ensure at least one epoch if epochs set to 0
 if args.epochs == 0:
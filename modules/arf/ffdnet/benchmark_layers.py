@@ -0,0 +1,122 @@
+# modules/arf/ffdnet/benchmark_layers.py
+#
+# microbenchmark ของ layer แรก/สุดท้ายของ FFDNet (2×2 de-interleave + noise map, และ upsample กลับ)
+# เทียบ implementation เดิม (zeros + strided copy 4 ครั้ง + repeat) กับแบบ reshape/permute ใน functions.py
+# ตรวจว่าผลลัพธ์ตรงกันทุก bit แล้ววัดเวลาและ peak memory (แต่ละ case รันใน process แยก)
+#   python modules/arf/ffdnet/benchmark_layers.py
+#   python modules/arf/ffdnet/benchmark_layers.py --sizes 512x512 3000x4000 --repeat 20
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import functions
+
+# ─── implementation เดิม (อ้างอิงสำหรับตรวจ bit-exact) ──────────────────
+def legacy_concatenate_input_noise_map(input, noise_sigma):
+    N, C, H, W = input.size()
+    sca, sca2 = 2, 4
+    Cout, Hout, Wout = sca2 * C, H // sca, W // sca
+    idxL = [[0, 0], [0, 1], [1, 0], [1, 1]]
+    downsampledfeatures = torch.FloatTensor(N, Cout, Hout, Wout).fill_(0)
+    noise_map = noise_sigma.view(N, 1, 1, 1).repeat(1, C, Hout, Wout)
+    for idx in range(sca2):
+        downsampledfeatures[:, idx:Cout:sca2, :, :] = input[:, :, idxL[idx][0]::sca, idxL[idx][1]::sca]
+    return torch.cat((noise_map, downsampledfeatures), 1)
+
+def legacy_upsamplefeatures(input):
+    N, Cin, Hin, Win = input.size()
+    sca, sca2 = 2, 4
+    idxL = [[0, 0], [0, 1], [1, 0], [1, 1]]
+    result = torch.zeros((N, Cin // sca2, Hin * sca, Win * sca)).type(input.type())
+    for idx in range(sca2):
+        result[:, :, idxL[idx][0]::sca, idxL[idx][1]::sca] = input[:, idx:Cin:sca2, :, :]
+    return result
+
+IMPLS = {
+    'legacy': (legacy_concatenate_input_noise_map, legacy_upsamplefeatures),
+    'fused':  (functions.concatenate_input_noise_map, functions.upsamplefeatures),
+}
+
+def _inputs(h: int, w: int, channels: int):
+    g = torch.Generator().manual_seed(0)
+    x     = torch.rand((1, channels, h, w), generator=g)
+    sigma = torch.tensor([25 / 255.0])
+    # output ของ DnCNN กลางเครือข่าย: 4C channel ที่ H/2 × W/2
+    feats = torch.rand((1, 4 * channels, h // 2, w // 2), generator=g)
+    return x, sigma, feats
+
+def check(h: int, w: int, channels: int) -> bool:
+    """ผลของทั้งสอง implementation ตรงกันทุก bit"""
+    x, sigma, feats = _inputs(h, w, channels)
+    down = torch.equal(legacy_concatenate_input_noise_map(x, sigma),
+                       functions.concatenate_input_noise_map(x, sigma))
+    up   = torch.equal(legacy_upsamplefeatures(feats), functions.upsamplefeatures(feats))
+    return down and up
+
+def _peak_rss_mb() -> float:
+    # VmHWM (peak RSS ของ process นี้ นับใหม่หลัง exec) — ru_maxrss ของ process ลูก
+    # อาจติดค่าสูงสุดของ process แม่มาตอน fork
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _measure(impl: str, h: int, w: int, channels: int, repeat: int) -> dict:
+    # รันใน process ลูก: peak RSS ที่เพิ่มขึ้นหลังสร้าง input = memory ชั่วคราวของ layer
+    concat, up = IMPLS[impl]
+    x, sigma, feats = _inputs(h, w, channels)
+    base = _peak_rss_mb()
+    out = {}
+    for name, fn, args in (('down', concat, (x, sigma)), ('up', up, (feats,))):
+        fn(*args)
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fn(*args)
+        out[f'{name}_ms'] = (time.perf_counter() - t0) / repeat * 1000
+    out['peak_mb'] = _peak_rss_mb() - base
+    return out
+
+def _parse_size(s: str):
+    h, w = (int(v) for v in s.lower().split('x'))
+    return h - h % 2, w - w % 2
+
+def main():
+    ap = argparse.ArgumentParser(description='FFDNet (un)shuffle layer microbenchmark')
+    ap.add_argument('--sizes', nargs='+', type=_parse_size,
+                    default=[(256, 256), (1024, 1024), (2000, 2000), (3000, 4000)], help='HxW')
+    ap.add_argument('--channels', type=int, default=3, choices=(1, 3))
+    ap.add_argument('--repeat', type=int, default=10)
+    ap.add_argument('--worker', nargs=3, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        impl, h, w = args.worker
+        print(json.dumps(_measure(impl, int(h), int(w), args.channels, args.repeat)))
+        return
+
+    print(f"{'size':>12}{'MP':>6}{'exact':>7}{'down ms':>18}{'up ms':>18}{'peak MB':>18}")
+    print(f"{'':>25}" + f"{'legacy → fused':>18}" * 3)
+    for h, w in args.sizes:
+        exact = check(h, w, args.channels)
+        res = {}
+        for impl in IMPLS:
+            out = subprocess.check_output([sys.executable, __file__, '--worker', impl, str(h), str(w),
+                                           '--channels', str(args.channels), '--repeat', str(args.repeat)])
+            res[impl] = json.loads(out)
+        cols = ''.join(f"{res['legacy'][k]:>9.1f} → {res['fused'][k]:<6.1f}" for k in ('down_ms', 'up_ms', 'peak_mb'))
+        print(f"{f'{h}x{w}':>12}{h * w / 1e6:>6.1f}{'yes' if exact else 'NO':>7}{cols}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# modules/arf/ffdnet/check_sweep.py
+#
+# ตรวจเกณฑ์เลือก sigma ของ sigma sweep (denoiser.select_sigma) บน noise สังเคราะห์ที่รู้ sigma จริง
+# ใช้ non-local means ของ OpenCV (h = sigma) แทน FFDNet เพราะเป็น denoiser ที่ปรับตาม sigma
+# ที่สั่งเหมือนกัน และตรวจได้โดยไม่ต้องมี weight จริง
+# sigma ที่ประเมินมาต่ำไปครึ่งหนึ่ง / พอดี / สูงไปเท่าตัว → candidate ที่เลือกต้องห่างจาก
+# candidate ที่ MSE เทียบภาพต้นฉบับต่ำสุด (oracle) ไม่เกินหนึ่งขั้น
+#   python modules/arf/ffdnet/check_sweep.py
+
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from denoiser import select_sigma, sweep_sigmas
+
+TRUE_SIGMAS = (10, 25, 40)
+EST_FACTORS = (0.5, 1.0, 2.0)   # sigma จาก DEM = sigma จริง × factor
+
+def synthetic_clean(size: int = 384, seed: int = 0) -> np.ndarray:
+    """ภาพ grayscale สังเคราะห์: gradient + รูปทรงขอบคม + texture เบลอ (uint8)"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32)
+    img = 60 + 120 * x / size
+    texture = cv2.GaussianBlur(rng.normal(0, 1, (size, size)).astype(np.float32), (0, 0), 3)
+    img += 40 * texture / texture.std()
+    for _ in range(12):
+        cx, cy = rng.integers(0, size, 2)
+        r = int(rng.integers(10, size // 6))
+        cv2.circle(img, (int(cx), int(cy)), r, float(rng.uniform(20, 235)), -1)
+    for _ in range(8):
+        p0, p1 = rng.integers(0, size, (2, 2))
+        cv2.line(img, tuple(map(int, p0)), tuple(map(int, p1)), float(rng.uniform(0, 255)), 2)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+def nlm(noisy: np.ndarray, sigma: float) -> np.ndarray:
+    return cv2.fastNlMeansDenoising(noisy, None, h=sigma, templateWindowSize=7, searchWindowSize=21)
+
+def main():
+    clean = synthetic_clean()
+    rng = np.random.default_rng(1)
+    failed = 0
+    print(f"{'true':>5}{'est':>7}{'chosen':>8}{'oracle':>8}  noise left")
+    for true in TRUE_SIGMAS:
+        noisy = np.clip(clean + rng.normal(0, true, clean.shape), 0, 255).astype(np.uint8)
+        for f in EST_FACTORS:
+            sigmas = sweep_sigmas(true * f)
+            outs   = [nlm(noisy, s) for s in sigmas]
+            best, left = select_sigma(noisy, outs, sigmas)
+            oracle = int(np.argmin([np.mean((o.astype(np.float32) - clean) ** 2) for o in outs]))
+            ok = abs(best - oracle) <= 1
+            failed += not ok
+            cols = '  '.join(f'{s:g}:{n:.1f}' for s, n in left.items())
+            print(f"{true:>5}{true * f:>7g}{sigmas[best]:>8g}{sigmas[oracle]:>8g}  {cols}{'' if ok else '  FAIL'}")
+    if failed:
+        sys.exit(f'{failed} case(s) chose a sigma more than one step from the oracle')
+    print('ok')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+# modules/arf/ffdnet/denoiser.py
+#
+# FFDNet แบบ import ใช้ได้: โหลด net_rgb.pth / net_gray.pth ครั้งเดียว แล้ว denoise
+# หลายภาพ (array) ต่อครั้ง โดยรวมภาพขนาดเดียวกันเป็น batch และ sigma แยกต่อภาพ
+#
+#   from denoiser import FFDNetDenoiser          # (cwd / sys.path = modules/arf/ffdnet)
+#   den  = FFDNetDenoiser()
+#   outs = den.denoise_batch([img1, img2, img3], sigmas=[15, 25, 15])
+#
+# ภาพเข้าได้ทั้ง uint8 [0, 255] และ float [0, 1], H×W (gray) หรือ H×W×3 (RGB)
+# ผลลัพธ์มี shape และ dtype เดียวกับภาพเข้า
+#
+# sigma sweep: ถ้า sigma ที่ประเมินมาคลาดเคลื่อน ใช้ denoise_sweep() รันหลาย sigma รอบ ๆ ค่านั้น
+# ใน forward เดียว แล้วเลือกผลด้วยเกณฑ์แบบไม่ต้องมีภาพอ้างอิง (select_sigma)
+#   out, sigma, left = den.denoise_sweep(img, 25)
+
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+from models import FFDNet
+from utils import remove_dataparallel_wrapper
+
+try:
+    from modules.dem.dem import CALIBRATION_FACTOR
+except ImportError:   # รันเป็นสคริปต์จาก modules/arf/ffdnet (test_ffdnet_ipol.py, check_sweep.py)
+    sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+    from modules.dem.dem import CALIBRATION_FACTOR
+
+MODEL_DIR = Path(__file__).resolve().parent / 'models'
+
+SIGMA_MAX       = 75.0                         # ช่วง sigma ที่ FFDNet ถูก train (0–75)
+SWEEP_FACTORS   = (0.5, 0.7, 1.0, 1.4, 2.0)    # candidate = sigma ที่ประเมิน × factor
+NOISE_LEFT_FRAC = 0.3                          # ผลที่ยอมรับได้: noise เหลือไม่เกิน 30% ของ noise ในภาพเข้า
+
+def sweep_sigmas(sigma: float, factors=SWEEP_FACTORS) -> list:
+    """candidate sigma รอบ ๆ ค่าที่ประเมิน (ตัดให้อยู่ใน 1–75, ไม่ซ้ำ, เรียงจากน้อยไปมาก)"""
+    return sorted({round(min(max(sigma * f, 1.0), SIGMA_MAX), 1) for f in factors})
+
+def noise_level(img: np.ndarray) -> float:
+    """
+    sigma ของ noise (สเกล 0–255) แบบเดียวกับ dem.estimate_noise:
+    MAD ระหว่างภาพ grayscale uint8 กับ median 3×3 × CALIBRATION_FACTOR
+    """
+    if img.dtype != np.uint8:
+        img = np.clip(img * 255.0 + 0.5, 0, 255).astype(np.uint8)
+    if img.ndim == 3:
+        img = img[..., 0] if img.shape[2] == 1 else cv2.cvtColor(np.ascontiguousarray(img), cv2.COLOR_RGB2GRAY)
+    return cv2.mean(cv2.absdiff(img, cv2.medianBlur(img, 3)))[0] * CALIBRATION_FACTOR
+
+def select_sigma(noisy: np.ndarray, outs, sigmas):
+    """
+    เลือก candidate แบบไม่มีภาพอ้างอิง จาก noise ที่ยังเหลือในผลของแต่ละ sigma
+      - sigma ต่ำกว่า noise จริง → noise เหลือมาก (DEM รอบสองจะยังเห็นเป็น noise)
+      - sigma ถึง noise จริงแล้ว → noise เหลือน้อย; เพิ่ม sigma ต่อไปเท่ากับลบขอบ/texture ทิ้ง
+    → เลือก sigma ที่น้อยที่สุดที่ noise เหลือ ≤ NOISE_LEFT_FRAC × noise ของภาพเข้า
+    ถ้าไม่มี candidate ไหนผ่าน (noise แรงกว่าทุก candidate) เลือก sigma ที่มากที่สุด
+    sigmas เรียงจากน้อยไปมาก (sweep_sigmas) คืน (index ที่เลือก, {sigma: noise ที่เหลือ})
+    """
+    target = NOISE_LEFT_FRAC * noise_level(noisy)
+    left   = {s: noise_level(out) for s, out in zip(sigmas, outs)}
+    passing = [i for i, s in enumerate(sigmas) if left[s] <= target]
+    return (passing[0] if passing else len(sigmas) - 1), left
+
+class FFDNetDenoiser:
+    """
+    FFDNet ทั้งสองโมเดล (RGB 3 channel / gray 1 channel) ใน eval mode
+    ภาพ RGB ที่ทั้งสาม channel เท่ากันใช้โมเดล gray (เหมือน is_rgb ของ test_ffdnet_ipol)
+    ไม่มี state ระหว่างการเรียก → ใช้พร้อมกันหลาย thread ได้
+    """
+
+    def __init__(self, device='cpu', model_dir=MODEL_DIR, max_batch: int = 8,
+                 max_batch_pixels: int = 8_000_000):
+        self.device           = torch.device(device)
+        self.max_batch        = max_batch
+        self.max_batch_pixels = max_batch_pixels
+        self.nets = {}
+        for in_ch, fn in ((3, 'net_rgb.pth'), (1, 'net_gray.pth')):
+            state_dict = torch.load(Path(model_dir) / fn, map_location=self.device)
+            net = FFDNet(num_input_channels=in_ch)
+            net.load_state_dict(remove_dataparallel_wrapper(state_dict))
+            self.nets[in_ch] = net.to(self.device).eval()
+
+    # ─── ทีละขั้น (MicroBatcher ของ model_host เรียกสามขั้นนี้) ───────────────
+    def prepare(self, img: np.ndarray, sigma):
+        """
+        img → (x: Tensor C×H'×W' ขนาดคู่, noise sigma ที่ normalize แล้ว, meta)
+        sigma (0–255) เป็นค่าเดียวทั้งภาพ หรือ array ของ sigma ต่อ block
+        (dem.noise_map) → ขยายเป็น noise map ขนาด H'/2 × W'/2
+        """
+        dtype = img.dtype
+        x = img.astype(np.float32) / 255.0 if dtype == np.uint8 else img.astype(np.float32, copy=False)
+        squeeze = x.ndim == 2
+        if squeeze:
+            x = x[..., None]
+        gray = x.shape[2] == 1 or (np.array_equal(x[..., 0], x[..., 1]) and np.array_equal(x[..., 2], x[..., 1]))
+        x = x[..., :1] if gray else x
+        h, w = x.shape[:2]
+
+        x = torch.from_numpy(np.ascontiguousarray(x.transpose(2, 0, 1))).to(self.device)
+        # pad odd-size dimensions (ทำซ้ำแถว/คอลัมน์สุดท้าย)
+        x = torch.nn.functional.pad(x[None], (0, w % 2, 0, h % 2), mode='replicate')[0]
+
+        if isinstance(sigma, np.ndarray):
+            nmap  = cv2.resize(sigma.astype(np.float32), (x.shape[2] // 2, x.shape[1] // 2),
+                               interpolation=cv2.INTER_LINEAR) / 255.0
+            sigma = torch.from_numpy(nmap).to(self.device)
+        else:
+            sigma = float(sigma) / 255.0
+        return x, sigma, (h, w, gray, squeeze, img.shape[2] if img.ndim == 3 else 1, dtype)
+
+    def forward(self, xb, sigmas):
+        """xb: N×C×H×W (C เดียวกันทั้ง batch), sigmas: list ต่อภาพ → ภาพที่ denoise แล้ว N×C×H×W"""
+        if any(isinstance(s, torch.Tensor) for s in sigmas):
+            # มี noise map ในกลุ่ม → ใช้ map N×1×H/2×W/2 ทั้ง batch (pad ให้เท่าขนาดของ batch)
+            hh, ww = xb.shape[2] // 2, xb.shape[3] // 2
+            nsigma = torch.stack([
+                torch.nn.functional.pad(s[None, None], (0, ww - s.shape[1], 0, hh - s.shape[0]),
+                                        mode='replicate')[0]
+                if isinstance(s, torch.Tensor) else torch.full((1, hh, ww), s, device=self.device)
+                for s in sigmas
+            ]).to(xb.dtype)
+        else:
+            nsigma = torch.tensor(sigmas, dtype=xb.dtype, device=self.device)
+        with torch.no_grad():
+            return torch.clamp(xb - self.nets[xb.shape[1]](xb, nsigma), 0., 1.)
+
+    def finish(self, y, meta) -> np.ndarray:
+        """crop ส่วนที่ pad ออก แล้วคืน shape / dtype เดิมของภาพเข้า"""
+        h, w, gray, squeeze, channels, dtype = meta
+        out = y[:, :h, :w].permute(1, 2, 0).cpu().numpy()
+        if gray and channels > 1:
+            out = np.repeat(out, channels, axis=2)
+        if squeeze:
+            out = out[..., 0]
+        if dtype == np.uint8:
+            return (out * 255.0).round().clip(0, 255).astype(np.uint8)
+        return out.astype(dtype, copy=False)
+
+    def _forward_chunks(self, xs, sigmas):
+        # xs: list ของ Tensor C×H×W ขนาดเดียวกัน → รันเป็น batch ไม่เกิน max_batch / max_batch_pixels
+        c, h, w = xs[0].shape
+        step = max(1, min(self.max_batch, self.max_batch_pixels // (h * w)))
+        for start in range(0, len(xs), step):
+            yield from self.forward(torch.stack(xs[start:start + step]), sigmas[start:start + step])
+
+    # ─── API ────────────────────────────────────────────────────────
+    def denoise(self, img: np.ndarray, sigma) -> np.ndarray:
+        return self.denoise_batch([img], [sigma])[0]
+
+    def denoise_batch(self, images, sigmas) -> list:
+        """
+        denoise หลายภาพ: sigma เป็นค่าเดียวใช้ทุกภาพ หรือ list ต่อภาพ
+        ภาพที่ขนาดและจำนวน channel (หลังแยก gray) เท่ากันรวมเป็น batch เดียว
+        (ไม่เกิน max_batch ภาพ / max_batch_pixels pixel ต่อ batch) คืน list ตามลำดับเดิม
+        """
+        images = list(images)
+        if not isinstance(sigmas, (list, tuple)):
+            sigmas = [sigmas] * len(images)
+        if len(sigmas) != len(images):
+            raise ValueError(f'sigmas ({len(sigmas)}) ต้องมีจำนวนเท่ากับ images ({len(images)})')
+
+        prepared = [self.prepare(img, s) for img, s in zip(images, sigmas)]
+        groups = {}
+        for i, (x, _, _) in enumerate(prepared):
+            groups.setdefault(tuple(x.shape), []).append(i)
+
+        results = [None] * len(images)
+        for idx in groups.values():
+            ys = self._forward_chunks([prepared[i][0] for i in idx], [prepared[i][1] for i in idx])
+            for i, y in zip(idx, ys):
+                results[i] = self.finish(y, prepared[i][2])
+        return results
+
+    def sweep(self, img: np.ndarray, sigmas) -> list:
+        """denoise ภาพเดียวด้วยหลาย sigma (ค่าเดียวต่อ candidate) ใน forward เดียว คืน list ตามลำดับ sigmas"""
+        x, _, meta = self.prepare(img, 0.0)
+        ys = self._forward_chunks([x] * len(sigmas), [float(s) / 255.0 for s in sigmas])
+        return [self.finish(y, meta) for y in ys]
+
+    def denoise_sweep(self, img: np.ndarray, sigma: float, factors=SWEEP_FACTORS):
+        """
+        รัน candidate sigma รอบ ๆ sigma ที่ประเมินมา (sweep_sigmas) แล้วเลือกด้วย select_sigma
+        คืน (ภาพที่เลือก, sigma ที่เลือก, {sigma: noise ที่เหลือในผล})
+        """
+        sigmas = sweep_sigmas(sigma, factors)
+        outs   = self.sweep(img, sigmas)
+        best, left = select_sigma(img, outs, sigmas)
+        return outs[best], sigmas[best], left
@@ -11,7 +11,8 @@ version. You should have received a copy of this license along
 this program. If not, see <http://www.gnu.org/licenses/>.
 """
 import torch
-from torch.autograd import Function, Variable
+import torch.nn.functional as F
+from torch.autograd import Function
 
 def concatenate_input_noise_map(input, noise_sigma):
 	r"""Implements the first layer of FFDNet. This function returns a
@@ -21,36 +22,35 @@ def concatenate_input_noise_map(input, noise_sigma):
 	non-overlapped 2x2 patches of the input image are placed in the new array
 	along the first dimension.
 
+	The 2x2 de-interleave (channel c*4 + 2*dy + dx, i.e. pixel_unshuffle) is a
+	single reshape/permute copy into the output tensor, and the noise map is
+	broadcast into its channels, so no intermediate tensors are allocated.
+
 	Args:
 		input: batch containing CxHxW images
-		noise_sigma: the value of the pixels of the CxH/2xW/2 noise map
+		noise_sigma: the value of the pixels of the CxH/2xW/2 noise map,
+			either one value per image (size N) or a map of size Nx1xH/2xW/2
 	"""
 	# noise_sigma is a list of length batch_size
 	N, C, H, W = input.size()
-	dtype = input.type()
 	sca = 2
 	sca2 = sca*sca
-	Cout = sca2*C
 	Hout = H//sca
 	Wout = W//sca
-	idxL = [[0, 0], [0, 1], [1, 0], [1, 1]]
-
-	# Fill the downsampled image with zeros
-	if 'cuda' in dtype:
-		downsampledfeatures = torch.cuda.FloatTensor(N, Cout, Hout, Wout).fill_(0)
-	else:
-		downsampledfeatures = torch.FloatTensor(N, Cout, Hout, Wout).fill_(0)
 
-	# Build the CxH/2xW/2 noise map
-	noise_map = noise_sigma.view(N, 1, 1, 1).repeat(1, C, Hout, Wout)
+	out = torch.empty((N, C + sca2*C, Hout, Wout), dtype=input.dtype, device=input.device)
 
-	# Populate output
-	for idx in range(sca2):
-		downsampledfeatures[:, idx:Cout:sca2, :, :] = \
-			input[:, :, idxL[idx][0]::sca, idxL[idx][1]::sca]
+	# Build the CxH/2xW/2 noise map (a scalar per image, or a spatially
+	# varying map of size Nx1xH/2xW/2)
+	if noise_sigma.dim() == 4:
+		out[:, :C] = noise_sigma.expand(N, C, Hout, Wout)
+	else:
+		out[:, :C] = noise_sigma.view(N, 1, 1, 1).expand(N, C, Hout, Wout)
 
-	# concatenate de-interleaved mosaic with noise map
-	return torch.cat((noise_map, downsampledfeatures), 1)
+	# de-interleaved mosaic: (N, C, Hout, dy, Wout, dx) -> (N, C, dy, dx, Hout, Wout)
+	out[:, C:].view(N, C, sca, sca, Hout, Wout).copy_(
+		input.reshape(N, C, Hout, sca, Wout, sca).permute(0, 1, 3, 5, 2, 4))
+	return out
 
 class UpSampleFeaturesFunction(Function):
 	r"""Extends PyTorch's modules by implementing a torch.autograd.Function.
@@ -61,44 +61,22 @@ class UpSampleFeaturesFunction(Function):
 	"""
 	@staticmethod
 	def forward(ctx, input):
-		N, Cin, Hin, Win = input.size()
-		dtype = input.type()
+		Cin = input.size(1)
 		sca = 2
-		sca2 = sca*sca
-		Cout = Cin//sca2
-		Hout = Hin*sca
-		Wout = Win*sca
-		idxL = [[0, 0], [0, 1], [1, 0], [1, 1]]
-
-		assert (Cin%sca2 == 0), \
+		assert (Cin%(sca*sca) == 0), \
 			'Invalid input dimensions: number of channels should be divisible by 4'
-
-		result = torch.zeros((N, Cout, Hout, Wout)).type(dtype)
-		for idx in range(sca2):
-			result[:, :, idxL[idx][0]::sca, idxL[idx][1]::sca] = \
-				input[:, idx:Cin:sca2, :, :]
-
+		N, _, Hin, Win = input.size()
+		Cout = Cin//(sca*sca)
+		# result[:, c, dy::2, dx::2] = input[:, c*4 + 2*dy + dx] (pixel_shuffle) as a
+		# single permute copy into an uninitialised output
+		result = torch.empty((N, Cout, Hin*sca, Win*sca), dtype=input.dtype, device=input.device)
+		result.view(N, Cout, Hin, sca, Win, sca).copy_(
+			input.reshape(N, Cout, sca, sca, Hin, Win).permute(0, 1, 4, 2, 5, 3))
 		return result
 
 	@staticmethod
 	def backward(ctx, grad_output):
-		N, Cg_out, Hg_out, Wg_out = grad_output.size()
-		dtype = grad_output.data.type()
-		sca = 2
-		sca2 = sca*sca
-		Cg_in = sca2*Cg_out
-		Hg_in = Hg_out//sca
-		Wg_in = Wg_out//sca
-		idxL = [[0, 0], [0, 1], [1, 0], [1, 1]]
-
-		# Build output
-		grad_input = torch.zeros((N, Cg_in, Hg_in, Wg_in)).type(dtype)
-		# Populate output
-		for idx in range(sca2):
-			grad_input[:, idx:Cg_in:sca2, :, :] = \
-				grad_output.data[:, :, idxL[idx][0]::sca, idxL[idx][1]::sca]
-
-		return Variable(grad_input)
+		return F.pixel_unshuffle(grad_output, 2)
 
 # Alias functions
 upsamplefeatures = UpSampleFeaturesFunction.apply
@@ -17,11 +17,8 @@ import time
 import numpy as np
 import cv2
 import torch
-import torch.nn as nn
-from torch.autograd import Variable
-from models import FFDNet
-from utils import batch_psnr, normalize, init_logger_ipol, \
-                  variable_to_cv2_image, remove_dataparallel_wrapper, is_rgb
+from utils import init_logger_ipol, is_rgb
+from denoiser import FFDNetDenoiser
 
 os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
@@ -30,82 +27,48 @@ def test_ffdnet(**args):
     # init logger
     logger = init_logger_ipol()
 
-    # check if input is RGB or grayscale
-    try:
-        rgb_den = is_rgb(args['input'])
-    except Exception as e:
-        raise RuntimeError('Cannot open image file') from e
-
-    # load image as numpy CxHxW
-    if rgb_den:
-        in_ch   = 3
-        model_fn= 'models/net_rgb.pth'
-        imorig  = cv2.imread(args['input'])
-        imorig  = cv2.cvtColor(imorig, cv2.COLOR_BGR2RGB).transpose(2,0,1)
-    else:
-        in_ch   = 1
-        model_fn= 'models/net_gray.pth'
-        imorig  = cv2.imread(args['input'], cv2.IMREAD_GRAYSCALE)
-        imorig  = np.expand_dims(imorig, 0)
-    imorig = np.expand_dims(imorig, 0)
-
-    # pad odd-size dimensions
-    sh = imorig.shape
-    expanded_h = sh[2] % 2 == 1
-    expanded_w = sh[3] % 2 == 1
-    if expanded_h:
-        imorig = np.concatenate((imorig, imorig[:, :, -1:, :]), axis=2)
-    if expanded_w:
-        imorig = np.concatenate((imorig, imorig[:, :, :, -1:]), axis=3)
-
-    # normalize and to torch.Tensor
-    imorig = normalize(imorig)
-    imorig = torch.Tensor(imorig)
-
-    # load model weights
-    model_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), model_fn)
-    print('Loading model:', model_path)
-    net = FFDNet(num_input_channels=in_ch)
-    if args['cuda']:
-        state_dict = torch.load(model_path)
-        model      = nn.DataParallel(net, device_ids=[0]).cuda()
-    else:
-        state_dict = torch.load(model_path, map_location='cpu')
-        state_dict = remove_dataparallel_wrapper(state_dict)
-        model      = net
-    model.load_state_dict(state_dict)
-    model.eval()
-
-    # set dtype for tensors
-    dtype = torch.cuda.FloatTensor if args['cuda'] else torch.FloatTensor
+    # decode once; RGB vs grayscale is decided on the decoded array
+    imorig = cv2.imread(args['input'], cv2.IMREAD_COLOR)
+    if imorig is None:
+        raise RuntimeError('Cannot open image file')
+    imorig = cv2.cvtColor(imorig, cv2.COLOR_BGR2RGB)
+    rgb_den = is_rgb(imorig)
+    print("rgb: {}".format(rgb_den))
+    print("im shape: {}".format(imorig.shape))
+    if not rgb_den:
+        imorig = imorig[..., 0]
+    imorig = imorig.astype(np.float32) / 255.
+
+    # load both models (net_rgb.pth / net_gray.pth)
+    model_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'models')
+    print('Loading models:', model_dir)
+    denoiser = FFDNetDenoiser('cuda' if args['cuda'] else 'cpu', model_dir)
 
     # create noisy input or clone original
     if args['add_noise']:
-        noise   = torch.FloatTensor(imorig.size()).normal_(mean=0, std=args['noise_sigma'])
+        noise   = np.random.normal(0, args['noise_sigma'], imorig.shape).astype(np.float32)
         imnoisy = imorig + noise
     else:
-        imnoisy = imorig.clone()
+        imnoisy = imorig
 
-    # inference
-    with torch.no_grad():
-        imorig, imnoisy = Variable(imorig.type(dtype)), Variable(imnoisy.type(dtype))
-        nsigma          = Variable(torch.FloatTensor([args['noise_sigma']]).type(dtype))
+    if args['noise_map']:
+        # per-block sigma (0-255) from DEM, upsampled to the H/2xW/2 noise map
+        sigma = np.load(args['noise_map']).astype(np.float32)
+    else:
+        sigma = args['noise_sigma'] * 255.
 
+    # inference
     start_t = time.time()
-    im_noise_estim = model(imnoisy, nsigma)
-    outim          = torch.clamp(imnoisy - im_noise_estim, 0., 1.)
+    outim   = denoiser.denoise(imnoisy, sigma)
     stop_t  = time.time()
-
-    # remove padding
-    if expanded_h:
-        outim = outim[:, :, :-1, :]
-    if expanded_w:
-        outim = outim[:, :, :, :-1]
+    logger.info("Test time: {0:.4f}s".format(stop_t - start_t))
 
     # save output image
     if not args['dont_save_results']:
         out_path = args['output']
-        out_img  = variable_to_cv2_image(outim)
+        out_img  = (outim * 255.).clip(0, 255).astype(np.uint8)
+        if out_img.ndim == 3:
+            out_img = cv2.cvtColor(out_img, cv2.COLOR_RGB2BGR)
         cv2.imwrite(out_path, out_img)
         # print path for wrapper to capture
         print(out_path)
@@ -116,6 +79,7 @@ if __name__ == "__main__":
     parser.add_argument('--add_noise',    type=str,   default="True")
     parser.add_argument("--input",        type=str,   required=True, help='path to input image')
     parser.add_argument("--noise_sigma",  type=float, default=25,   help='noise level (0-255)')
+    parser.add_argument("--noise_map",    type=str,   default=None, help='.npy of per-block noise sigma (0-255), overrides --noise_sigma')
     parser.add_argument("--dont_save_results", action='store_true', help="don't save output images")
     parser.add_argument("--no_gpu",       action='store_true', help="run model on CPU")
     parser.add_argument("--output",       type=str,   required=True, help='path to save denoised image')
@@ -160,10 +160,13 @@ def init_logger_ipol():
 	"""
 	logger = logging.getLogger('testlog')
 	logger.setLevel(level=logging.INFO)
-	fh = logging.FileHandler('out.txt', mode='w')
-	formatter = logging.Formatter('%(message)s')
-	fh.setFormatter(formatter)
-	logger.addHandler(fh)
+	# add the file handler only once: repeated calls in the same process
+	# (importable denoiser, server) must not stack handlers on 'testlog'
+	if not any(isinstance(h, logging.FileHandler) for h in logger.handlers):
+		fh = logging.FileHandler('out.txt', mode='w')
+		formatter = logging.Formatter('%(message)s')
+		fh.setFormatter(formatter)
+		logger.addHandler(fh)
 
 	return logger
 
@@ -243,15 +246,17 @@ def remove_dataparallel_wrapper(state_dict):
 
 	return new_state_dict
 
-def is_rgb(im_path):
-	r""" Returns True if the image in im_path is an RGB image
+def is_rgb(im):
+	r""" Returns True if the image is an RGB image (channels not all equal)
+
+	Args:
+		im: path to the image, or an already decoded HxW / HxWxC numpy array
 	"""
-	from skimage.io import imread
+	if not isinstance(im, np.ndarray):
+		from skimage.io import imread
+		im = imread(im)
 	rgb = False
-	im = imread(im_path)
 	if (len(im.shape) == 3):
-		if not(np.allclose(im[...,0], im[...,1]) and np.allclose(im[...,2], im[...,1])):
+		if not(np.array_equal(im[...,0], im[...,1]) and np.array_equal(im[...,2], im[...,1])):
 			rgb = True
-	print("rgb: {}".format(rgb))
-	print("im shape: {}".format(im.shape))
 	return rgb
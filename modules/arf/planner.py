@@ -0,0 +1,175 @@
+# modules/arf/planner.py
+
+import atexit
+import json
+import math
+import os
+import random
+import threading
+import time
+from dataclasses import replace
+from pathlib import Path
+
+from ..dem.dem import (BLUR_LAP_THRESHOLD, HR_LAP_THRESHOLD, NOISE_SIGMA_THRESHOLD, DEMReport,
+                       degradation_flags)
+
+# ─── CONFIG ─────────────────────────────────────────────────────────
+# ARF_PLANNER=1: ทำนายผล DEM หลัง FFDNet / DeblurGAN จากสถิติที่บันทึกไว้แทนการรัน DEM ซ้ำ
+# รัน DEM จริงเฉพาะเมื่อค่าที่ทำนายใกล้ threshold (ไม่แน่ใจ) หรือยังมีข้อมูลไม่พอ
+# ไฟล์สถิติอยู่ใน instance/ ของโปรเจกต์ (ไม่อยู่ใต้ static/ → ดาวน์โหลดผ่าน /uploads ไม่ได้)
+PLANNER_ENABLED = os.environ.get('ARF_PLANNER', '0') == '1'
+PLANNER_STATS   = Path(os.environ.get(
+    'ARF_PLANNER_STATS',
+    Path(__file__).resolve().parents[2] / 'instance' / 'planner_stats.json'))
+
+MIN_SAMPLES = 20     # จำนวนคู่ (ก่อน, หลัง) ขั้นต่ำต่อ stage ก่อนเริ่มทำนาย
+MARGIN      = 2.0    # ห่างจาก threshold น้อยกว่า MARGIN × residual SD → ไม่แน่ใจ → รัน DEM จริง
+AUDIT_RATE  = 0.05   # สุ่มรัน DEM จริงแม้มั่นใจ เพื่อวัดความแม่นและเก็บสถิติต่อ
+SAVE_EVERY  = 20     # เขียนไฟล์สถิติทุก SAVE_EVERY record ใหม่ ...
+SAVE_SECS   = 60.0   # ... หรือเมื่อห่างจากครั้งก่อนเกิน SAVE_SECS วินาที (และตอนปิด process)
+
+class _Fit:
+    """linear regression y = a·x + b แบบสะสม (sum) → อัปเดตทีละคู่ได้และเก็บเป็น JSON ได้"""
+
+    __slots__ = ('n', 'sx', 'sy', 'sxx', 'sxy', 'syy')
+
+    def __init__(self, n=0, sx=0.0, sy=0.0, sxx=0.0, sxy=0.0, syy=0.0):
+        self.n, self.sx, self.sy, self.sxx, self.sxy, self.syy = n, sx, sy, sxx, sxy, syy
+
+    def add(self, x: float, y: float):
+        self.n   += 1
+        self.sx  += x
+        self.sy  += y
+        self.sxx += x * x
+        self.sxy += x * y
+        self.syy += y * y
+
+    def predict(self, x: float):
+        """(ค่าที่ทำนาย, residual SD)"""
+        n   = self.n
+        var = self.sxx - self.sx * self.sx / n
+        a   = (self.sxy - self.sx * self.sy / n) / var if var > 1e-12 else 0.0
+        b   = (self.sy - a * self.sx) / n
+        sse = self.syy - 2 * a * self.sxy - 2 * b * self.sy + a * a * self.sxx + 2 * a * b * self.sx + n * b * b
+        return a * x + b, math.sqrt(max(sse, 0.0) / max(n - 2, 1))
+
+    def to_list(self) -> list:
+        return [self.n, self.sx, self.sy, self.sxx, self.sxy, self.syy]
+
+class StagePlanner:
+    """
+    เก็บสถิติว่าแต่ละโมเดลเปลี่ยน sigma และ log(lap_var) อย่างไร (regression ต่อ stage)
+    แล้วทำนาย DEMReport หลัง stage จาก DEMReport ก่อน stage
+    FFDNet / DeblurGAN ไม่เปลี่ยนขนาดภาพ → flag low-res จากขนาดไม่ต้องทำนาย
+    """
+
+    def __init__(self, path=PLANNER_STATS, min_samples: int = MIN_SAMPLES,
+                 margin: float = MARGIN, audit_rate: float = AUDIT_RATE):
+        self.path        = Path(path)
+        self.min_samples = min_samples
+        self.margin      = margin
+        self.audit_rate  = audit_rate
+        self._fits       = {}   # stage → {'sigma': _Fit, 'lap': _Fit}
+        self._lock       = threading.Lock()
+        self._save_lock  = threading.Lock()   # เขียนไฟล์ทีละ thread (นอก _lock)
+        self._dirty      = 0                  # record ที่ยังไม่ได้เขียนลงไฟล์
+        self._saved_at   = time.monotonic()
+        self.counts      = {'predicted': 0, 'uncertain': 0, 'audits': 0, 'audit_mismatch': 0}
+        self._load()
+
+    # ─── statistics ─────────────────────────────────────────────────
+    def record(self, stage: str, before: DEMReport, after: DEMReport):
+        """บันทึกผล DEM จริงหลัง stage (เรียกทุกครั้งที่รัน DEM ซ้ำ) ลงไฟล์เป็นระยะ"""
+        with self._lock:
+            fits = self._fits.setdefault(stage, {'sigma': _Fit(), 'lap': _Fit()})
+            fits['sigma'].add(before.sigma, after.sigma)
+            fits['lap'].add(math.log1p(before.lap_var), math.log1p(after.lap_var))
+            self._dirty += 1
+            due = self._dirty >= SAVE_EVERY or time.monotonic() - self._saved_at >= SAVE_SECS
+        if due:
+            self.flush()
+
+    def predict(self, stage: str, before: DEMReport):
+        """
+        DEMReport ที่ทำนายไว้หลัง stage (mode='predicted')
+        หรือ None ถ้าข้อมูลยังไม่พอ / ค่าที่ทำนายใกล้ threshold เกินไป
+        """
+        with self._lock:
+            fits = self._fits.get(stage)
+            if fits is None or fits['sigma'].n < self.min_samples:
+                self.counts['uncertain'] += 1
+                return None
+            sigma,   sigma_sd = fits['sigma'].predict(before.sigma)
+            log_lap, lap_sd   = fits['lap'].predict(math.log1p(before.lap_var))
+
+            # ระยะจาก threshold เทียบกับความคลาดเคลื่อนของการทำนาย
+            near = abs(sigma - NOISE_SIGMA_THRESHOLD) < self.margin * sigma_sd or any(
+                abs(log_lap - math.log1p(t)) < self.margin * lap_sd
+                for t in (BLUR_LAP_THRESHOLD, HR_LAP_THRESHOLD))
+            if near:
+                self.counts['uncertain'] += 1
+                return None
+            self.counts['predicted'] += 1
+
+        lap_var = max(math.expm1(log_lap), 0.0)
+        sigma   = max(sigma, 0.0)
+        noise, blur, lowres = degradation_flags(sigma, lap_var, before.height, before.width)
+        return replace(before, sigma=sigma, lap_var=lap_var, noise=noise, blur=blur,
+                       lowres=lowres, mode='predicted')
+
+    def audit(self) -> bool:
+        """True = ควรรัน DEM จริงแม้จะทำนายได้ (สุ่มตาม audit_rate)"""
+        return random.random() < self.audit_rate
+
+    def audited(self, predicted: DEMReport, actual: DEMReport):
+        with self._lock:
+            self.counts['audits'] += 1
+            self.counts['audit_mismatch'] += predicted.kind != actual.kind
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counts,
+                'samples': {stage: f['sigma'].n for stage, f in self._fits.items()},
+                'min_samples': self.min_samples,
+                'margin': self.margin,
+            }
+
+    # ─── persistence ────────────────────────────────────────────────
+    def _load(self):
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return
+        for stage, fits in data.items():
+            self._fits[stage] = {k: _Fit(*v) for k, v in fits.items()}
+
+    def flush(self):
+        """เขียนสถิติที่ยังไม่ได้บันทึกลงไฟล์ (snapshot ใต้ _lock แต่เขียนไฟล์นอก lock)"""
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = {stage: {k: f.to_list() for k, f in fits.items()}
+                        for stage, fits in self._fits.items()}
+                self._dirty    = 0
+                self._saved_at = time.monotonic()
+            self._save(data)
+
+    def _save(self, data: dict):
+        # เขียนไฟล์ชั่วคราวแล้ว replace → ไฟล์ไม่เสียถ้า process ตายกลางทาง
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(data), encoding='utf-8')
+        os.replace(tmp, self.path)
+
+_planner = None
+_planner_lock = threading.Lock()
+
+def get_planner() -> StagePlanner:
+    global _planner
+    with _planner_lock:
+        if _planner is None:
+            _planner = StagePlanner()
+            atexit.register(_planner.flush)   # record ที่ยังไม่ถึงรอบเขียนไม่หายตอนปิด
+        return _planner
@@ -1,153 +1,324 @@
 # modules/arf/run_arf.py
 
+import os
 import sys
 import subprocess
 import uuid
-import shutil
 from pathlib import Path
-from ..fem.run_fem import apply_fem
+import numpy as np
+from ..dem.dem import DEMReport, DEMTileMap, analyze, analyze_file, noise_map, tile_map, to_gray
+from ..fem.run_fem import is_color_distorted, run_awb
+from ..model_host import (BACKEND, EDSR_SCALE, get_host, load_image, match_channels, save_image,
+                          scratch_dir, to_uint8)
+from .planner import PLANNER_ENABLED, get_planner
+from .tiles import restore_tiles
 
 # ─── PATH SETUP ─────────────────────────────────────────────────────
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
 UPLOAD_DIR   = PROJECT_ROOT / 'static' / 'uploads'
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-def run_dem(img_path: Path):
+# ─── TILE MODE ──────────────────────────────────────────────────────
+# ARF_TILE_MODE=1: ก่อน FFDNet/DeblurGAN ทำ DEM ต่อ tile แล้ว restore เฉพาะ tile ที่มีปัญหา
+# (ภาพที่เบลอ/noise แค่บางส่วน) ถ้า tile ที่ต้องแก้เกิน TILE_MAX_FRACTION ของภาพ
+# รันทั้งภาพตามเดิมเพราะ overlap ของ crop จะทำให้ช้ากว่า — EDSR รันทั้งภาพเสมอ (ขนาดภาพเปลี่ยน)
+TILE_MODE         = os.environ.get('ARF_TILE_MODE', '0') == '1'
+TILE_MAX_FRACTION = float(os.environ.get('ARF_TILE_MAX_FRACTION', '0.6'))
+TILE_OVERLAP      = 32
+
+# ARF_NOISE_MAP=1: ส่ง noise map เฉพาะที่ (sigma ต่อ block จาก DEM) เข้า FFDNet แทน sigma เดียวทั้งภาพ
+# → ภาพแสงน้อยที่ noise ในเงามืดแรงกว่าส่วนสว่าง denoise ได้ครบในรอบเดียว
+NOISE_MAP = os.environ.get('ARF_NOISE_MAP', '0') == '1'
+
+# ARF_FFDNET_SWEEP=1: sigma จาก DEM อาจคลาดเคลื่อน → รัน FFDNet หลาย sigma รอบ ๆ ค่านั้น
+# ใน forward เดียว แล้วเลือกผลจาก noise ที่เหลือ (denoiser.select_sigma) ไม่ต้องมีภาพอ้างอิง
+# ใช้เมื่อ sigma เป็นค่าเดียวทั้งภาพและรันทั้งภาพ (ไม่ใช้ร่วมกับ noise map / tile), host backend เท่านั้น
+FFDNET_SWEEP = os.environ.get('ARF_FFDNET_SWEEP', '0') == '1'
+
+# ARF_GRAY=1 (ค่าเริ่มต้น): ภาพขาวดำจริง (สาม channel เท่ากัน) ถูกตรวจครั้งเดียวตอนอ่านไฟล์
+# แล้วส่งต่อเป็น H×W×1 ตลอด pipeline: FFDNet ใช้ net_gray.pth, DeblurGAN / EDSR ขยายเป็น
+# 3 channel เฉพาะใน tensor ของโมเดล และข้าม FEM (ภาพขาวดำไม่มีสีให้เพี้ยน)
+GRAY_FAST_PATH = os.environ.get('ARF_GRAY', '1') == '1'
+
+# ทุก stage ใน pipeline รับ/คืนภาพเป็น float32 RGB [0, 1] (หรือ H×W×1) ในหน่วยความจำ
+# เข้ารหัสลงไฟล์ครั้งเดียวตอนจบ (ARF_BACKEND=subprocess จะเขียนไฟล์ชั่วคราว
+# ในโฟลเดอร์ scratch_dir ของ request นั้นเอง แล้วลบทิ้งเมื่อจบ stage)
+
+def _gray_u8(img: np.ndarray) -> np.ndarray:
+    # ภาพ float32 RGB หรือ H×W×1 → grayscale uint8 สำหรับ DEM
+    # (to_gray เดียวกับ analyze_file → ไฟล์เดียวกันได้ route เดียวกันทั้ง /process และ /batch)
+    return to_gray(to_uint8(img), rgb=True)
+
+def run_dem(img) -> DEMReport:
     """
-    รัน dem.py เพื่อตรวจหาว่าในภาพมี noise, blur, หรือ low-resolution
-    คืนค่า (kind, sigma) เช่น ('noise', 15.2) หรือ ('blur', None)
+    รัน DEM (in-process) เพื่อตรวจหาว่าในภาพมี noise, blur, หรือ low-resolution
+    img เป็น ndarray float32 RGB หรือ path ของไฟล์ก็ได้
+    คืน DEMReport (sigma, lap_var, ขนาดภาพ, flag ทุกตัว, kind, plan) จากการวิเคราะห์ครั้งเดียว
     """
-    dem_script = PROJECT_ROOT / 'modules' / 'dem' / 'dem.py'
-    out = subprocess.check_output(
-        [sys.executable, str(dem_script), str(img_path)],
-        text=True
-    ).strip().split()
-    kind  = out[0]
-    sigma = None if out[1] == 'None' else float(out[1])
-    return kind, sigma
-
-def _run_ffdnet(in_path: Path, sigma: float) -> str:
+    if isinstance(img, np.ndarray):
+        return analyze(_gray_u8(img))
+    return analyze_file(str(img))
+
+def run_dem_tiles(img: np.ndarray) -> DEMTileMap:
+    """DEM ต่อ tile ของภาพ float32 RGB (ใช้ใน tile mode)"""
+    return tile_map(_gray_u8(img))
+
+def run_noise_map(img: np.ndarray) -> np.ndarray:
+    """sigma ต่อ block (0–255) ของภาพ float32 RGB สำหรับ noise map ของ FFDNet"""
+    return noise_map(_gray_u8(img))
+
+def _tile_mask(mask: np.ndarray):
+    # คืน mask ถ้าควร restore แบบราย tile, None = รันทั้งภาพ
+    if mask.any() and mask.mean() <= TILE_MAX_FRACTION:
+        return mask
+    return None
+
+def _run_script(cmd: list, cwd: Path = None):
+    subprocess.check_call([sys.executable, *map(str, cmd)], cwd=str(cwd) if cwd else None)
+
+def _run_ffdnet(img: np.ndarray, sigma, tiles: DEMTileMap = None) -> np.ndarray:
     """
-    Wrapper ให้ FFDNet เขียนผลลัพธ์ตรงไปที่ static/uploads
+    FFDNet denoise
+    sigma เป็นค่าเดียวทั้งภาพ หรือ array sigma ต่อ block (run_noise_map)
+    ถ้าส่ง tiles (tile mode) จะ denoise เฉพาะ tile ที่มี noise ด้วย sigma ของ tile นั้น
     """
+    if BACKEND == 'host':
+        host = get_host()
+        mask = _tile_mask(tiles.noise) if tiles is not None else None
+        if mask is None:
+            return host.denoise(img, sigma)
+        return restore_tiles(img, mask, tiles.tile,
+                             lambda crop, r, c: host.denoise(crop, round(float(tiles.sigma[r, c]), 1)),
+                             overlap=TILE_OVERLAP)
+
     base_dir = PROJECT_ROOT / 'modules' / 'arf' / 'ffdnet'
-    script   = base_dir / 'test_ffdnet_ipol.py'
-    out_name = f"{in_path.stem}_denoise_{uuid.uuid4().hex[:6]}.png"
-    out_path = UPLOAD_DIR / out_name
-
-    cmd = [
-        sys.executable, str(script),
-        '--input',       str(in_path),
-        '--noise_sigma', str(sigma),
-        '--add_noise',   'False',
-        '--output',      str(out_path)
-    ]
-    subprocess.check_call(cmd, cwd=str(base_dir))
-    return str(out_path)
-
-def _run_deblurgan(in_path: Path) -> str:
+    with scratch_dir('ffdnet') as tmp:
+        in_path  = save_image(tmp / 'input.png', img)
+        out_path = tmp / 'denoise.png'
+        if isinstance(sigma, np.ndarray):
+            np.save(tmp / 'noise_map.npy', sigma)
+            sigma_args = ['--noise_map', tmp / 'noise_map.npy']
+        else:
+            sigma_args = ['--noise_sigma', sigma]
+        _run_script([
+            base_dir / 'test_ffdnet_ipol.py',
+            '--input',       in_path,
+            *sigma_args,
+            '--add_noise',   'False',
+            '--output',      out_path
+        ], cwd=base_dir)
+        return match_channels(load_image(out_path), img)
+
+def _run_ffdnet_sweep(img: np.ndarray, sigma: float):
+    """FFDNet หลาย candidate sigma (host) → (ภาพที่เลือก, sigma ที่เลือก)"""
+    out, chosen, _ = get_host().denoise_sweep(img, sigma)
+    return out, chosen
+
+def _run_deblurgan(img: np.ndarray, tiles: DEMTileMap = None) -> np.ndarray:
     """
-    Wrapper ให้ DeblurGAN-v2 เขียนผลลัพธ์ตรงไปที่ static/uploads
+    DeblurGAN-v2 deblur
+    ถ้าส่ง tiles (tile mode) จะ deblur เฉพาะ tile ที่เบลอ
     """
-    script   = PROJECT_ROOT / 'modules' / 'arf' / 'deblurganv2' / 'predict.py'
-    out_name = f"{in_path.stem}_deblur_{uuid.uuid4().hex[:6]}.jpg"
-    out_path = UPLOAD_DIR / out_name
-
-    subprocess.check_call([
-        sys.executable,
-        str(script),
-        str(in_path),
-        str(out_path)
-    ])
-    return str(out_path)
-
-def _run_edsr(in_path: Path) -> str:
+    if BACKEND == 'host':
+        host = get_host()
+        mask = _tile_mask(tiles.blur) if tiles is not None else None
+        if mask is None:
+            return host.deblur(img)
+        return restore_tiles(img, mask, tiles.tile, lambda crop, r, c: host.deblur(crop),
+                             overlap=TILE_OVERLAP)
+
+    script = PROJECT_ROOT / 'modules' / 'arf' / 'deblurganv2' / 'predict.py'
+    with scratch_dir('deblur') as tmp:
+        in_path  = save_image(tmp / 'input.png', img)
+        out_path = tmp / 'deblur.png'
+        _run_script([script, in_path, out_path])
+        return match_channels(load_image(out_path), img)
+
+def _run_edsr(img: np.ndarray) -> np.ndarray:
     """
-    Wrapper ให้ EDSR เขียนผลลัพธ์ไปที่ static/uploads
+    EDSR super-resolution (x{EDSR_SCALE})
     """
-    edsr_dir   = PROJECT_ROOT / 'modules' / 'arf' / 'edsr'
-    script     = edsr_dir / 'main.py'
-    demo_name  = 'Demo'
-    demo_dir   = edsr_dir / 'data' / demo_name
-
-    # เคลียร์ data/Demo ก่อนเสมอ
-    if demo_dir.exists():
-        for f in demo_dir.iterdir():
-            if f.is_file():
-                f.unlink()
-    else:
-        demo_dir.mkdir(parents=True, exist_ok=True)
+    scale = str(EDSR_SCALE)  # ตั้งค่า scale ที่ model_host.EDSR_SCALE
 
-    shutil.copy(in_path, demo_dir / in_path.name)
+    if BACKEND == 'host':
+        return get_host().super_resolve(img)
 
-    scale      = '3'  # เปลี่ยนเป็น '4' ถ้าต้องการ x4
+    edsr_dir   = PROJECT_ROOT / 'modules' / 'arf' / 'edsr'
     model_file = PROJECT_ROOT / 'modules' / 'arf' / 'experiment' / 'model' / f'EDSR_x{scale}.pt'
 
-    cmd = [
-        sys.executable, str(script),
-        '--data_test', demo_name,
-        '--scale',     scale,
-        '--model',     'EDSR',
-        '--n_resblocks', '32',
-        '--n_feats',     '256',
-        '--res_scale',   '0.1',
-        '--pre_train',   str(model_file),
-        '--test_only',
-        '--save_results',
-        '--save_dir',   str(UPLOAD_DIR),
-        '--n_threads',   '1',
-    ]
-    subprocess.check_call(cmd, cwd=str(edsr_dir))
-
-    # หาไฟล์ <stem>_x{scale}_SR.* ใน static/uploads
-    result_dir = UPLOAD_DIR
-    sr_files   = list(result_dir.glob(f"{in_path.stem}_x{scale}_SR.*"))
-    if not sr_files:
-        sr_files = list(result_dir.glob(in_path.name))
-    if not sr_files:
-        raise FileNotFoundError(f"ไม่พบผลลัพธ์ EDSR ใน {result_dir}")
-
-    out_file = sr_files[0]
-    return str(out_file)
-
-def apply_arf(input_path: str, kind: str = None, sigma: float = None) -> str:
+    # แต่ละ request มีโฟลเดอร์ demo (input) และผลลัพธ์ของตัวเอง แทน data/Demo ที่ใช้ร่วมกัน
+    # --save เป็น path เต็มใน scratch → checkpoint เขียน log.txt / config.txt ที่นั่น
+    # (os.path.join('..', 'experiment', save) คืน save ตรง ๆ เมื่อเป็น absolute path)
+    # แทน ../experiment/test ที่ทุก request ใช้ร่วมกัน
+    with scratch_dir('edsr') as tmp:
+        demo_dir = tmp / 'demo'
+        out_dir  = tmp / 'out'
+        demo_dir.mkdir()
+        in_path = Path(save_image(demo_dir / 'edsr.png', img))
+
+        _run_script([
+            edsr_dir / 'main.py',
+            '--data_test',   'Demo',
+            '--dir_demo',    demo_dir,
+            '--scale',       scale,
+            '--model',       'EDSR',
+            '--n_resblocks', '32',
+            '--n_feats',     '256',
+            '--res_scale',   '0.1',
+            '--pre_train',   model_file,
+            '--test_only',
+            '--save_results',
+            '--save_dir',    out_dir,
+            '--save',        tmp / 'experiment',
+            '--n_threads',   '1',
+        ], cwd=edsr_dir)
+
+        # หาไฟล์ <stem>_x{scale}_SR.* ในโฟลเดอร์ผลลัพธ์ของ request นี้
+        sr_files = list(out_dir.glob(f"{in_path.stem}_x{scale}_SR.*"))
+        if not sr_files:
+            raise FileNotFoundError(f"ไม่พบผลลัพธ์ EDSR ใน {out_dir}")
+        return match_channels(load_image(sr_files[0]), img)
+
+def _save_result(p: Path, img: np.ndarray) -> str:
+    out_path = UPLOAD_DIR / f"{p.stem}_restored_{uuid.uuid4().hex[:6]}.png"
+    return save_image(out_path, img)
+
+def _finish_steps(p: Path, img: np.ndarray, route: list, fem: bool = True):
+    # FEM ตรวจสี (+ AWB ถ้าสีเพี้ยน) แล้วเขียนไฟล์ผลลัพธ์ — ภาพขาวดำ (H×W×1) ข้าม FEM
+    if fem and img.shape[2] == 3:
+        distorted = yield ('fem', is_color_distorted, (img,))
+        route.append('fem')
+        if distorted:
+            img = yield ('fem', run_awb, (img,))
+            route.append('awb')
+    return (yield ('io', _save_result, (p, img)))
+
+def arf_steps(input_path: str, kind: str = None, sigma: float = None,
+              route: list = None, report: DEMReport = None, reports: list = None):
     """
-    Pipeline อัตโนมัติ:
-      1) DEM
-      2) ถ้าเจอ noise → FFDNet → DEM
-      3) ถ้าเจอ blur  → DeblurGAN-v2 → DEM
-      4) ถ้าเจอ low-res → EDSR
-      หลังจากขั้นตอนสุดท้าย (denoise/deblur/SR) ให้ส่งภาพเข้า FEM ตรวจสี
+    Pipeline ของ apply_arf ในรูป generator: yield (stage, fn, args) ทีละขั้น
+    แล้วรับผลลัพธ์ของ fn(*args) กลับทาง send() → ตัวรัน (run_steps หรือ
+    orchestrator.pipeline.StagedExecutor) เลือกได้ว่าจะรันแต่ละขั้นที่ไหน
+    stage: 'io', 'dem', 'ffdnet', 'deblurgan', 'edsr', 'fem'
+
+    ส่ง report (DEMReport ของภาพต้นฉบับ เช่นจาก batch) มาได้เพื่อข้าม DEM รอบแรก
+    ถ้าส่ง list มาใน reports จะได้ DEMReport ทุกรอบ (รวมรอบที่ planner ทำนาย: mode='predicted')
     """
     p = Path(input_path)
+    img = original = yield ('io', load_image, (p, GRAY_FAST_PATH))
+    if route is None:
+        route = []
+    if reports is None:
+        reports = []
+
+    def _dem(report):
+        reports.append(report)
+        route.append(f"{'plan' if report.mode == 'predicted' else 'dem'}:{report.kind}")
+        return report
+
+    def _recheck(stage, before, img):
+        # DEM หลัง stage: ARF_PLANNER=1 ทำนายจากสถิติของ stage ถ้ามั่นใจ (ไม่ต้องรัน DEM)
+        # ไม่เช่นนั้นรัน DEM จริงบน array แล้วบันทึกผลเป็นสถิติให้ planner
+        planner   = get_planner() if PLANNER_ENABLED and before is not None else None
+        predicted = planner.predict(stage, before) if planner else None
+        if predicted is not None and not planner.audit():
+            return _dem(predicted)
+        after = yield ('dem', run_dem, (img,))
+        if planner and before.mode != 'predicted':
+            planner.record(stage, before, after)
+            if predicted is not None:
+                planner.audited(predicted, after)
+        return _dem(after)
 
-    # 1) ถ้าไม่มี kind มาจาก front-end ให้ตรวจ DEM รอบแรก
+    # 1) DEM รอบแรก: วิเคราะห์ครั้งเดียวได้ทุก flag แต่ route ยังเดินตาม report.kind (flag แรกที่เจอ)
+    #    และ DEM รอบหลังแต่ละ stage; report.plan เป็นข้อมูลประกอบ (to_dict / CSV) เท่านั้น
+    #    เพราะ FFDNet / DeblurGAN เปลี่ยน lap_var ที่ตัดสิน low-res → ตัด EDSR ล่วงหน้าไม่ได้
+    #    (kind/sigma จาก front-end ยังใช้ได้เหมือนเดิม)
     if kind is None:
-        kind, sigma = run_dem(p)
+        if report is None:
+            report = yield ('dem', run_dem, (img,))
+        report = _dem(report)
+        kind, sigma = report.result()
+    else:
+        route.append(f'dem:{kind}')
+
+    # DEM รอบหลังรันเฉพาะหลัง stage ที่เปลี่ยน metric ที่ใช้ตัดสินขั้นถัดไป
+    # (FFDNet เปลี่ยน sigma และ lap_var, DeblurGAN เปลี่ยน lap_var) — EDSR ไม่ต้องตรวจซ้ำ
+
+    # tile mode (host backend): DEM ต่อ tile ก่อน stage ที่แก้เฉพาะบางส่วนของภาพได้
+    tiled = TILE_MODE and BACKEND == 'host'
 
     # 2) กรณีแรก DEM บอกว่าเป็น noise
     if kind == 'noise':
-        p = Path(_run_ffdnet(p, sigma))      # รัน FFDNet → ได้ภาพ denoise
-        kind, sigma = run_dem(p)             # ตรวจ DEM รอบสอง
+        tiles = None
+        if NOISE_MAP:
+            sigma = yield ('dem', run_noise_map, (img,))    # sigma เฉพาะที่ต่อ block
+        elif tiled:
+            tiles = yield ('dem', run_dem_tiles, (img,))
+        if FFDNET_SWEEP and BACKEND == 'host' and tiles is None and not NOISE_MAP:
+            # หลาย sigma ใน forward เดียว → route บันทึก sigma ที่เลือก
+            img, chosen = yield ('ffdnet', _run_ffdnet_sweep, (img, sigma))
+            route.append(f'ffdnet:sigma={chosen:g}')
+            stage = 'ffdnet_sweep'    # สถิติ planner แยกจาก FFDNet sigma เดียว
+        else:
+            img = yield ('ffdnet', _run_ffdnet, (img, sigma, tiles))   # รัน FFDNet → ได้ภาพ denoise
+            route.append('ffdnet')
+            # สถิติ planner แยกตามแบบที่รัน: ทั้งภาพ / เฉพาะ tile / noise map เปลี่ยนค่า DEM ต่างกัน
+            stage = 'ffdnet:map' if NOISE_MAP else 'ffdnet:tile' if tiles is not None else 'ffdnet'
+        report = yield from _recheck(stage, report, img)   # ตรวจ DEM รอบสอง (หรือทำนาย)
+        kind, sigma = report.result()
         if kind == 'noise':
             # ถ้ายังเป็น noise จบ pipeline → ส่งเข้า FEM แล้ว return
-            p = Path(apply_fem(str(p)))
-            return str(p)
+            return (yield from _finish_steps(p, img, route))
         # ถ้าเปลี่ยนเป็น blur หรือ hr (noise หายไป) ให้ดำเนินต่อ
 
     # 3) กรณี DEM บอกว่าเป็น blur
     if kind == 'blur':
-        p = Path(_run_deblurgan(p))          # รัน DeblurGAN-v2 → ได้ภาพ deblur
-        kind, sigma = run_dem(p)             # ตรวจ DEM รอบสอง
+        tiles = (yield ('dem', run_dem_tiles, (img,))) if tiled else None
+        img = yield ('deblurgan', _run_deblurgan, (img, tiles))  # รัน DeblurGAN-v2 → ได้ภาพ deblur
+        route.append('deblurgan')
+        stage  = 'deblurgan:tile' if tiles is not None else 'deblurgan'
+        report = yield from _recheck(stage, report, img)   # ตรวจ DEM รอบสอง (หรือทำนาย)
+        kind, sigma = report.result()
         if kind == 'blur':
             # ถ้ายังเป็น blur จบ pipeline → ส่งเข้า FEM แล้ว return
-            p = Path(apply_fem(str(p)))
-            return str(p)
+            return (yield from _finish_steps(p, img, route))
         # ถ้าเปลี่ยนเป็น noise หรือ hr (blur หายไป) ให้ดำเนินต่อ
 
     # 4) กรณี DEM บอกว่าเป็น low-resolution (hr)
     if kind == 'hr':
-        p = Path(_run_edsr(p))               # รัน EDSR → ได้ภาพ super-resolved
-        p = Path(apply_fem(str(p)))          # ส่งเข้า FEM แล้ว return
+        img = yield ('edsr', _run_edsr, (img,))            # รัน EDSR → ได้ภาพ super-resolved
+        route.append('edsr')
+        return (yield from _finish_steps(p, img, route))   # ส่งเข้า FEM แล้ว return
 
+    # clean: ถ้ามี stage ที่รันไปแล้ว (เช่น FFDNet) เขียนผลลัพธ์โดยไม่ผ่าน FEM
+    if img is not original:
+        return (yield from _finish_steps(p, img, route, fem=False))
     return str(p)
+
+def run_steps(steps):
+    """รัน generator จาก arf_steps ทีละขั้นใน thread ปัจจุบัน คืนค่าที่ generator return"""
+    try:
+        _, fn, args = next(steps)
+        while True:
+            _, fn, args = steps.send(fn(*args))
+    except StopIteration as stop:
+        return stop.value
+
+def apply_arf(input_path: str, kind: str = None, sigma: float = None,
+              route: list = None) -> str:
+    """
+    Pipeline อัตโนมัติ:
+      1) DEM
+      2) ถ้าเจอ noise → FFDNet → DEM
+      3) ถ้าเจอ blur  → DeblurGAN-v2 → DEM
+      4) ถ้าเจอ low-res → EDSR
+      หลังจากขั้นตอนสุดท้าย (denoise/deblur/SR) ให้ส่งภาพเข้า FEM ตรวจสี
+
+    ภาพถูกถอดรหัสครั้งเดียว ส่งต่อระหว่าง stage เป็น array และเขียนไฟล์ผลลัพธ์
+    (PNG) ครั้งเดียวตอนจบ ถ้าไม่มี stage ไหนถูกรันจะคืน path เดิม
+
+    ถ้าส่ง list มาใน route จะบันทึกเส้นทางที่รันจริงลงไป เช่น
+    ['dem:noise', 'ffdnet', 'dem:hr', 'edsr', 'fem']
+    """
+    return run_steps(arf_steps(input_path, kind, sigma, route))
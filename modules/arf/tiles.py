@@ -0,0 +1,51 @@
+# modules/arf/tiles.py
+
+import numpy as np
+
+def _ramp(c0: int, c1: int, t0: int, t1: int, overlap: int) -> np.ndarray:
+    """
+    น้ำหนักตามแนวแกนเดียวของ crop [c0, c1): 1 ภายใน tile [t0, t1)
+    แล้วลดลงเชิงเส้นเป็น 0 ภายในระยะ overlap นอก tile (ส่วนที่เกินกว่านั้นเป็น context อย่างเดียว)
+    """
+    p    = np.arange(c0, c1, dtype=np.float32)
+    dist = np.maximum(t0 - p, 0) + np.maximum(p - (t1 - 1), 0)
+    return np.clip(1.0 - dist / (overlap + 1), 0.0, 1.0)
+
+def _expand(t0: int, t1: int, size: int, overlap: int, min_crop: int):
+    # ขยาย tile ออกไป overlap ทุกด้าน และให้ crop ยาวอย่างน้อย min_crop (ถ้าภาพใหญ่พอ)
+    # (DeblurGAN normalize ด้วยสถิติต่อภาพ แต่ backbone ย่อภาพหลายเท่า → crop เล็กมาก
+    #  feature ชั้นลึกเหลือ 1×1 คำนวณสถิติไม่ได้ หรือได้สถิติจากไม่กี่ pixel จนผลเพี้ยน)
+    c0, c1 = max(0, t0 - overlap), min(size, t1 + overlap)
+    need   = min(min_crop, size)
+    if c1 - c0 < need:
+        c0 = max(0, min((t0 + t1) // 2 - need // 2, size - need))
+        c1 = c0 + need
+    return c0, c1
+
+def restore_tiles(img: np.ndarray, mask: np.ndarray, tile: int, fn,
+                  overlap: int = 32, min_crop: int = 256) -> np.ndarray:
+    """
+    รัน fn(crop, row, col) → crop ที่ restore แล้ว (ขนาดเท่าเดิม) เฉพาะ tile ที่ mask เป็น True
+    แต่ละ crop มี context รอบ tile แล้วผสมกลับด้วยน้ำหนักที่ค่อย ๆ ลดลงในแถบ overlap
+    → ไม่มีรอยต่อ ส่วนที่ไม่อยู่ใกล้ tile ที่ถูกเลือกคัดลอกจากภาพเดิมตรง ๆ (bit-exact)
+    """
+    h, w = img.shape[:2]
+    acc  = np.zeros(img.shape, dtype=np.float32)
+    wsum = np.zeros((h, w, 1), dtype=np.float32)
+
+    for r, c in zip(*np.nonzero(mask)):
+        y0, x0 = r * tile, c * tile
+        y1, x1 = min(y0 + tile, h), min(x0 + tile, w)
+        cy0, cy1 = _expand(y0, y1, h, overlap, min_crop)
+        cx0, cx1 = _expand(x0, x1, w, overlap, min_crop)
+
+        out = fn(img[cy0:cy1, cx0:cx1], r, c)
+        wgt = np.outer(_ramp(cy0, cy1, y0, y1, overlap), _ramp(cx0, cx1, x0, x1, overlap))[..., None]
+        acc[cy0:cy1, cx0:cx1]  += out * wgt
+        wsum[cy0:cy1, cx0:cx1] += wgt
+
+    touched = wsum[..., 0] > 0
+    out = img.copy()
+    W   = np.minimum(wsum[touched], 1.0)
+    out[touched] = img[touched] * (1.0 - W) + (acc[touched] / wsum[touched]) * W
+    return out
@@ -0,0 +1,112 @@
+# modules/batching.py
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import torch
+
+class _Request:
+    __slots__ = ('x', 'extra', 'meta', 'future', 'arrived')
+
+    def __init__(self, x, extra, meta):
+        self.x       = x
+        self.extra   = extra
+        self.meta    = meta
+        self.future  = Future()
+        self.arrived = time.monotonic()
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching หน้าโมเดล 1 ตัว:
+    รวม request ที่เข้ามาภายใน max_wait_ms และอยู่ใน shape bucket เดียวกัน
+    (H, W ปัดขึ้นเป็นพหุคูณของ bucket) แล้วรัน forward ครั้งเดียวทั้ง batch
+    จากนั้นแยกผลลัพธ์คืนให้แต่ละ request
+
+    stage ต้องมี
+      prepare(img, *args) → (x: Tensor C×H×W, extra, meta)
+      forward(xb: Tensor N×C×H×W, extras: list) → Tensor N×C'×H'×W'
+      finish(y: Tensor C'×H'×W', meta) → img   (crop จากมุมซ้ายบน)
+    ส่วนที่ pad เพิ่มเพื่อเข้า bucket อยู่ขวา/ล่าง จึงถูก crop ทิ้งใน finish
+    """
+
+    def __init__(self, stage, max_batch: int = 4, max_wait_ms: float = 10,
+                 bucket: int = 64, max_batch_pixels: int = 4_000_000, name: str = ''):
+        self.stage            = stage
+        self.max_batch        = max_batch
+        self.max_wait         = max_wait_ms / 1000.0
+        self.bucket           = max(1, bucket)
+        self.max_batch_pixels = max_batch_pixels
+        self.batches          = 0
+        self.items            = 0
+        self._pending = OrderedDict()   # bucket key → [_Request]
+        self._cond    = threading.Condition()
+        self._thread  = threading.Thread(target=self._loop, name=f'batcher-{name}', daemon=True)
+        self._thread.start()
+
+    def __call__(self, img, *args):
+        x, extra, meta = self.stage.prepare(img, *args)
+        req = _Request(x, extra, meta)
+        c, h, w = x.shape
+        key = (c, self._round(h), self._round(w))
+        with self._cond:
+            self._pending.setdefault(key, []).append(req)
+            self._cond.notify()
+        return self.stage.finish(req.future.result(), meta)
+
+    def stats(self) -> dict:
+        with self._cond:
+            pending = sum(len(v) for v in self._pending.values())
+        return {
+            'batches':    self.batches,
+            'items':      self.items,
+            'avg_batch':  round(self.items / self.batches, 2) if self.batches else None,
+            'pending':    pending,
+        }
+
+    # ─── internal ───────────────────────────────────────────────────
+    def _round(self, n: int) -> int:
+        return int(math.ceil(n / self.bucket) * self.bucket)
+
+    def _limit(self, key) -> int:
+        _, h, w = key
+        return max(1, min(self.max_batch, self.max_batch_pixels // (h * w)))
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # bucket ที่มี request เก่าที่สุดได้รันก่อน
+            key   = min(self._pending, key=lambda k: self._pending[k][0].arrived)
+            limit = self._limit(key)
+            deadline = self._pending[key][0].arrived + self.max_wait
+            while len(self._pending[key]) < limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            reqs = self._pending[key][:limit]
+            del self._pending[key][:limit]
+            if not self._pending[key]:
+                del self._pending[key]
+            return key, reqs
+
+    def _loop(self):
+        while True:
+            (_, h, w), reqs = self._next_batch()
+            try:
+                xb = torch.stack([
+                    torch.nn.functional.pad(r.x[None], (0, w - r.x.shape[2], 0, h - r.x.shape[1]),
+                                            mode='replicate')[0]
+                    for r in reqs
+                ])
+                yb = self.stage.forward(xb, [r.extra for r in reqs])
+                for r, y in zip(reqs, yb):
+                    r.future.set_result(y)
+            except Exception as e:
+                for r in reqs:
+                    r.future.set_exception(e)
+            self.batches += 1
+            self.items   += len(reqs)
@@ -0,0 +1,150 @@
+# modules/dem/batch_dem.py
+#
+# DEM ทีละหลายพันไฟล์ใน process เดียว (แทนการเรียก dem.py ทีละไฟล์)
+#   python modules/dem/batch_dem.py <ภาพหรือโฟลเดอร์ ...> -o report.csv
+#   python modules/dem/batch_dem.py archive/ --format jsonl --workers 16 > report.jsonl
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    from .dem import analyze, learned_classifier, read_for_analysis
+except ImportError:   # รันเป็นสคริปต์
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from dem import analyze, learned_classifier, read_for_analysis
+
+IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.jpe', '.jfif', '.bmp', '.tif', '.tiff', '.webp'}
+
+FIELDS = ['path', 'width', 'height', 'sigma', 'lap_var', 'noise', 'blur', 'lowres',
+          'kind', 'plan', 'mode', 'decode_ms', 'analyze_ms', 'error']
+
+def iter_images(paths):
+    """ไฟล์ภาพจาก path ที่ระบุ (โฟลเดอร์จะค้นหาแบบ recursive)"""
+    for p in map(Path, paths):
+        if p.is_dir():
+            for root, _, files in os.walk(p):
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTS:
+                        yield Path(root) / name
+        else:
+            yield p
+
+def analyze_path(path, mode: str = None) -> dict:
+    """
+    DEM ของไฟล์เดียว คืน dict ตาม FIELDS (error แทนการ raise)
+    ถอดรหัสและคำนวณด้วย OpenCV ซึ่งปล่อย GIL → เรียกจากหลาย thread ได้
+    """
+    row = {'path': str(path)}
+    t0 = time.perf_counter()
+    gray = read_for_analysis(path, gray=True)
+    t1 = time.perf_counter()
+    if gray is None:
+        row['error'] = 'unreadable'
+        return row
+    report = analyze(gray, mode)
+    del gray
+    row.update(report.to_dict())
+    row['decode_ms']  = round((t1 - t0) * 1000, 2)
+    row['analyze_ms'] = round((time.perf_counter() - t1) * 1000, 2)
+    return row
+
+def _decode(path):
+    t0 = time.perf_counter()
+    gray = read_for_analysis(path, gray=True)
+    return gray, time.perf_counter() - t0
+
+def _analyze_learned(clf, paths, workers: int):
+    # ถอดรหัสทีละ chunk ด้วย thread pool แล้ว clf.analyze_many ครั้งเดียวต่อ chunk
+    # (feature ขนานใน analyze_many, MLP รันทั้ง chunk เป็น matrix เดียว)
+    chunk = workers * 2
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dem') as pool:
+        for start in range(0, len(paths), chunk):
+            part    = paths[start:start + chunk]
+            decoded = list(pool.map(_decode, part))
+            grays   = [g for g, _ in decoded if g is not None]
+            t0      = time.perf_counter()
+            reports = iter(clf.analyze_many(grays, workers) if grays else [])
+            per_img = (time.perf_counter() - t0) / max(len(grays), 1)
+            del grays
+            for path, (gray, t_decode) in zip(part, decoded):
+                row = {'path': str(path)}
+                if gray is None:
+                    row['error'] = 'unreadable'
+                else:
+                    row.update(next(reports).to_dict())
+                    row['decode_ms']  = round(t_decode * 1000, 2)
+                    row['analyze_ms'] = round(per_img * 1000, 2)   # เฉลี่ยต่อภาพใน chunk
+                yield row
+
+def analyze_many(paths, workers: int = None, mode: str = None):
+    """
+    DEM ของหลายไฟล์ด้วย thread pool — yield ผลตามลำดับ paths
+    ภาพที่ถอดรหัสค้างในหน่วยความจำมีไม่เกินจำนวน worker (+ คิวเล็กน้อย)
+    mode 'learned' (มีไฟล์ weight): ถอดรหัสทีละ chunk แล้วทำนายทั้ง chunk ในครั้งเดียว
+    """
+    workers = workers or os.cpu_count() or 4
+    clf = learned_classifier(mode)
+    if clf is not None:
+        yield from _analyze_learned(clf, paths, workers)
+        return
+    paths   = iter(paths)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dem') as pool:
+        pending = []
+        for path in paths:
+            pending.append(pool.submit(analyze_path, path, mode))
+            if len(pending) >= workers * 2:
+                yield pending.pop(0).result()
+        for fut in pending:
+            yield fut.result()
+
+def _writer(fmt: str, out):
+    if fmt == 'jsonl':
+        return lambda row: out.write(json.dumps(row, ensure_ascii=False) + '\n')
+    w = csv.DictWriter(out, fieldnames=FIELDS, extrasaction='ignore')
+    w.writeheader()
+    def _row(row):
+        row = dict(row)
+        if isinstance(row.get('plan'), list):
+            row['plan'] = '+'.join(row['plan'])
+        w.writerow(row)
+    return _row
+
+def main():
+    ap = argparse.ArgumentParser(description='Batch DEM triage → CSV / JSONL')
+    ap.add_argument('paths', nargs='+', help='ภาพหรือโฟลเดอร์')
+    ap.add_argument('-o', '--output', help='ไฟล์ผลลัพธ์ (ไม่ระบุ = stdout)')
+    ap.add_argument('--format', choices=('csv', 'jsonl'),
+                    help='ค่าเริ่มต้นตามนามสกุลของ --output (csv ถ้าไม่ระบุ)')
+    ap.add_argument('--workers', type=int, default=None, help='จำนวน thread (ค่าเริ่มต้น = จำนวน core)')
+    ap.add_argument('--mode', choices=('auto', 'full', 'fast', 'learned'), default=None)
+    args = ap.parse_args()
+
+    fmt = args.format or ('jsonl' if (args.output or '').endswith(('.jsonl', '.json')) else 'csv')
+    out = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    write = _writer(fmt, out)
+
+    counts = {}
+    t0 = time.perf_counter()
+    try:
+        for row in analyze_many(iter_images(args.paths), args.workers, args.mode):
+            write(row)
+            key = row.get('kind') or 'error'
+            counts[key] = counts.get(key, 0) + 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    total = sum(counts.values())
+    dt    = time.perf_counter() - t0
+    print(f"{total} images in {dt:.1f}s ({total / dt if dt else 0:.1f} img/s) — "
+          + ', '.join(f'{k}: {v}' for k, v in sorted(counts.items())), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
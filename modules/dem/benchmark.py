@@ -0,0 +1,301 @@
+# modules/dem/benchmark.py
+#
+# วัด accuracy / throughput ของ DEM ด้วย degradation สังเคราะห์ที่รู้คำตอบ
+# (noise หลายระดับ, motion/defocus blur, ย่อภาพ bicubic) จากภาพ clean
+#   python modules/dem/benchmark.py <ภาพ clean หรือโฟลเดอร์ ...>
+#   python modules/dem/benchmark.py --synthetic 8
+#   python modules/dem/benchmark.py --synthetic 8 --sweep noise_sigma=6:20:2 --sweep blur_lap=50:300:50
+#   python modules/dem/benchmark.py --synthetic 8 --cost ffdnet=1,deblurgan=4,edsr=8 --json bench.json
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from dem import (BLUR_LAP_THRESHOLD, HR_LAP_THRESHOLD, HR_MIN_SIDE, NOISE_SIGMA_THRESHOLD,
+                 analyze, degradation_flags)
+
+IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp'}
+
+KINDS = ('noise', 'blur', 'hr', 'clean')
+FLAGS = ('noise', 'blur', 'lowres')
+STAGE_OF_FLAG = {'noise': 'ffdnet', 'blur': 'deblurgan', 'lowres': 'edsr'}
+
+# ค่าใช้จ่ายสัมพัทธ์ของแต่ละโมเดล (ปรับด้วย --cost ตามเวลาจริงของเครื่อง)
+DEFAULT_COST = {'ffdnet': 1.0, 'deblurgan': 4.0, 'edsr': 8.0}
+
+# threshold ที่ sweep ได้ → ค่าปัจจุบันใน dem.py
+SWEEPABLE = {
+    'noise_sigma': NOISE_SIGMA_THRESHOLD,
+    'blur_lap':    BLUR_LAP_THRESHOLD,
+    'hr_lap':      HR_LAP_THRESHOLD,
+    'hr_min_side': HR_MIN_SIDE,
+}
+
+# ─── degradations ───────────────────────────────────────────────────
+def _noise(sigma):
+    def fn(img, rng):
+        return np.clip(img + rng.normal(0, sigma, img.shape), 0, 255).astype(np.uint8)
+    return fn
+
+def _motion(length):
+    def fn(img, rng):
+        k = np.zeros((length, length), np.float32)
+        k[length // 2, :] = 1.0
+        rot = cv2.getRotationMatrix2D((length / 2 - 0.5, length / 2 - 0.5), float(rng.uniform(0, 180)), 1.0)
+        k = cv2.warpAffine(k, rot, (length, length))
+        return cv2.filter2D(img, -1, k / k.sum())
+    return fn
+
+def _defocus(radius):
+    def fn(img, rng):
+        size = 2 * radius + 1
+        k = np.zeros((size, size), np.float32)
+        cv2.circle(k, (radius, radius), radius, 1.0, -1)
+        return cv2.filter2D(img, -1, k / k.sum())
+    return fn
+
+def _down(factor, restore=False):
+    def fn(img, rng):
+        h, w = img.shape[:2]
+        small = cv2.resize(img, (max(1, round(w / factor)), max(1, round(h / factor))),
+                           interpolation=cv2.INTER_CUBIC)
+        return cv2.resize(small, (w, h), interpolation=cv2.INTER_CUBIC) if restore else small
+    return fn
+
+# (ชื่อ, flag ที่ถูกต้อง, sigma ที่เติม, ฟังก์ชัน) — ภาพที่ด้านสั้นน้อยกว่า HR_MIN_SIDE นับเป็น lowres เสมอ
+DEGRADATIONS = [
+    ('clean',     set(),       None, lambda img, rng: img),
+    ('noise5',    set(),       5,    _noise(5)),
+    ('noise15',   {'noise'},   15,   _noise(15)),
+    ('noise25',   {'noise'},   25,   _noise(25)),
+    ('noise40',   {'noise'},   40,   _noise(40)),
+    ('motion9',   {'blur'},    None, _motion(9)),
+    ('motion21',  {'blur'},    None, _motion(21)),
+    ('defocus3',  {'blur'},    None, _defocus(3)),
+    ('defocus6',  {'blur'},    None, _defocus(6)),
+    ('down2',     {'lowres'},  None, _down(2)),
+    ('down4',     {'lowres'},  None, _down(4)),
+    ('down3up',   {'lowres'},  None, _down(3, restore=True)),
+]
+
+# ─── inputs ─────────────────────────────────────────────────────────
+def _images(paths):
+    for p in map(Path, paths):
+        if p.is_dir():
+            yield from sorted(f for f in p.rglob('*') if f.suffix.lower() in IMAGE_EXTS)
+        else:
+            yield p
+
+def _synthetic_clean(n: int, megapixels: float, seed: int = 0):
+    """ภาพ clean สังเคราะห์ (สี่เหลี่ยม/วงกลมขอบคม ไม่มี noise) — DEM ตัดสินเป็น clean"""
+    rng = np.random.default_rng(seed)
+    w   = int((megapixels * 1e6 * 1.5) ** 0.5)
+    h   = int(w / 1.5)
+    for i in range(n):
+        img = np.full((h, w, 3), 128, np.uint8)
+        for _ in range(h * w // 320):
+            color = tuple(int(v) for v in rng.integers(0, 256, 3))
+            x, y  = int(rng.integers(0, w)), int(rng.integers(0, h))
+            s     = int(rng.integers(3, 40))
+            if rng.random() < 0.5:
+                cv2.rectangle(img, (x, y), (x + s, y + int(rng.integers(3, 40))), color, -1)
+            else:
+                cv2.circle(img, (x, y), s // 2 + 1, color, -1)
+        yield f'synthetic_{i:02d}', img
+
+# ─── run ────────────────────────────────────────────────────────────
+def _kind(flags) -> str:
+    """route หลักตามลำดับเดียวกับ DEMReport.kind"""
+    for flag, kind in (('noise', 'noise'), ('blur', 'blur'), ('lowres', 'hr')):
+        if flag in flags:
+            return kind
+    return 'clean'
+
+def run(samples, mode: str = None, seed: int = 0) -> list:
+    """
+    สร้างทุก degradation ของทุกภาพ แล้วรัน DEM
+    คืน list ของ dict: ภาพ, degradation, flag ที่ถูกต้อง, sigma จริง, ค่าที่ DEM วัดได้, เวลา
+    """
+    rng  = np.random.default_rng(seed)
+    rows = []
+    for name, img in samples:
+        clean_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        for deg, truth, sigma, fn in DEGRADATIONS:
+            out  = fn(img, rng)
+            gray = cv2.cvtColor(out, cv2.COLOR_BGR2GRAY) if out.ndim == 3 else out
+            h, w = gray.shape
+            truth = set(truth) | ({'lowres'} if min(h, w) < HR_MIN_SIDE else set())
+
+            t0 = time.perf_counter()
+            report = analyze(gray, mode)
+            elapsed = time.perf_counter() - t0
+
+            row = {
+                'image': name, 'degradation': deg, 'truth': sorted(truth), 'truth_kind': _kind(truth),
+                'sigma_added': sigma, 'sigma_gray': None,
+                'sigma': report.sigma, 'lap_var': report.lap_var, 'height': h, 'width': w,
+                'kind': report.kind, 'pred': [f for f in FLAGS if getattr(report, f)],
+                'mode': report.mode, 'analyze_ms': elapsed * 1000,
+            }
+            if sigma is not None:
+                # noise ที่เติมต่อ channel เฉลี่ยลงเมื่อแปลงเป็น grayscale → DEM ควรประมาณค่านี้
+                row['sigma_gray'] = float(np.std(gray.astype(np.float32) - clean_gray.astype(np.float32)))
+            rows.append(row)
+    return rows
+
+def score(rows: list, thresholds: dict = None, cost: dict = None) -> dict:
+    """
+    ประเมิน routing จากค่าที่วัดไว้แล้ว (ไม่ต้องวิเคราะห์ภาพใหม่)
+    ไม่ระบุ thresholds = ใช้ flag ที่ DEM ตัดสินจริง, ระบุ = คำนวณ flag ใหม่ด้วย threshold นั้น
+    (sweep ใช้ได้กับ heuristic DEM เท่านั้น — mode learned ไม่ได้ใช้ threshold เหล่านี้)
+      confusion : truth kind → predicted kind → จำนวน
+      flags     : precision / recall ของแต่ละ flag
+      wasted    : ค่าใช้จ่ายรวมของ stage ที่รันโดยไม่จำเป็น
+      missed    : จำนวน stage ที่จำเป็นแต่ไม่ได้รัน
+    """
+    thresholds = thresholds or {}
+    cost       = {**DEFAULT_COST, **(cost or {})}
+    confusion  = {t: {p: 0 for p in KINDS} for t in KINDS}
+    tp = {f: 0 for f in FLAGS}
+    fp = {f: 0 for f in FLAGS}
+    fn = {f: 0 for f in FLAGS}
+    wasted = needed = 0.0
+    missed = 0
+
+    for r in rows:
+        if thresholds:
+            pred = {f for f, v in zip(FLAGS, degradation_flags(r['sigma'], r['lap_var'], r['height'],
+                                                               r['width'], **thresholds)) if v}
+        else:
+            pred = set(r['pred'])
+        truth = set(r['truth'])
+        confusion[r['truth_kind']][_kind(pred)] += 1
+        for f in FLAGS:
+            tp[f] += f in pred and f in truth
+            fp[f] += f in pred and f not in truth
+            fn[f] += f not in pred and f in truth
+        wasted += sum(cost[STAGE_OF_FLAG[f]] for f in pred - truth)
+        needed += sum(cost[STAGE_OF_FLAG[f]] for f in truth)
+        missed += len(truth - pred)
+
+    correct = sum(confusion[k][k] for k in KINDS)
+    return {
+        'n':         len(rows),
+        'accuracy':  correct / len(rows) if rows else 0.0,
+        'confusion': confusion,
+        'flags': {
+            f: {'precision': tp[f] / (tp[f] + fp[f]) if tp[f] + fp[f] else None,
+                'recall':    tp[f] / (tp[f] + fn[f]) if tp[f] + fn[f] else None}
+            for f in FLAGS
+        },
+        'wasted_cost': wasted,
+        'needed_cost': needed,
+        'missed':      missed,
+    }
+
+def _parse_sweep(spec: str):
+    """'noise_sigma=6:20:2' → ('noise_sigma', [6, 8, ..., 20])"""
+    name, _, rng = spec.partition('=')
+    if name not in SWEEPABLE:
+        raise argparse.ArgumentTypeError(f"sweep ได้เฉพาะ {', '.join(SWEEPABLE)}")
+    start, stop, step = (float(v) for v in rng.split(':'))
+    return name, [round(v, 6) for v in np.arange(start, stop + step / 2, step)]
+
+def _parse_cost(spec: str) -> dict:
+    cost = {}
+    for item in filter(None, (s.strip() for s in spec.split(','))):
+        name, _, v = item.partition('=')
+        cost[name.strip()] = float(v)
+    return cost
+
+# ─── report ─────────────────────────────────────────────────────────
+def _fmt(v):
+    return '   -' if v is None else f'{v:.2f}'
+
+def _print_report(rows: list, s: dict):
+    print(f"{'confusion (truth ↓ / DEM →)':<30}" + ''.join(f'{k:>8}' for k in KINDS))
+    for t in KINDS:
+        print(f'{t:<30}' + ''.join(f'{s["confusion"][t][p]:>8}' for p in KINDS))
+    print()
+    print(f"{'flag':<10}{'precision':>10}{'recall':>8}")
+    for f in FLAGS:
+        print(f"{f:<10}{_fmt(s['flags'][f]['precision']):>10}{_fmt(s['flags'][f]['recall']):>8}")
+    print()
+
+    print(f"{'degradation':<14}{'n':>4}{'correct':>9}{'sigma':>8}{'lap_var':>10}")
+    for deg, *_ in DEGRADATIONS:
+        sub = [r for r in rows if r['degradation'] == deg]
+        if sub:
+            ok = sum(r['kind'] == r['truth_kind'] for r in sub)
+            print(f"{deg:<14}{len(sub):>4}{ok:>9}{np.median([r['sigma'] for r in sub]):>8.2f}"
+                  f"{np.median([r['lap_var'] for r in sub]):>10.1f}")
+    print()
+
+    noisy = [r for r in rows if r['sigma_gray'] is not None]
+    if noisy:
+        err = np.array([r['sigma'] - r['sigma_gray'] for r in noisy])
+        print(f"sigma error (vs gray) : mean |err| {np.abs(err).mean():.2f}  bias {err.mean():+.2f}  "
+              f"max |err| {np.abs(err).max():.2f}")
+        for sigma in sorted({r['sigma_added'] for r in noisy}):
+            sub = [r for r in noisy if r['sigma_added'] == sigma]
+            print(f"  added {sigma:>4}  → gray {np.mean([r['sigma_gray'] for r in sub]):6.2f}"
+                  f"  DEM {np.mean([r['sigma'] for r in sub]):6.2f}")
+
+    total_s = sum(r['analyze_ms'] for r in rows) / 1000
+    mpix    = sum(r['height'] * r['width'] for r in rows) / 1e6
+    print(f"route accuracy        : {s['accuracy'] * 100:.1f}% ({s['n']} images)")
+    print(f"cost wasted / needed  : {s['wasted_cost']:.1f} / {s['needed_cost']:.1f}  (missed stages: {s['missed']})")
+    print(f"throughput            : {len(rows) / total_s:.1f} img/s, {mpix / total_s:.1f} MP/s")
+
+def _print_sweep(rows: list, name: str, values: list, cost: dict):
+    print()
+    print(f"sweep {name} (current {SWEEPABLE[name]})")
+    print(f"{'value':>10}{'accuracy':>10}" + ''.join(f'{f + " P/R":>14}' for f in FLAGS)
+          + f"{'wasted':>9}{'missed':>8}")
+    for v in values:
+        s = score(rows, {name: v}, cost)
+        pr = ''.join(f"{_fmt(s['flags'][f]['precision']) + '/' + _fmt(s['flags'][f]['recall']):>14}"
+                     for f in FLAGS)
+        print(f"{v:>10g}{s['accuracy'] * 100:>9.1f}%{pr}{s['wasted_cost']:>9.1f}{s['missed']:>8}")
+
+def main():
+    ap = argparse.ArgumentParser(description='DEM routing accuracy / throughput on synthetic degradations')
+    ap.add_argument('paths', nargs='*', help='ภาพ clean หรือโฟลเดอร์')
+    ap.add_argument('--synthetic', type=int, default=0, help='จำนวนภาพ clean สังเคราะห์')
+    ap.add_argument('--megapixels', type=float, default=2, help='ขนาดภาพสังเคราะห์')
+    ap.add_argument('--mode', choices=('auto', 'full', 'fast', 'learned'), default=None)
+    ap.add_argument('--sweep', type=_parse_sweep, action='append', default=[],
+                    help='name=start:stop:step (name: ' + ', '.join(SWEEPABLE) + ')')
+    ap.add_argument('--cost', type=_parse_cost, default={}, help='ค่าใช้จ่ายต่อ stage เช่น ffdnet=1,deblurgan=4,edsr=8')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--json', help='บันทึกผลทุกภาพ + สรุปลงไฟล์ JSON')
+    args = ap.parse_args()
+
+    samples = []
+    for path in _images(args.paths):
+        img = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        if img is not None:
+            samples.append((path.name, img))
+    if args.synthetic:
+        samples.extend(_synthetic_clean(args.synthetic, args.megapixels, args.seed))
+    if not samples:
+        sys.exit('ไม่มีภาพให้วัด (ระบุ path ของภาพ clean หรือ --synthetic N)')
+
+    rows    = run(samples, args.mode, args.seed)
+    summary = score(rows, cost=args.cost)
+    _print_report(rows, summary)
+    for name, values in args.sweep:
+        _print_sweep(rows, name, values, args.cost)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'rows': rows}, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
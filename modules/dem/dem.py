@@ -1,8 +1,11 @@
 # modules/dem/dem.py
 
+import os
 import sys
+import json
 import cv2
 import numpy as np
+from dataclasses import asdict, dataclass
 from pathlib import Path
 import math
 
@@ -10,49 +13,356 @@ import math
 # Calibration factor: convert MAD estimate to Gaussian σ
 CALIBRATION_FACTOR = math.sqrt(math.pi / 2) * 1.5  # ≈1.2533
 
+# Routing thresholds
+NOISE_SIGMA_THRESHOLD = 12    # sigma >  12   → noise
+BLUR_LAP_THRESHOLD    = 100   # lap_var < 100 → blur
+HR_LAP_THRESHOLD      = 1200  # lap_var < 1200 → low-res
+HR_MIN_SIDE           = 721   # min(h, w) < 721 → low-res
+
+# Fast mode: ภาพใหญ่ประมาณ sigma / lap_var จาก tile ที่สุ่มแบบ stratified
+# (จำนวน tile คงที่ → เวลาคงที่ไม่ขึ้นกับขนาดภาพ)
+DEM_MODE        = os.environ.get('ARF_DEM_MODE', 'auto')   # auto | full | fast | learned
+FAST_MIN_PIXELS = 4_000_000   # auto: ภาพใหญ่กว่านี้ใช้ fast mode
+FAST_TILE       = 64          # ขนาด tile (px)
+FAST_TILES      = 144         # จำนวน tile (12×12 grid ≈ 0.6 MP)
+
+# Tile map: แบ่งภาพเป็น tile ขนาด TILE_SIZE แล้ววัด sigma / lap_var ต่อ tile
+TILE_SIZE     = 256
+TILE_FLAT_STD = 4.0   # tile ที่ std ต่ำกว่านี้เป็นพื้นเรียบ (ท้องฟ้า, ผนัง) → ไม่นับเป็น blur
+
+# Noise map: sigma ต่อ block สำหรับ noise map ของ FFDNet (ช่วงที่ FFDNet รองรับคือ 0–75)
+NOISE_MAP_BLOCK = 32
+NOISE_MAP_MAX   = 75.0
+
+THRESHOLDS = {
+    'calibration_factor': CALIBRATION_FACTOR,
+    'noise_sigma':        NOISE_SIGMA_THRESHOLD,
+    'blur_lap_var':       BLUR_LAP_THRESHOLD,
+    'hr_lap_var':         HR_LAP_THRESHOLD,
+    'hr_min_side':        HR_MIN_SIDE,
+    'dem_mode':           DEM_MODE,
+    'fast_min_pixels':    FAST_MIN_PIXELS,
+    'fast_tile':          FAST_TILE,
+    'fast_tiles':         FAST_TILES,
+    'decode':             'color→gray',
+    'tile_size':          TILE_SIZE,
+    'tile_flat_std':      TILE_FLAT_STD,
+    'noise_map_block':    NOISE_MAP_BLOCK,
+    'noise_map_max':      NOISE_MAP_MAX,
+}
+
+# ───────── analysis decode ──────────────────────────────────────────
+JPEG_EXTS = {'.jpg', '.jpeg', '.jpe', '.jfif'}
+
+_REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+def to_gray(img: np.ndarray, rgb: bool = False) -> np.ndarray:
+    """
+    ภาพ uint8 → grayscale ที่ DEM ทุกทางใช้ (ไฟล์ใน /batch และ array ใน /process)
+    รับ BGR จาก cv2.imread (rgb=True: ภาพ RGB), H×W×1 หรือ H×W
+    แปลงด้วย cv2.cvtColor เท่านั้น → ภาพเดียวกันได้ gray เดียวกันไม่ว่ามาทางไหน
+    (IMREAD_GRAYSCALE ของ JPEG อ่าน luma ตรงจาก decoder ค่าต่างจากนี้เล็กน้อย → route อาจต่างกัน)
+    """
+    if img.ndim == 2:
+        return img
+    if img.shape[2] == 1:
+        return img[..., 0]
+    return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY if rgb else cv2.COLOR_BGR2GRAY)
+
+def read_for_analysis(img_path, scale: int = 1, gray: bool = False):
+    """
+    อ่านภาพเพื่อคำนวณสถิติเท่านั้น (ไม่ใช่ภาพสำหรับ restore)
+      gray=True : ถอดรหัสสีแล้วแปลงด้วย to_gray (เหมือน DEM ของ array ใน pipeline)
+      scale 2/4/8 : JPEG ถอดรหัสที่ 1/scale ใน DCT domain (cv2.IMREAD_REDUCED_*)
+                    format อื่นถอดรหัสเต็มแล้วเลือกทุก ๆ scale pixel (strided)
+    ใช้ scale > 1 ได้เฉพาะค่าที่ไม่ขึ้นกับความละเอียด เช่นค่าเฉลี่ยสี
+    (noise sigma / lap_var ต้องใช้ scale=1)
+    คืน uint8 BGR หรือ gray, None ถ้าอ่านไม่ได้
+    """
+    path = str(img_path)
+    img = None
+    if scale > 1 and Path(path).suffix.lower() in JPEG_EXTS:
+        img = cv2.imread(path, _REDUCED_FLAGS[scale])
+    if img is None:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is not None and scale > 1:
+            img = img[::scale, ::scale]
+    if img is None or not gray:
+        return img
+    return to_gray(img)
+
 # ───────── helper ───────────────────────────────────────────────────
+# คำนวณด้วย OpenCV ทั้งหมด (ปล่อย GIL ระหว่างคำนวณ → รันหลาย thread พร้อมกันได้จริง
+# และไม่ต้องสร้างสำเนา float ของภาพทั้งภาพ)
 def variance_of_laplacian(gray: np.ndarray) -> float:
-    return cv2.Laplacian(gray, cv2.CV_64F).var()
+    _, std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_64F))
+    return float(std[0, 0]) ** 2
 
 def estimate_noise(gray: np.ndarray) -> float:
     """Return calibrated noise sigma by Median Absolute Deviation (MAD)."""
     H = cv2.medianBlur(gray, 3)
-    mad = np.mean(np.abs(gray.astype(np.float32) - H))
+    mad = cv2.mean(cv2.absdiff(gray, H))[0]
     return mad * CALIBRATION_FACTOR
 
-# ───────── main ──────────────────────────────────────────────────────
-def main(img_path: str):
+def sample_tiles(gray: np.ndarray, tile: int = FAST_TILE, n_tiles: int = FAST_TILES,
+                 seed: int = 0):
+    """
+    สุ่มตำแหน่งหนึ่ง tile ต่อช่องของ grid (stratified) ด้วย seed คงที่ → ผลลัพธ์ซ้ำได้
+    yield patch ขนาด (tile+2)×(tile+2) (เผื่อขอบ 1 px ให้ filter 3×3 ตรงกับการคำนวณบนภาพเต็ม)
+    """
+    h, w  = gray.shape
+    t     = tile + 2
+    side  = max(1, int(math.ceil(math.sqrt(n_tiles))))
+    rng   = np.random.default_rng(seed)
+    span_y, span_x = max(0, h - t), max(0, w - t)
+    for i in range(side):
+        for j in range(side):
+            y = int(i * span_y / side + rng.random() * span_y / side)
+            x = int(j * span_x / side + rng.random() * span_x / side)
+            yield gray[y:y + t, x:x + t]
+
+def sampled_metrics(gray: np.ndarray, tile: int = FAST_TILE, n_tiles: int = FAST_TILES,
+                    seed: int = 0):
+    """
+    ประมาณ (sigma, lap_var) จาก tile ขนาด tile×tile จำนวน n_tiles (sample_tiles)
+    """
+    mad_sum = lap_sum = lap_sq = 0.0
+    count = 0
+    for patch in sample_tiles(gray, tile, n_tiles, seed):
+        inner = patch[1:-1, 1:-1]
+        med   = cv2.medianBlur(patch, 3)[1:-1, 1:-1]
+        lap   = cv2.Laplacian(patch, cv2.CV_64F)[1:-1, 1:-1]
+        mad_sum += float(np.abs(inner.astype(np.float32) - med).sum())
+        lap_sum += float(lap.sum())
+        lap_sq  += float(np.square(lap).sum())
+        count   += inner.size
+
+    mean_lap = lap_sum / count
+    return mad_sum / count * CALIBRATION_FACTOR, lap_sq / count - mean_lap * mean_lap
+
+# ───────── report ────────────────────────────────────────────────────
+@dataclass(frozen=True)
+class DEMReport:
+    """
+    ผลของ DEM ครบทุกค่าจากการวิเคราะห์ครั้งเดียว
+      sigma   : noise sigma (MAD × CALIBRATION_FACTOR)
+      lap_var : variance of Laplacian
+      height, width
+      noise / blur / lowres : flag ของแต่ละ degradation (ไม่หยุดที่ตัวแรกที่เจอ)
+      mode    : 'full' (ทั้งภาพ), 'fast' (สุ่ม tile) หรือ 'learned' (learned.DEMClassifier)
+    """
+    sigma:   float
+    lap_var: float
+    height:  int
+    width:   int
+    noise:   bool
+    blur:    bool
+    lowres:  bool
+    mode:    str = 'full'
+
+    @property
+    def kind(self) -> str:
+        """route หลักตามลำดับเดิม noise → blur → hr → clean"""
+        if self.noise:
+            return 'noise'
+        if self.blur:
+            return 'blur'
+        if self.lowres:
+            return 'hr'
+        return 'clean'
+
+    @property
+    def plan(self) -> list:
+        """
+        stage ที่คาดว่าต้องรันทั้งหมดจาก flag ของรอบนี้ เช่น ['ffdnet', 'edsr', 'fem']
+        เป็นข้อมูลประกอบ: arf_steps เลือก stage จาก kind และ DEM รอบหลังแต่ละ stage
+        """
+        stages = [name for flag, name in ((self.noise, 'ffdnet'), (self.blur, 'deblurgan'),
+                                          (self.lowres, 'edsr')) if flag]
+        return stages + ['fem'] if stages else []
+
+    def result(self):
+        """(kind, sigma) แบบเดิมของ classify/detect"""
+        return self.kind, (round(self.sigma, 1) if self.noise else None)
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), 'kind': self.kind, 'plan': self.plan}
+
+def _learned_classifier():
+    try:
+        from .learned import get_classifier
+    except ImportError:   # รันเป็นสคริปต์
+        from learned import get_classifier
+    return get_classifier()
+
+def learned_classifier(mode: str = None):
+    """
+    learned.DEMClassifier เมื่อ mode (ค่าเริ่มต้น DEM_MODE) เป็น 'learned' และมีไฟล์ weight
+    ไม่เช่นนั้น None → ผู้เรียกที่มีหลายภาพใช้ analyze_many ของมัน (MLP ครั้งเดียวทั้ง batch)
+    """
+    return _learned_classifier() if (mode or DEM_MODE) == 'learned' else None
+
+def analyze(gray: np.ndarray, mode: str = None) -> DEMReport:
+    """
+    วิเคราะห์ภาพ grayscale (uint8) ครั้งเดียว คืน DEMReport ที่มีทุกค่า
+    mode: 'full' | 'fast' | 'auto' (ค่าเริ่มต้น DEM_MODE: fast เมื่อภาพใหญ่กว่า FAST_MIN_PIXELS)
+          | 'learned' (learned.DEMClassifier ถ้ามีไฟล์ weight ไม่เช่นนั้นใช้ auto)
+    """
+    h, w = gray.shape
+    mode = mode or DEM_MODE
+    if mode == 'learned':
+        clf = _learned_classifier()
+        if clf is not None:
+            return clf.analyze(gray)
+        mode = 'auto'
+    if mode == 'auto':
+        mode = 'fast' if h * w > FAST_MIN_PIXELS else 'full'
+    if mode == 'fast' and min(h, w) > FAST_TILE + 2:
+        sigma, lap_var = sampled_metrics(gray)
+    else:
+        mode    = 'full'
+        sigma   = float(estimate_noise(gray))
+        lap_var = float(variance_of_laplacian(gray))
+    noise, blur, lowres = degradation_flags(sigma, lap_var, h, w)
+    return DEMReport(sigma=sigma, lap_var=lap_var, height=h, width=w, mode=mode,
+                     noise=noise, blur=blur, lowres=lowres)
+
+def degradation_flags(sigma: float, lap_var: float, height: int, width: int,
+                      noise_sigma: float = None, blur_lap: float = None,
+                      hr_lap: float = None, hr_min_side: int = None):
+    """
+    (noise, blur, lowres) จากค่าที่วัดได้ — threshold ที่ไม่ระบุใช้ค่าคงที่ของโมดูล
+    (benchmark ใช้ sweep threshold โดยไม่ต้องวิเคราะห์ภาพใหม่)
+    """
+    noise_sigma = NOISE_SIGMA_THRESHOLD if noise_sigma is None else noise_sigma
+    blur_lap    = BLUR_LAP_THRESHOLD    if blur_lap    is None else blur_lap
+    hr_lap      = HR_LAP_THRESHOLD      if hr_lap      is None else hr_lap
+    hr_min_side = HR_MIN_SIDE           if hr_min_side is None else hr_min_side
+    return (
+        sigma > noise_sigma,
+        lap_var < blur_lap,
+        # low-res: min(width, height) < 721 หรือ lap_var < 1200
+        min(height, width) < hr_min_side or lap_var < hr_lap,
+    )
+
+def analyze_file(img_path: str):
+    """อ่านไฟล์แล้ว analyze คืน None ถ้าไม่มีไฟล์หรืออ่านไม่ได้"""
     if not Path(img_path).is_file():
-        print("clean None")
-        return
+        return None
+    # DEM ต้องใช้ความละเอียดเต็ม; grayscale จาก to_gray เหมือน run_dem ของ array
+    gray = read_for_analysis(img_path, gray=True)
+    return None if gray is None else analyze(gray)
 
-    img       = cv2.imread(img_path, cv2.IMREAD_COLOR)
-    gray      = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    h, w      = gray.shape
+# ───────── tile map ──────────────────────────────────────────────────
+@dataclass(frozen=True)
+class DEMTileMap:
+    """
+    ค่า DEM ต่อ tile (array ขนาด rows × cols) — tile ขอบขวา/ล่างอาจเล็กกว่า tile
+      sigma   : noise sigma ของแต่ละ tile (MAD × CALIBRATION_FACTOR)
+      lap_var : variance of Laplacian ของแต่ละ tile
+      std     : ส่วนเบี่ยงเบนมาตรฐานของความสว่าง (แยกพื้นเรียบออกจากภาพเบลอ)
+    """
+    tile:    int
+    sigma:   np.ndarray
+    lap_var: np.ndarray
+    std:     np.ndarray
 
-    # 1) noise detection (MAD)
-    sigma_est = estimate_noise(gray)
-    if sigma_est > 12:
-        print(f"noise {sigma_est:.1f}")
-        return
+    @property
+    def shape(self):
+        return self.sigma.shape
 
-    # 2) blur detection (Variance of Laplacian)
-    lap_var = variance_of_laplacian(gray)
-    if lap_var < 100:
-        print("blur None")
-        return
+    @property
+    def noise(self) -> np.ndarray:
+        return self.sigma > NOISE_SIGMA_THRESHOLD
 
-    # 3) low-res detection
-    #    - ถ้า min(width, height) < 720 → low-res
-    #    - หรือภาพเบลอมาก (lap_var < 50) แต่เราตรวจ blur ที่ <100 ไปแล้ว
-    if min(h, w) < 721 or lap_var < 1200:
-        print("hr None")
-        return
+    @property
+    def blur(self) -> np.ndarray:
+        return (self.lap_var < BLUR_LAP_THRESHOLD) & (self.std >= TILE_FLAT_STD)
+
+    def to_dict(self) -> dict:
+        return {
+            'tile':    self.tile,
+            'sigma':   np.round(self.sigma, 2).tolist(),
+            'lap_var': np.round(self.lap_var, 1).tolist(),
+            'noise':   self.noise.tolist(),
+            'blur':    self.blur.tolist(),
+        }
+
+def _block_sums(a: np.ndarray, tile: int) -> np.ndarray:
+    h, w = a.shape
+    s = np.add.reduceat(a, np.arange(0, h, tile), axis=0, dtype=np.float64)
+    return np.add.reduceat(s, np.arange(0, w, tile), axis=1, dtype=np.float64)
+
+def _block_counts(shape, tile: int) -> np.ndarray:
+    # จำนวน pixel ต่อ block (block ขอบขวา/ล่างอาจเล็กกว่า)
+    h, w = shape
+    return np.outer(np.diff(np.append(np.arange(0, h, tile), h)),
+                    np.diff(np.append(np.arange(0, w, tile), w))).astype(np.float64)
+
+def tile_map(gray: np.ndarray, tile: int = TILE_SIZE) -> DEMTileMap:
+    """
+    วัด sigma / lap_var ต่อ tile ของภาพ grayscale (uint8) ด้วยสูตรเดียวกับ
+    estimate_noise / variance_of_laplacian (คำนวณทั้งภาพครั้งเดียวแล้วรวมต่อ block)
+    """
+    counts = _block_counts(gray.shape, tile)
 
-    # 4) clean (no noise, no blur, no low-res)
-    print("clean None")
+    mad = _block_sums(cv2.absdiff(gray, cv2.medianBlur(gray, 3)), tile) / counts
+
+    lap      = cv2.Laplacian(gray, cv2.CV_64F)
+    lap_mean = _block_sums(lap, tile) / counts
+    lap_var  = _block_sums(lap * lap, tile) / counts - lap_mean ** 2
+    del lap
+
+    g      = gray.astype(np.float32)
+    g_mean = _block_sums(g, tile) / counts
+    g_var  = _block_sums(g * g, tile) / counts - g_mean ** 2
+
+    return DEMTileMap(tile=tile, sigma=mad * CALIBRATION_FACTOR,
+                      lap_var=np.maximum(lap_var, 0), std=np.sqrt(np.maximum(g_var, 0)))
+
+def noise_map(gray: np.ndarray, block: int = NOISE_MAP_BLOCK) -> np.ndarray:
+    """
+    noise sigma เฉพาะที่ (0–255) ต่อ block ขนาด block×block ของภาพ grayscale (uint8)
+    = MAD ต่อ block × CALIBRATION_FACTOR (สูตรเดียวกับ estimate_noise)
+    แล้ว median 3×3 บน grid ของ block ลดค่าที่สูงเกินจริงจากขอบวัตถุ
+    คืน float32 array ขนาด ceil(H / block) × ceil(W / block)
+    """
+    counts = _block_counts(gray.shape, block)
+    mad    = _block_sums(cv2.absdiff(gray, cv2.medianBlur(gray, 3)), block) / counts
+    sigma  = (mad * CALIBRATION_FACTOR).astype(np.float32)
+    if min(sigma.shape) >= 3:
+        sigma = cv2.medianBlur(sigma, 3)
+    return np.clip(sigma, 0.0, NOISE_MAP_MAX)
+
+# ───────── detection ─────────────────────────────────────────────────
+def detect(img_path: str):
+    """
+    ตรวจ degradation ของไฟล์ภาพ คืนค่า (kind, sigma) เช่น ('noise', 15.2) หรือ ('blur', None)
+    """
+    report = analyze_file(img_path)
+    return ('clean', None) if report is None else report.result()
+
+def classify(gray: np.ndarray):
+    """
+    ตรวจ degradation ของภาพ grayscale (uint8) ตามลำดับ noise → blur → low-res
+    คืนค่า (kind, sigma) เช่น ('noise', 15.2) หรือ ('blur', None)
+    """
+    return analyze(gray).result()
+
+# ───────── main ──────────────────────────────────────────────────────
+def main(img_path: str, as_json: bool = False):
+    if as_json:
+        report = analyze_file(img_path)
+        print(json.dumps(None if report is None else report.to_dict()))
+        return
+    kind, sigma = detect(img_path)
+    if sigma is None:
+        print(f"{kind} None")
+    else:
+        print(f"{kind} {sigma:.1f}")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        sys.exit("usage: dem.py <image_path>")
-    main(sys.argv[1])
+    args = [a for a in sys.argv[1:] if a != '--json']
+    if not args:
+        sys.exit("usage: dem.py [--json] <image_path>")
+    main(args[0], as_json='--json' in sys.argv[1:])
@@ -0,0 +1,106 @@
+# modules/dem/fast_accuracy.py
+#
+# วัดความแม่นของ DEM fast mode (สุ่ม tile) เทียบกับการคำนวณบนภาพเต็ม
+#   python modules/dem/fast_accuracy.py <ภาพหรือโฟลเดอร์ ...>
+#   python modules/dem/fast_accuracy.py --synthetic 24          # ภาพสังเคราะห์ 24MP
+#   python modules/dem/fast_accuracy.py --tiles 64 --tile 48 <...>
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from dem import FAST_TILE, FAST_TILES, analyze, estimate_noise, sampled_metrics, variance_of_laplacian
+
+IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp'}
+
+def _images(paths):
+    for p in map(Path, paths):
+        if p.is_dir():
+            yield from sorted(f for f in p.rglob('*') if f.suffix.lower() in IMAGE_EXTS)
+        else:
+            yield p
+
+def _synthetic(n: int, megapixels: float, seed: int = 0):
+    """ภาพสังเคราะห์ขนาด megapixels: texture + noise/blur หลายระดับ"""
+    rng = np.random.default_rng(seed)
+    w   = int((megapixels * 1e6 * 1.5) ** 0.5)
+    h   = int(w / 1.5)
+    for i in range(n):
+        small = rng.random((h // 32 + 1, w // 32 + 1), dtype=np.float32) * 255
+        base  = cv2.resize(small, (w, h), interpolation=cv2.INTER_CUBIC)
+        fine  = cv2.GaussianBlur(rng.random((h, w), dtype=np.float32) * 255, (0, 0), 1.5)
+        img   = 0.6 * base + 0.4 * fine
+        blur  = (0, 1, 2, 4)[i % 4]
+        noise = (0, 5, 15, 30)[(i // 4) % 4]
+        if blur:
+            img = cv2.GaussianBlur(img, (0, 0), blur)
+        if noise:
+            img = img + rng.normal(0, noise, img.shape).astype(np.float32)
+        yield f'synthetic_{i:02d}_blur{blur}_noise{noise}', np.clip(img, 0, 255).astype(np.uint8)
+
+def compare(gray: np.ndarray, tile: int, n_tiles: int) -> dict:
+    t0 = time.perf_counter()
+    sigma_full, lap_full = estimate_noise(gray), variance_of_laplacian(gray)
+    t_full = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    sigma_fast, lap_fast = sampled_metrics(gray, tile, n_tiles)
+    t_fast = time.perf_counter() - t0
+
+    return {
+        'sigma_full': float(sigma_full), 'sigma_fast': float(sigma_fast),
+        'lap_full':   float(lap_full),   'lap_fast':   float(lap_fast),
+        'kind_full':  analyze(gray, 'full').kind,
+        'kind_fast':  analyze(gray, 'fast').kind if (tile, n_tiles) == (FAST_TILE, FAST_TILES) else None,
+        't_full': t_full, 't_fast': t_fast,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description='DEM fast mode vs full-resolution accuracy')
+    ap.add_argument('paths', nargs='*', help='ภาพหรือโฟลเดอร์')
+    ap.add_argument('--synthetic', type=int, default=0, help='จำนวนภาพสังเคราะห์')
+    ap.add_argument('--megapixels', type=float, default=24, help='ขนาดภาพสังเคราะห์')
+    ap.add_argument('--tile', type=int, default=FAST_TILE)
+    ap.add_argument('--tiles', type=int, default=FAST_TILES)
+    args = ap.parse_args()
+
+    samples = []
+    for path in _images(args.paths):
+        gray = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+        if gray is not None:
+            samples.append((path.name, gray))
+    samples = iter(samples)
+    if args.synthetic:
+        samples = (s for src in (samples, _synthetic(args.synthetic, args.megapixels)) for s in src)
+
+    rows = []
+    print(f"{'image':<34}{'MP':>6}{'sigma full':>11}{'fast':>8}{'lap full':>11}{'fast':>10}"
+          f"{'kind':>14}{'speedup':>9}")
+    for name, gray in samples:
+        r = compare(gray, args.tile, args.tiles)
+        rows.append(r)
+        kind = r['kind_full'] if r['kind_fast'] in (None, r['kind_full']) else f"{r['kind_full']}≠{r['kind_fast']}"
+        print(f"{name[:33]:<34}{gray.size / 1e6:>6.1f}{r['sigma_full']:>11.2f}{r['sigma_fast']:>8.2f}"
+              f"{r['lap_full']:>11.1f}{r['lap_fast']:>10.1f}{kind:>14}{r['t_full'] / r['t_fast']:>8.1f}x")
+
+    if not rows:
+        sys.exit('ไม่มีภาพให้วัด (ระบุ path หรือ --synthetic N)')
+
+    sigma_err = np.array([abs(r['sigma_fast'] - r['sigma_full']) for r in rows])
+    lap_rel   = np.array([abs(r['lap_fast'] - r['lap_full']) / max(r['lap_full'], 1e-9) for r in rows])
+    agree     = [r['kind_fast'] == r['kind_full'] for r in rows if r['kind_fast'] is not None]
+    print()
+    print(f"images            : {len(rows)}")
+    print(f"sigma abs error   : mean {sigma_err.mean():.3f}  max {sigma_err.max():.3f}")
+    print(f"lap_var rel error : mean {lap_rel.mean() * 100:.2f}%  max {lap_rel.max() * 100:.2f}%")
+    if agree:
+        print(f"route agreement   : {sum(agree)}/{len(agree)}")
+    print(f"time full / fast  : {sum(r['t_full'] for r in rows):.3f}s / {sum(r['t_fast'] for r in rows):.3f}s")
+
+if __name__ == '__main__':
+    main()
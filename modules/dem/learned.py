@@ -0,0 +1,164 @@
+# modules/dem/learned.py
+#
+# DEM แบบ learned (ทางเลือก): MLP ขนาดเล็กบน feature ราคาถูกของภาพ
+# ทำนาย noise / blur / low-res พร้อมกัน (รวม degradation ที่ซ้อนกัน) และ sigma สำหรับ FFDNet
+# ในครั้งเดียว → DEMReport.plan ได้ทุก stage ตั้งแต่ DEM รอบแรก
+# (plan เป็นข้อมูลประกอบ: arf_steps ยังตรวจ DEM ซ้ำหลัง FFDNet / DeblurGAN — ข้ามได้ด้วย planner)
+# หลายภาพ (batch_dem.py, /batch) → analyze_many: MLP ครั้งเดียวทั้ง chunk
+#
+# weight อยู่ใน models/dem_classifier.npz (สร้างด้วย train_classifier.py)
+# inference ใช้ numpy ล้วน รันแบบ batch บน CPU ได้ใน ~ms
+
+import math
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+try:
+    from .dem import (FAST_MIN_PIXELS, HR_MIN_SIDE, DEMReport, estimate_noise,
+                      sample_tiles, sampled_metrics, variance_of_laplacian)
+except ImportError:   # รันเป็นสคริปต์
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from dem import (FAST_MIN_PIXELS, HR_MIN_SIDE, DEMReport, estimate_noise,
+                     sample_tiles, sampled_metrics, variance_of_laplacian)
+
+MODEL_PATH = Path(os.environ.get('ARF_DEM_MODEL',
+                                 Path(__file__).resolve().parent / 'models' / 'dem_classifier.npz'))
+
+FEATURE_TILE  = 128   # tile สำหรับ feature หลายสเกลและ FFT
+FEATURE_TILES = 16
+
+# ขอบของ band ความถี่ (cycles/pixel) สำหรับสัดส่วนพลังงาน FFT
+FFT_BANDS = (0.0, 0.0625, 0.125, 0.25, 0.5)
+
+FEATURE_NAMES = [
+    'sigma', 'log_lap_var',
+    'log_lap_s1', 'log_lap_s2', 'log_lap_s4',
+    *[f'log_fft_b{i}' for i in range(len(FFT_BANDS) - 1)],
+    'log_min_side', 'log_std',
+]
+
+OUTPUTS = ('noise', 'blur', 'lowres')
+SIGMA_SCALE = 50.0   # output sigma ของ MLP ถูก normalize ด้วยค่านี้ตอน train
+
+# ─── features ───────────────────────────────────────────────────────
+def _radial_bands(size: int) -> np.ndarray:
+    # index ของ band (0..len-2) ต่อความถี่ใน rfft2 ของ tile ขนาด size×size, -1 = DC
+    fy = np.fft.fftfreq(size)[:, None]
+    fx = np.fft.rfftfreq(size)[None, :]
+    r  = np.sqrt(fy * fy + fx * fx)
+    band = np.digitize(r, FFT_BANDS[1:-1])
+    band[r > FFT_BANDS[-1]] = len(FFT_BANDS) - 2
+    band[0, 0] = -1
+    return band
+
+_BANDS  = _radial_bands(FEATURE_TILE)
+_WINDOW = np.outer(np.hanning(FEATURE_TILE), np.hanning(FEATURE_TILE)).astype(np.float32)
+
+def features(gray: np.ndarray) -> np.ndarray:
+    """
+    feature vector (float32, ตาม FEATURE_NAMES) ของภาพ grayscale (uint8)
+      sigma / lap_var : ค่าเดียวกับ DEM (ภาพใหญ่ใช้ tile ที่สุ่ม)
+      lap_s1/s2/s4    : lap_var ของ tile ที่ย่อ 1, 1/2, 1/4 เท่า (blur vs low-res)
+      fft_b*          : สัดส่วนพลังงานในแต่ละ band ความถี่ (noise = ความถี่สูงมาก)
+      min_side, std   : ขนาดภาพและ contrast
+    """
+    h, w = gray.shape
+    if h * w > FAST_MIN_PIXELS:
+        sigma, lap_var = sampled_metrics(gray)
+    else:
+        sigma, lap_var = float(estimate_noise(gray)), float(variance_of_laplacian(gray))
+
+    lap   = np.zeros(3)
+    power = np.zeros(len(FFT_BANDS) - 1)
+    std   = 0.0
+    n     = 0
+    for patch in sample_tiles(gray, FEATURE_TILE, FEATURE_TILES):
+        t = patch[1:-1, 1:-1]
+        if t.shape != (FEATURE_TILE, FEATURE_TILE):
+            continue
+        level = t
+        for s in range(3):
+            lap[s] += cv2.Laplacian(level, cv2.CV_64F).var()
+            level = cv2.pyrDown(level)
+        f = t.astype(np.float32)
+        std += float(f.std())
+        spec = np.abs(np.fft.rfft2((f - f.mean()) * _WINDOW)) ** 2
+        valid = _BANDS >= 0
+        power += np.bincount(_BANDS[valid], weights=spec[valid], minlength=len(power))
+        n += 1
+
+    if n:
+        lap   /= n
+        power /= max(power.sum(), 1e-12)
+        std   /= n
+    return np.array([
+        sigma, math.log1p(max(lap_var, 0.0)),
+        *np.log1p(lap),
+        *np.log(power + 1e-6),
+        math.log(min(h, w) / HR_MIN_SIDE), math.log1p(std),
+    ], dtype=np.float32)
+
+# ─── classifier ─────────────────────────────────────────────────────
+class DEMClassifier:
+    """
+    MLP 2 ชั้นซ่อน (ReLU) → 3 logit (noise, blur, lowres) + sigma
+    weight ใน .npz: mean, std (normalize feature), w0, b0, w1, b1, w2, b2, features
+    """
+
+    def __init__(self, path=MODEL_PATH):
+        data = np.load(path)
+        if 'features' in data and list(data['features']) != FEATURE_NAMES:
+            raise ValueError(f'{path}: feature ไม่ตรงกับ learned.FEATURE_NAMES (train ใหม่ด้วย train_classifier.py)')
+        self.path   = Path(path)
+        self.mean   = data['mean']
+        self.std    = data['std']
+        self.layers = [(data[f'w{i}'], data[f'b{i}']) for i in range(3)]
+
+    def predict(self, X: np.ndarray):
+        """X: N×F → (prob N×3 ตาม OUTPUTS, sigma N)"""
+        h = (np.atleast_2d(X) - self.mean) / self.std
+        for i, (w, b) in enumerate(self.layers):
+            h = h @ w + b
+            if i < len(self.layers) - 1:
+                h = np.maximum(h, 0.0)
+        prob  = 1.0 / (1.0 + np.exp(-h[:, :3]))
+        sigma = np.maximum(h[:, 3] * SIGMA_SCALE, 0.0)
+        return prob, sigma
+
+    def _report(self, gray: np.ndarray, x: np.ndarray, prob: np.ndarray, sigma: float) -> DEMReport:
+        h, w = gray.shape
+        return DEMReport(
+            sigma=float(sigma), lap_var=float(math.expm1(x[1])), height=h, width=w,
+            noise=bool(prob[0] > 0.5), blur=bool(prob[1] > 0.5), lowres=bool(prob[2] > 0.5),
+            mode='learned',
+        )
+
+    def analyze(self, gray: np.ndarray) -> DEMReport:
+        x = features(gray)
+        prob, sigma = self.predict(x)
+        return self._report(gray, x, prob[0], sigma[0])
+
+    def analyze_many(self, grays, workers: int = None) -> list:
+        """feature ของทุกภาพแบบขนาน (OpenCV/numpy ปล่อย GIL) แล้ว MLP ครั้งเดียวทั้ง batch"""
+        grays = list(grays)
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4) as pool:
+            X = np.stack(list(pool.map(features, grays)))
+        prob, sigma = self.predict(X)
+        return [self._report(g, x, p, s) for g, x, p, s in zip(grays, X, prob, sigma)]
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+def get_classifier():
+    """DEMClassifier ตัวเดียวทั้ง process หรือ None ถ้ายังไม่มีไฟล์ weight"""
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None and MODEL_PATH.exists():
+            _classifier = DEMClassifier(MODEL_PATH)
+        return _classifier
@@ -0,0 +1,160 @@
+# modules/dem/train_classifier.py
+#
+# train learned DEM (learned.DEMClassifier) บน degradation สังเคราะห์
+# (noise / blur / low-res ซ้อนกันแบบสุ่ม) แล้วบันทึก weight เป็น .npz
+#   python modules/dem/train_classifier.py --synthetic 40
+#   python modules/dem/train_classifier.py <ภาพ clean หรือโฟลเดอร์ ...> --per-image 40
+#   ARF_DEM_MODE=learned python orchestrator/app.py       # ใช้งาน
+
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from benchmark import _defocus, _down, _images, _motion, _noise, _synthetic_clean
+from dem import HR_MIN_SIDE, degradation_flags
+from learned import FEATURE_NAMES, MODEL_PATH, OUTPUTS, SIGMA_SCALE, features
+
+NOISE_LABEL_SIGMA = 10   # sigma ที่เติม (ต่อ channel) ตั้งแต่ค่านี้ขึ้นไปนับเป็น noise
+
+def _degrade(img: np.ndarray, rng):
+    """
+    สุ่ม degradation ซ้อนกันตามลำดับที่เกิดจริง: ย่อภาพ → เบลอ → noise ของ sensor
+    คืน (ภาพ, set ของ flag ที่ถูกต้อง, sigma ที่เติม)
+    """
+    truth, sigma = set(), 0.0
+    if rng.random() < 0.35:
+        img = _down(float(rng.uniform(1.5, 4.0)), restore=rng.random() < 0.5)(img, rng)
+        truth.add('lowres')
+    if rng.random() < 0.4:
+        if rng.random() < 0.5:
+            img = _motion(int(rng.integers(7, 26)))(img, rng)
+        else:
+            img = _defocus(int(rng.integers(2, 8)))(img, rng)
+        truth.add('blur')
+    if rng.random() < 0.45:
+        sigma = float(rng.uniform(0, 50))
+        img   = _noise(sigma)(img, rng)
+        if sigma >= NOISE_LABEL_SIGMA:
+            truth.add('noise')
+    if min(img.shape[:2]) < HR_MIN_SIDE:
+        truth.add('lowres')
+    return img, truth, sigma
+
+def _bases(paths, n_synthetic: int, seed: int):
+    for path in _images(paths):
+        img = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        if img is not None:
+            yield path.name, img
+    rng = np.random.default_rng(seed)
+    for i in range(n_synthetic):
+        # ขนาดสุ่ม → มีทั้งภาพที่ด้านสั้นน้อยและมากกว่า HR_MIN_SIDE
+        yield from _synthetic_clean(1, float(rng.uniform(0.3, 3.0)), seed + i)
+
+def build_dataset(paths, n_synthetic: int, per_image: int, seed: int = 0, workers: int = None):
+    """คืน (X: N×F, Y: N×3 ตาม OUTPUTS, S: N sigma ที่เติม)"""
+    rng = np.random.default_rng(seed)
+    X, Y, S = [], [], []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for name, img in _bases(paths, n_synthetic, seed):
+            samples = [_degrade(img, rng) for _ in range(per_image)]
+            grays   = [cv2.cvtColor(s[0], cv2.COLOR_BGR2GRAY) for s in samples]
+            X.extend(pool.map(features, grays))
+            Y.extend([[f in truth for f in OUTPUTS] for _, truth, _ in samples])
+            S.extend([sigma for _, _, sigma in samples])
+            print(f'{name}: {len(X)} samples', file=sys.stderr)
+    return np.stack(X), np.array(Y, dtype=np.float32), np.array(S, dtype=np.float32)
+
+def train(X, Y, S, hidden: int = 32, epochs: int = 2000, lr: float = 3e-3, seed: int = 0):
+    """MLP (F → hidden → hidden → 3 logit + sigma) full-batch Adam"""
+    torch.manual_seed(seed)
+    mean, std = X.mean(0), X.std(0) + 1e-6
+    x = torch.from_numpy((X - mean) / std)
+    y = torch.from_numpy(Y)
+    s = torch.from_numpy(S / SIGMA_SCALE)
+
+    net = torch.nn.Sequential(
+        torch.nn.Linear(X.shape[1], hidden), torch.nn.ReLU(),
+        torch.nn.Linear(hidden, hidden), torch.nn.ReLU(),
+        torch.nn.Linear(hidden, len(OUTPUTS) + 1),
+    )
+    opt = torch.optim.Adam(net.parameters(), lr=lr, weight_decay=1e-4)
+    for epoch in range(epochs):
+        out  = net(x)
+        loss = (torch.nn.functional.binary_cross_entropy_with_logits(out[:, :3], y)
+                + torch.nn.functional.mse_loss(out[:, 3], s))
+        opt.zero_grad()
+        loss.backward()
+        opt.step()
+        if epoch % 500 == 0 or epoch == epochs - 1:
+            print(f'epoch {epoch:5d}  loss {loss.item():.4f}', file=sys.stderr)
+
+    linears = [m for m in net if isinstance(m, torch.nn.Linear)]
+    weights = {'mean': mean, 'std': std, 'features': np.array(FEATURE_NAMES)}
+    for i, m in enumerate(linears):
+        weights[f'w{i}'] = m.weight.detach().numpy().T.copy()
+        weights[f'b{i}'] = m.bias.detach().numpy().copy()
+    return weights
+
+def evaluate(clf, X, Y, S):
+    """ความแม่นของ learned DEM เทียบกับ heuristic DEM (threshold ใน dem.py) บนชุด holdout"""
+    prob, sigma = clf.predict(X)
+    pred = prob > 0.5
+    # heuristic: ใช้ sigma / lap_var / ขนาดภาพจาก feature เดียวกัน
+    min_side = np.exp(X[:, FEATURE_NAMES.index('log_min_side')]) * HR_MIN_SIDE
+    heur = np.array([degradation_flags(x[0], np.expm1(x[1]), m, m) for x, m in zip(X, min_side)])
+    truth = Y > 0.5
+
+    print(f"{'flag':<10}{'learned':>10}{'heuristic':>11}")
+    for i, f in enumerate(OUTPUTS):
+        print(f"{f:<10}{(pred[:, i] == truth[:, i]).mean() * 100:>9.1f}%{(heur[:, i] == truth[:, i]).mean() * 100:>10.1f}%")
+    print(f"{'all flags':<10}{(pred == truth).all(1).mean() * 100:>9.1f}%{(heur == truth).all(1).mean() * 100:>10.1f}%")
+    noisy = S >= NOISE_LABEL_SIGMA
+    if noisy.any():
+        print(f"sigma MAE (noisy): learned {np.abs(sigma[noisy] - S[noisy]).mean():.2f}  "
+              f"heuristic {np.abs(X[noisy, 0] - S[noisy]).mean():.2f}")
+
+    t0 = time.perf_counter()
+    for _ in range(100):
+        clf.predict(X)
+    print(f"MLP batch of {len(X)}: {(time.perf_counter() - t0) * 10:.2f} ms")
+
+def main():
+    ap = argparse.ArgumentParser(description='Train the learned DEM classifier on synthetic degradations')
+    ap.add_argument('paths', nargs='*', help='ภาพ clean หรือโฟลเดอร์')
+    ap.add_argument('--synthetic', type=int, default=0, help='จำนวนภาพ clean สังเคราะห์')
+    ap.add_argument('--per-image', type=int, default=24, help='จำนวน degradation ต่อภาพ clean')
+    ap.add_argument('--holdout', type=float, default=0.2)
+    ap.add_argument('--epochs', type=int, default=2000)
+    ap.add_argument('--hidden', type=int, default=32)
+    ap.add_argument('--workers', type=int, default=None)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('-o', '--output', default=str(MODEL_PATH))
+    args = ap.parse_args()
+
+    if not args.paths and not args.synthetic:
+        sys.exit('ไม่มีภาพ (ระบุ path ของภาพ clean หรือ --synthetic N)')
+
+    X, Y, S = build_dataset(args.paths, args.synthetic, args.per_image, args.seed, args.workers)
+    idx   = np.random.default_rng(args.seed).permutation(len(X))
+    n_val = int(len(X) * args.holdout)
+    val, tr = idx[:n_val], idx[n_val:]
+
+    weights = train(X[tr], Y[tr], S[tr], args.hidden, args.epochs, seed=args.seed)
+    out = Path(args.output)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(out, **weights)
+    print(f'saved {out} ({len(tr)} train / {len(val)} holdout samples)')
+
+    if n_val:
+        from learned import DEMClassifier
+        evaluate(DEMClassifier(out), X[val], Y[val], S[val])
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,13 @@
 # modules/fem/run_fem.py
 
 import os
-import shutil
 import uuid
 import subprocess
 import sys
 from pathlib import Path
-from PIL import Image
 import numpy as np
+from ..dem.dem import read_for_analysis
+from ..model_host import BACKEND, get_host, load_image, save_image, scratch_dir
 
 # ─── PATH SETUP ─────────────────────────────────────────────────────
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
@@ -16,67 +16,82 @@ MODEL_DIR    = FEM_ROOT / 'models'
 RESULT_DIR   = FEM_ROOT / 'result_images'
 UPLOAD_DIR   = PROJECT_ROOT / 'static' / 'uploads'
 
+# gray-world ใช้แค่ค่าเฉลี่ยสี → อ่านไฟล์ที่ 1/8 ของความละเอียดพอ
+ANALYSIS_SCALE = 8
+
 # Ensure folders exist
 RESULT_DIR.mkdir(parents=True, exist_ok=True)
 
 def clear_results():
-    """ลบไฟล์เก่าใน result_images ก่อนรันใหม่"""
+    """
+    ลบไฟล์เก่าใน result_images (ใช้ร่วมกันทุก request — run_awb ไม่ใช้โฟลเดอร์นี้แล้ว
+    จึงไม่ควรเรียกระหว่างที่มี request อื่นรันอยู่)
+    """
     for f in RESULT_DIR.iterdir():
         if f.is_file():
             f.unlink()
 
-def is_color_distorted(img_path: Path, threshold: float = 0.1) -> bool:
+def is_color_distorted(img, threshold: float = 0.1) -> bool:
     """
     ตรวจ color distortion แบบ Gray-world assumption:
     |Rmean-Gmean|/Gmean หรือ |Bmean-Gmean|/Gmean > threshold → เพี้ยน
+    img เป็น path ของไฟล์ หรือ ndarray RGB (H×W×3) ก็ได้
+    ถ้าเป็น path จะถอดรหัสแบบย่อ (JPEG: DCT 1/8, อื่น ๆ: strided) เพราะใช้แค่ค่าเฉลี่ย
     """
-    img = Image.open(img_path).convert('RGB')
-    arr = np.array(img).astype(np.float32)
+    if isinstance(img, np.ndarray):
+        arr = img
+    else:
+        bgr = read_for_analysis(img, scale=ANALYSIS_SCALE)
+        if bgr is None:
+            raise FileNotFoundError(f"อ่านไฟล์ภาพไม่ได้: {img}")
+        arr = bgr[..., ::-1]
     # ถ้า grayscale ข้ามเลย
     if arr.ndim != 3 or arr.shape[2] != 3:
         return False
-    means = arr.reshape(-1, 3).mean(axis=0)
+    means = arr.reshape(-1, 3).mean(axis=0, dtype=np.float64)
     r, g, b = means
     return (abs(r-g)/g > threshold) or (abs(b-g)/g > threshold)
 
+def run_awb(img: np.ndarray) -> np.ndarray:
+    """
+    แก้ white balance ของภาพ float32 RGB [0, 1] แล้วคืนภาพใหม่
+    (ModelHost หรือ demo_single_image.py --task awb ถ้า ARF_BACKEND=subprocess)
+    """
+    if BACKEND == 'host':
+        return get_host().white_balance(img)
+
+    # แต่ละ request ใช้โฟลเดอร์ชั่วคราวของตัวเอง → รัน AWB พร้อมกันหลาย request ได้
+    with scratch_dir('fem') as tmp:
+        inp = save_image(tmp / 'fem.png', img)
+        cmd = [
+            sys.executable,
+            str(FEM_ROOT / 'demo_single_image.py'),
+            '--model_dir', str(MODEL_DIR),
+            '--input',      inp,
+            '--output_dir', str(tmp),
+            '--task',       'awb',
+            '--save'
+        ]
+        subprocess.check_call(cmd, cwd=str(FEM_ROOT))
+
+        # หาไฟล์ AWB
+        awb_files = list(tmp.glob(f"{Path(inp).stem}_AWB.*"))
+        if not awb_files:
+            raise FileNotFoundError(f"ไม่พบผลลัพธ์ AWB ใน {tmp}")
+        return load_image(awb_files[0])
+
 def apply_fem(input_fp: str) -> str:
     """
-    1) ล้างโฟลเดอร์ result_images
-    2) ตรวจ distortion
-    3) ถ้าเพี้ยน → เรียก demo_single_image.py (--task awb) เพื่อสร้าง <stem>_AWB.png
-    4) คัดลอก AWB ผลลัพธ์ไป static/uploads/ ด้วยชื่อใหม่มี uuid
-    5) คืนพาธไฟล์สุดท้าย
+    1) ตรวจ distortion
+    2) ถ้าเพี้ยน → รัน AWB (run_awb)
+    3) เขียนผลลัพธ์ไป static/uploads/ ด้วยชื่อใหม่มี uuid
+    4) คืนพาธไฟล์สุดท้าย
     """
     inp = Path(input_fp)
-    clear_results()
 
-    # 2) ตรวจสีเพี้ยน
+    # 1) ตรวจสีเพี้ยน (ถอดรหัสแบบย่อ) — ถอดรหัสเต็มเฉพาะเมื่อต้องแก้ AWB
     if not is_color_distorted(inp):
         return str(inp)
 
-    # 3) รัน AWB
-    cmd = [
-        sys.executable,
-        str(FEM_ROOT / 'demo_single_image.py'),
-        '--model_dir', str(MODEL_DIR),
-        '--input',      str(inp),
-        '--output_dir', str(RESULT_DIR),
-        '--task',       'awb',
-        '--save'
-    ]
-    subprocess.check_call(cmd, cwd=str(FEM_ROOT))
-
-    # 4) หาไฟล์ AWB
-    stem = inp.stem
-    awb_files = list(RESULT_DIR.glob(f"{stem}_AWB.*"))
-    if not awb_files:
-        raise FileNotFoundError(f"ไม่พบผลลัพธ์ AWB ใน {RESULT_DIR}")
-    awb_fp = awb_files[0]
-
-    # คัดลอกไป static/uploads พร้อม uuid
-    ext        = awb_fp.suffix
-    final_name = f"{stem}_awb_{uuid.uuid4().hex[:6]}{ext}"
-    dest       = UPLOAD_DIR / final_name
-    shutil.copy(awb_fp, dest)
-
-    return str(dest)
+    dest = UPLOAD_DIR / f"{inp.stem}_awb_{uuid.uuid4().hex[:6]}.png"
+    return save_image(dest, run_awb(load_image(inp)))
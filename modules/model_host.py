@@ -0,0 +1,434 @@
+# modules/model_host.py
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import torch
+import yaml
+from PIL import Image
+
+from .batching import MicroBatcher
+
+# ─── PATH SETUP ─────────────────────────────────────────────────────
+PROJECT_ROOT   = Path(__file__).resolve().parents[1]
+ARF_ROOT       = PROJECT_ROOT / 'modules' / 'arf'
+FFDNET_DIR     = ARF_ROOT / 'ffdnet'
+DEBLURGAN_DIR  = ARF_ROOT / 'deblurganv2'
+EDSR_DIR       = ARF_ROOT / 'edsr'
+EDSR_MODEL_DIR = ARF_ROOT / 'experiment' / 'model'
+FEM_ROOT       = PROJECT_ROOT / 'modules' / 'fem'
+FEM_MODEL_DIR  = FEM_ROOT / 'models'
+
+# 'host'       = ใช้โมเดลที่โหลดค้างไว้ใน process (ค่าเริ่มต้น)
+# 'subprocess' = เรียกสคริปต์ของแต่ละโมเดลแยก process แบบเดิม
+BACKEND = os.environ.get('ARF_BACKEND', 'host')
+
+EDSR_SCALE = 3  # เปลี่ยนเป็น 4 ถ้าต้องการ x4 (ต้องมี EDSR_x4.pt)
+
+# micro-batching หน้าโมเดล ARF (ARF_BATCH_MAX=1 = ปิด, รันทีละ request)
+BATCHING = {
+    'max_batch':        int(os.environ.get('ARF_BATCH_MAX', 4)),
+    'max_wait_ms':      float(os.environ.get('ARF_BATCH_WAIT_MS', 10)),
+    'bucket':           int(os.environ.get('ARF_BATCH_BUCKET', 64)),
+    'max_batch_pixels': int(float(os.environ.get('ARF_BATCH_MAX_MPIX', 4)) * 1_000_000),
+}
+
+# โฟลเดอร์ชั่วคราวต่อ request ของ subprocess backend (ว่าง = temp dir ของระบบ)
+SCRATCH_ROOT = os.environ.get('ARF_SCRATCH_DIR') or None
+
+# ไฟล์ weight/config ที่แต่ละ stage ใช้ (ไฟล์ที่ไม่มีอยู่จะถูกข้าม)
+WEIGHT_FILES = {
+    'ffdnet':    [FFDNET_DIR / 'models' / 'net_rgb.pth', FFDNET_DIR / 'models' / 'net_gray.pth'],
+    'deblurgan': [DEBLURGAN_DIR / 'fpn_inception.h5', DEBLURGAN_DIR / 'config' / 'config.yaml'],
+    'edsr':      [EDSR_MODEL_DIR / f'EDSR_x{EDSR_SCALE}.pt'],
+    'awb':       [FEM_MODEL_DIR / 'net_awb.pth', FEM_MODEL_DIR / 'net.pth'],
+}
+
+# ─── IMAGE HELPERS ──────────────────────────────────────────────────
+# ทุก stage รับ/คืนภาพเป็น float32 ช่วง [0, 1] ขนาด H×W×3 (RGB)
+# หรือ H×W×1 สำหรับภาพขาวดำจริง (load_image(keep_gray=True)) → stage ที่มีแต่โมเดล RGB
+# ขยายเป็น 3 channel เฉพาะใน tensor ที่ส่งเข้าโมเดล แล้วรวมกลับเป็น channel เดียว
+
+def is_gray(img: np.ndarray) -> bool:
+    """ภาพ 1 channel หรือทั้งสาม channel เท่ากันทุก pixel"""
+    return img.shape[2] == 1 or (np.array_equal(img[..., 0], img[..., 1])
+                                 and np.array_equal(img[..., 2], img[..., 1]))
+
+def load_image(path, keep_gray: bool = False) -> np.ndarray:
+    """อ่านไฟล์ภาพ → float32 RGB [0, 1] (keep_gray: ภาพขาวดำจริงคืนเป็น H×W×1)"""
+    bgr = cv2.imread(str(path), cv2.IMREAD_COLOR)
+    if bgr is None:
+        raise FileNotFoundError(f"อ่านไฟล์ภาพไม่ได้: {path}")
+    if keep_gray and is_gray(bgr):
+        return bgr[..., :1].astype(np.float32) / 255.0
+    return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0
+
+def match_channels(out: np.ndarray, ref: np.ndarray) -> np.ndarray:
+    """ผลของโมเดล RGB จากภาพ H×W×1 → เฉลี่ยกลับเป็น channel เดียวให้ตรงกับภาพเข้า"""
+    if ref.shape[2] == 1 and out.shape[2] != 1:
+        return out.mean(axis=2, keepdims=True, dtype=np.float32)
+    return out
+
+def to_uint8(img: np.ndarray) -> np.ndarray:
+    """float [0, 1] → uint8 [0, 255] (ปัดเศษ)"""
+    return np.clip(img * 255.0 + 0.5, 0, 255).astype(np.uint8)
+
+def save_image(path, img: np.ndarray) -> str:
+    """เขียน float32 RGB (หรือ H×W×1) [0, 1] ลงไฟล์ (นามสกุลไฟล์กำหนด format)"""
+    if img.shape[2] == 1:
+        cv2.imwrite(str(path), to_uint8(img[..., 0]))
+    else:
+        cv2.imwrite(str(path), cv2.cvtColor(to_uint8(img), cv2.COLOR_RGB2BGR))
+    return str(path)
+
+@contextmanager
+def scratch_dir(tag: str):
+    """
+    โฟลเดอร์ทำงานชั่วคราวของ request เดียว (เช่น input/output ของ EDSR, AWB)
+    ลบทิ้งทั้งโฟลเดอร์เมื่อออกจาก with ไม่ว่าจะสำเร็จหรือ error
+    → หลาย request รันสคริปต์เดียวกันพร้อมกันได้โดยไม่ทับไฟล์กัน
+    """
+    path = Path(tempfile.mkdtemp(prefix=f'arf_{tag}_', dir=SCRATCH_ROOT))
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+_import_lock = threading.RLock()
+
+@contextmanager
+def _isolated_import(src_dir: Path, names):
+    """
+    import โค้ดของโมเดลแต่ละตัวซึ่งใช้ flat import (เช่น `from models import FFDNet`)
+    โดยใส่ src_dir ไว้หน้า sys.path ชั่วคราว และซ่อน module ชื่อซ้ำ
+    (ffdnet/models.py กับ deblurganv2/models/) ไม่ให้ชนกันใน sys.modules
+    """
+    def _owned(mod_name):
+        return any(mod_name == n or mod_name.startswith(n + '.') for n in names)
+
+    # sys.path / sys.modules ใช้ร่วมกันทั้ง process → โหลดโมเดลพร้อมกันหลาย thread
+    # (เช่นตอน warm-up) ต้องสลับ import ทีละตัว
+    with _import_lock:
+        saved = {k: sys.modules.pop(k) for k in list(sys.modules) if _owned(k)}
+        sys.path.insert(0, str(src_dir))
+        try:
+            yield
+        finally:
+            sys.path.remove(str(src_dir))
+            for k in [k for k in sys.modules if _owned(k)]:
+                del sys.modules[k]
+            sys.modules.update(saved)
+
+# ─── STAGES ─────────────────────────────────────────────────────────
+# stage ของ ARF แยกเป็น prepare → forward → finish เพื่อให้ MicroBatcher
+# รวมหลาย request เป็น batch เดียวได้ (__call__ = รันทีละภาพ)
+
+class _BatchableStage:
+    batchable   = True
+    thread_safe = True   # eval mode, ไม่มี state → เรียกพร้อมกันหลาย thread ได้
+    bucket      = None   # None = ARF_BATCH_BUCKET; stage ที่ padding เปลี่ยนผลกำหนดเอง
+
+    def __call__(self, img: np.ndarray, *args) -> np.ndarray:
+        x, extra, meta = self.prepare(img, *args)
+        return self.finish(self.forward(x[None], [extra])[0], meta)
+
+class FFDNetStage(_BatchableStage):
+    """FFDNet denoiser: ใช้ ffdnet/denoiser.FFDNetDenoiser (โหลด net_rgb.pth / net_gray.pth ครั้งเดียว)"""
+
+    def __init__(self, device):
+        self.device = device
+        with _isolated_import(FFDNET_DIR, ('models', 'functions', 'utils', 'denoiser')):
+            from denoiser import FFDNetDenoiser
+        self.denoiser = FFDNetDenoiser(device, FFDNET_DIR / 'models')
+        self.nets     = self.denoiser.nets
+
+    def prepare(self, img: np.ndarray, sigma):
+        """
+        sigma (0–255) เป็นค่าเดียวทั้งภาพ หรือ array ของ sigma ต่อ block
+        (dem.noise_map) → ขยายเป็น noise map ขนาด H/2 × W/2 ของ FFDNet
+        """
+        return self.denoiser.prepare(img, sigma)
+
+    def forward(self, xb, sigmas):
+        # noise_sigma แยกต่อภาพ → batch เดียวกันมี sigma ต่างกันได้
+        return self.denoiser.forward(xb, sigmas)
+
+    def finish(self, y, meta):
+        # คืน shape เดิมของภาพเข้า: H×W×1 ได้ 1 channel, RGB ที่สาม channel เท่ากัน (รันโมเดล gray) ได้ 3 channel
+        return self.denoiser.finish(y, meta)
+
+    def sweep(self, img: np.ndarray, sigma: float):
+        """หลาย candidate sigma ใน forward เดียว → (ภาพที่เลือก, sigma ที่เลือก, {sigma: noise ที่เหลือ})"""
+        return self.denoiser.denoise_sweep(img, sigma)
+
+class DeblurGANStage(_BatchableStage):
+    """DeblurGAN-v2 generator (fpn_inception.h5 + config/config.yaml)"""
+
+    # norm layer ถูกแปลงเป็น InstanceStatsNorm (deblurganv2/inference.py): สถิติต่อภาพ
+    # เหมือน train mode แต่ไม่แก้ buffer → รวม batch และเรียกพร้อมกันหลาย thread ได้
+    # สถิติคิดรวมส่วนที่ pad ด้วย → bucket = 32 เท่ากับที่ prepare pad อยู่แล้ว
+    # (MicroBatcher ไม่ pad เพิ่ม ผลเท่ากับรันทีละภาพ)
+    bucket = 32
+
+    def __init__(self, device):
+        self.device = device
+        with open(DEBLURGAN_DIR / 'config' / 'config.yaml', encoding='utf-8') as f:
+            cfg = yaml.safe_load(f)
+        with _isolated_import(DEBLURGAN_DIR, ('models', 'aug', 'inference')):
+            from models.networks import get_generator
+            from inference import to_inference
+            model = get_generator(cfg.get('model', 'fpn_inception'))
+
+        state = torch.load(str(DEBLURGAN_DIR / 'fpn_inception.h5'), map_location=device)
+        # บางไฟล์ weight เก็บใต้ key 'model'
+        state_dict = state.get('model', state) if isinstance(state, dict) else state
+        model.load_state_dict(state_dict, strict=False)
+        self.model = to_inference(model).to(device)
+
+    def prepare(self, img: np.ndarray):
+        # normalize → (–1..1) แล้ว pad ให้เป็น multiple of 32
+        h, w, _ = img.shape
+        block   = 32
+        pad_h   = (block - h % block) % block
+        pad_w   = (block - w % block) % block
+        x = np.pad(img * 2.0 - 1.0, ((0, pad_h), (0, pad_w), (0, 0)), mode='reflect')
+        x = torch.from_numpy(x.transpose(2, 0, 1)).float().to(self.device)
+        # ภาพขาวดำ (H×W×1): โมเดลมีแต่ RGB → ขยายเป็น 3 channel เฉพาะใน tensor
+        return x.expand(3, -1, -1), None, (h, w, img.shape[2] == 1)
+
+    def forward(self, xb, extras):
+        with torch.inference_mode():
+            return self.model(xb)
+
+    def finish(self, y, meta):
+        h, w, gray = meta
+        if gray:
+            y = y.mean(0, keepdim=True)
+        pred = y.cpu().numpy()
+        return np.clip((pred.transpose(1, 2, 0) + 1.0) / 2.0, 0, 1)[:h, :w, :]
+
+class EDSRStage(_BatchableStage):
+    """EDSR (r32f256, x{EDSR_SCALE}) จาก experiment/model/EDSR_x{scale}.pt"""
+
+    # receptive field ของ EDSR กว้าง → ส่วนที่ pad (replicate) เปลี่ยนผลแถบขวา/ล่างของภาพจริง
+    # bucket = 1: รวม batch เฉพาะภาพขนาดเท่ากัน (ไม่ pad เลย) ผลเท่ากับรันทีละภาพ
+    bucket = 1
+
+    def __init__(self, device, scale: int = EDSR_SCALE):
+        self.device = device
+        self.scale  = scale
+        args = SimpleNamespace(
+            n_resblocks=32, n_feats=256, res_scale=0.1,
+            scale=[scale], rgb_range=255, n_colors=3
+        )
+        with _isolated_import(EDSR_DIR, ('model',)):
+            from model import edsr
+            net = edsr.make_model(args)
+
+        state = torch.load(EDSR_MODEL_DIR / f'EDSR_x{scale}.pt', map_location=device)
+        net.load_state_dict(state, strict=False)
+        self.net = net.to(device).eval()
+
+    def prepare(self, img: np.ndarray):
+        # rgb_range = 255 → tensor ช่วง [0, 255]
+        x = torch.from_numpy(np.ascontiguousarray(img.transpose(2, 0, 1)) * 255.0).to(self.device)
+        # n_colors=3 → ภาพขาวดำ (H×W×1) ขยายเป็น 3 channel เฉพาะใน tensor
+        return x.expand(3, -1, -1), None, (*img.shape[:2], img.shape[2] == 1)
+
+    def forward(self, xb, extras):
+        with torch.no_grad():
+            return self.net(xb).clamp(0, 255).round()  # utility.quantize
+
+    def finish(self, y, meta):
+        h, w, gray = meta
+        if gray:
+            y = y.mean(0, keepdim=True)
+        return y[:, :h * self.scale, :w * self.scale].permute(1, 2, 0).cpu().numpy() / 255.0
+
+class AWBStage:
+    """Deep white-balance (net_awb.pth หรือแยกจาก net.pth)"""
+
+    batchable   = False
+    thread_safe = True
+
+    def __init__(self, device, max_size: int = 656):
+        self.device   = device
+        self.max_size = max_size
+        with _isolated_import(FEM_ROOT, ('arch', 'utilities')):
+            from arch import deep_wb_model, deep_wb_single_task
+            import arch.splitNetworks as splitter
+            from utilities.deepWB import deep_wb
+
+        if (FEM_MODEL_DIR / 'net_awb.pth').exists():
+            net_awb = deep_wb_single_task.deepWBnet()
+            net_awb.load_state_dict(torch.load(FEM_MODEL_DIR / 'net_awb.pth', map_location=device))
+        elif (FEM_MODEL_DIR / 'net.pth').exists():
+            net = deep_wb_model.deepWBNet()
+            net.load_state_dict(torch.load(FEM_MODEL_DIR / 'net.pth', map_location=device))
+            net_awb, _, _ = splitter.splitNetworks(net)
+        else:
+            raise FileNotFoundError(f"ไม่พบโมเดล AWB ใน {FEM_MODEL_DIR}")
+
+        self.net_awb = net_awb.to(device).eval()
+        self._deep_wb = deep_wb
+
+    def __call__(self, img: np.ndarray) -> np.ndarray:
+        out = self._deep_wb(Image.fromarray(to_uint8(img)), task='awb',
+                            net_awb=self.net_awb, device=self.device, s=self.max_size)
+        return out.astype(np.float32)
+
+STAGES = {
+    'ffdnet':    FFDNetStage,
+    'deblurgan': DeblurGANStage,
+    'edsr':      EDSRStage,
+    'awb':       AWBStage,
+}
+
+# ขนาดภาพ (H, W) ที่ใช้ dummy forward ตอน warm-up — EDSR ใช้ภาพเล็กกว่า
+# เพราะ output ใหญ่ขึ้น x{EDSR_SCALE} และช้ามากบน CPU
+WARMUP_SHAPES = {
+    'ffdnet':    (256, 256),
+    'deblurgan': (256, 256),
+    'edsr':      (96, 96),
+    'awb':       (256, 256),
+}
+
+# ─── HOST ───────────────────────────────────────────────────────────
+class ModelHost:
+    """
+    เก็บโมเดลทุกตัวไว้ใน process เดียว (โหลดครั้งแรกที่ถูกเรียก แล้วใช้ซ้ำ)
+    แทนการเปิด subprocess ใหม่ทุก stage ซึ่งต้อง import torch + โหลด weight ทุกครั้ง
+    """
+
+    def __init__(self, device=None, batching: dict = None):
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device    = torch.device(device)
+        self.batching  = BATCHING if batching is None else batching
+        self._models   = {}
+        self._batchers = {}
+        self._locks    = {name: threading.Lock() for name in STAGES}
+        self._load_s   = {}   # name → เวลาโหลด weight (วินาที)
+        self._warmup   = {}   # name → {'state', 'warmup_s', 'error'}
+
+    def get(self, name: str):
+        """คืน stage ที่โหลดแล้ว (โหลดตอนนี้ถ้ายังไม่เคย)"""
+        stage = self._models.get(name)
+        if stage is None:
+            with self._locks[name]:
+                stage = self._models.get(name)
+                if stage is None:
+                    t0 = time.monotonic()
+                    stage = STAGES[name](self.device)
+                    self._load_s[name] = time.monotonic() - t0
+                    if stage.batchable and self.batching['max_batch'] > 1:
+                        batching = {**self.batching, 'bucket': stage.bucket or self.batching['bucket']}
+                        self._batchers[name] = MicroBatcher(stage, name=name, **batching)
+                    self._models[name] = stage
+        return stage
+
+    def run(self, name: str, *args):
+        stage = self.get(name)
+        batcher = self._batchers.get(name)
+        if batcher is not None:
+            return batcher(*args)
+        if stage.thread_safe:
+            return stage(*args)
+        # stage ที่ไม่ thread-safe → ให้รันทีละ request ต่อโมเดล
+        with self._locks[name]:
+            return stage(*args)
+
+    def batch_stats(self) -> dict:
+        return {name: b.stats() for name, b in self._batchers.items()}
+
+    # ─── warm-up / readiness ────────────────────────────────────────
+    def warmup(self, names=None, background: bool = True):
+        """
+        โหลดโมเดลแล้วรัน dummy forward (ขนาดตาม WARMUP_SHAPES) ล่วงหน้า
+        แต่ละโมเดลใน thread ของตัวเอง → request แรกไม่ต้องรอโหลด weight
+        คืน list ของ thread (background=False จะรอจนเสร็จ)
+        """
+        names = list(names or STAGES)
+        for name in names:
+            self._warmup[name] = {'state': 'pending', 'warmup_s': None, 'error': None}
+        threads = [threading.Thread(target=self._warm, args=(name,), name=f'warmup-{name}',
+                                    daemon=True) for name in names]
+        for t in threads:
+            t.start()
+        if not background:
+            for t in threads:
+                t.join()
+        return threads
+
+    def _warm(self, name: str):
+        state = self._warmup[name]
+        try:
+            state['state'] = 'loading'
+            self.get(name)
+            state['state'] = 'warming'
+            t0 = time.monotonic()
+            h, w = WARMUP_SHAPES[name]
+            img = np.random.default_rng(0).random((h, w, 3), dtype=np.float32)
+            if name == 'ffdnet':
+                self.run(name, img, 25.0)
+                self.run(name, np.repeat(img[..., :1], 3, axis=2), 25.0)   # โมเดล gray
+            else:
+                self.run(name, img)
+            state['warmup_s'] = round(time.monotonic() - t0, 3)
+            state['state']    = 'ready'
+        except Exception as e:
+            state['error'] = f"{type(e).__name__}: {e}"
+            state['state'] = 'failed'
+
+    def status(self) -> dict:
+        """สถานะต่อโมเดล: state (not_loaded / pending / loading / warming / ready / failed), load_s, warmup_s"""
+        out = {}
+        for name in STAGES:
+            info = dict(self._warmup.get(name) or
+                        {'state': 'ready' if name in self._models else 'not_loaded',
+                         'warmup_s': None, 'error': None})
+            load_s = self._load_s.get(name)
+            info['load_s'] = None if load_s is None else round(load_s, 3)
+            out[name] = info
+        return out
+
+    def ready(self) -> bool:
+        """True เมื่อทุกโมเดลที่สั่ง warm-up พร้อมแล้ว"""
+        return bool(self._warmup) and all(s['state'] == 'ready' for s in self._warmup.values())
+
+    def denoise(self, img: np.ndarray, sigma: float) -> np.ndarray:
+        return self.run('ffdnet', img, sigma)
+
+    def denoise_sweep(self, img: np.ndarray, sigma: float):
+        # candidate ทั้งหมดเป็น batch ในตัวอยู่แล้ว → ไม่ผ่าน MicroBatcher
+        return self.get('ffdnet').sweep(img, sigma)
+
+    def deblur(self, img: np.ndarray) -> np.ndarray:
+        return self.run('deblurgan', img)
+
+    def super_resolve(self, img: np.ndarray) -> np.ndarray:
+        return self.run('edsr', img)
+
+    def white_balance(self, img: np.ndarray) -> np.ndarray:
+        return self.run('awb', img)
+
+_host = None
+_host_lock = threading.Lock()
+
+def get_host() -> ModelHost:
+    """ModelHost ตัวเดียวของ process"""
+    global _host
+    if _host is None:
+        with _host_lock:
+            if _host is None:
+                _host = ModelHost()
+    return _host
@@ -1,19 +1,150 @@
 # orchestrator/app.py
 
+import hashlib
+import json
 import os
 import sys
-from flask import Flask, render_template, request, send_from_directory
+import tempfile
+import threading
+import time
+import zipfile
+from flask import (Flask, Response, jsonify, render_template, request, send_file,
+                   send_from_directory, url_for)
+from PIL import Image
+from werkzeug.utils import secure_filename
 
 # ─── PATH SETUP ─────────────────────────────────────────────────────
 BASE_DIR     = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(BASE_DIR, '..'))
 sys.path.insert(0, PROJECT_ROOT)  # เพื่อให้ import modules.arf.run_arf ได้
 
-TEMPLATE_DIR  = os.path.join(PROJECT_ROOT, 'templates')
-UPLOAD_FOLDER = os.path.join(PROJECT_ROOT, 'static', 'uploads')
+TEMPLATE_DIR      = os.path.join(PROJECT_ROOT, 'templates')
+UPLOAD_FOLDER     = os.path.join(PROJECT_ROOT, 'static', 'uploads')
+CACHE_FOLDER      = os.path.join(UPLOAD_FOLDER, 'cache')
+# ไฟล์ที่ไม่ให้เสิร์ฟ (metadata ของแคช, สถิติ planner) อยู่ใน instance/ นอก static/
+INSTANCE_FOLDER   = os.path.join(PROJECT_ROOT, 'instance')
+CACHE_META_FOLDER = os.path.join(INSTANCE_FOLDER, 'cache')
 
 # ─── IMPORT APPLY_ARF ───────────────────────────────────────────────
-from modules.arf.run_arf import apply_arf
+from modules.arf.planner import PLANNER_ENABLED, get_planner
+from modules.arf.run_arf import arf_steps
+from modules.model_host import BACKEND, STAGES, get_host
+from orchestrator.cache import ResultCache
+from orchestrator.batch import run_batch
+from orchestrator.jobs import JobManager, QueueFull
+from orchestrator import metrics
+from orchestrator.pipeline import StagedExecutor, parse_stage_workers
+
+# ─── RESULT CACHE ───────────────────────────────────────────────────
+# อัปโหลดไฟล์เดิมซ้ำ (และ config/weight เหมือนเดิม) → คืนผลลัพธ์เดิมโดยไม่รันโมเดล
+cache = ResultCache(
+    CACHE_FOLDER,
+    CACHE_META_FOLDER,
+    max_bytes=int(os.environ.get('ARF_CACHE_MB', 2048)) * 1024 * 1024
+)
+
+# ─── METRICS ────────────────────────────────────────────────────────
+# GET /metrics (Prometheus text format) — ค่าจาก pool/cache อ่านตอน scrape
+registry = metrics.Registry()
+stage_seconds = registry.register(metrics.Histogram(
+    'arf_stage_seconds', 'Time spent in one pipeline step, by stage', ['stage']))
+stage_errors = registry.register(metrics.Counter(
+    'arf_stage_errors_total', 'Pipeline steps that raised, by stage', ['stage']))
+request_seconds = registry.register(metrics.Histogram(
+    'arf_request_seconds', 'End-to-end restore time per request', ['cache']))
+image_megapixels = registry.register(metrics.Histogram(
+    'arf_image_megapixels', 'Size of uploaded images in megapixels', buckets=metrics.MEGAPIXEL_BUCKETS))
+route_total = registry.register(metrics.Counter(
+    'arf_route_total', 'Requests by first DEM verdict (noise/blur/hr/clean)', ['kind']))
+
+def _on_step(stage: str, seconds: float, ok: bool):
+    stage_seconds.observe(seconds, stage=stage)
+    if not ok:
+        stage_errors.inc(stage=stage)
+
+# ─── STAGED PIPELINE ────────────────────────────────────────────────
+# แต่ละ stage (io, dem, ffdnet, deblurgan, edsr, fem) มี worker pool ของตัวเอง
+# ปรับจำนวน worker ได้ด้วย ARF_STAGE_WORKERS เช่น "ffdnet=4,edsr=2"
+pipeline = StagedExecutor(parse_stage_workers(os.environ.get('ARF_STAGE_WORKERS', '')),
+                          on_step=_on_step)
+
+def _route_kind(route: list) -> str:
+    # route[0] = ผล DEM รอบแรก เช่น 'dem:noise' → 'noise'
+    return route[0].split(':', 1)[1]
+
+def restore(inp_path: str, route: list) -> str:
+    """ดูในแคชก่อน ถ้าไม่มีค่อยรัน pipeline (arf_steps) แล้วเก็บผลลัพธ์เข้าแคช"""
+    t0 = time.monotonic()
+    with Image.open(inp_path) as im:   # อ่านแค่ header
+        image_megapixels.observe(im.width * im.height / 1e6)
+
+    key = cache.key_for_file(inp_path)
+    hit = cache.get(key)
+    if hit is not None:
+        route.extend(hit['route'])
+        out_path = hit['path']
+    else:
+        out_path = pipeline.run(arf_steps(inp_path, route=route))
+        # ภาพ clean จะได้ path เดิมกลับมา → คัดลอกแทนการย้ายไฟล์อัปโหลด
+        out_path = cache.put(key, out_path, route, move=(os.path.abspath(out_path) != os.path.abspath(inp_path)))
+
+    route_total.inc(kind=_route_kind(route))
+    request_seconds.observe(time.monotonic() - t0, cache='hit' if hit else 'miss')
+    return out_path
+
+# ─── JOB POOL ───────────────────────────────────────────────────────
+# ทุกงาน (ทั้ง /process และ /jobs) รันผ่าน worker pool ขนาดจำกัดนี้
+# max_workers = จำนวน request ที่อยู่ใน pipeline พร้อมกัน (กระจายอยู่คนละ stage)
+jobs = JobManager(
+    restore,
+    max_workers=int(os.environ.get('ARF_WORKERS', 8)),
+    max_queue=int(os.environ.get('ARF_MAX_QUEUE', 32))
+)
+
+registry.register(metrics.Gauge(
+    'arf_queue_depth', 'Jobs waiting for a worker', fn=lambda: jobs.stats()['queue_depth']))
+registry.register(metrics.Gauge(
+    'arf_jobs_running', 'Jobs currently in the pipeline', fn=lambda: jobs.stats()['running']))
+registry.register(metrics.Gauge(
+    'arf_stage_queue_depth', 'Steps waiting for a stage worker', ['stage'],
+    fn=lambda: {name: st['queued'] for name, st in pipeline.stats().items()}))
+registry.register(metrics.Gauge(
+    'arf_inflight_jobs', 'Distinct uploads currently queued or running', fn=lambda: jobs.stats()['inflight']))
+registry.register(metrics.Gauge(
+    'arf_coalesced_waiters', 'Requests attached to an identical in-flight upload',
+    fn=lambda: jobs.stats()['waiters']))
+registry.register(metrics.Counter(
+    'arf_coalesced_total', 'Requests served by an identical in-flight job', fn=lambda: jobs.stats()['coalesced']))
+registry.register(metrics.Counter(
+    'arf_cache_hits_total', 'Result cache hits', fn=lambda: cache.stats()['hits']))
+registry.register(metrics.Counter(
+    'arf_cache_misses_total', 'Result cache misses', fn=lambda: cache.stats()['misses']))
+registry.register(metrics.Gauge(
+    'arf_cache_bytes', 'Bytes stored in the result cache', fn=lambda: cache.stats()['bytes']))
+registry.register(metrics.Gauge(
+    'process_resident_memory_bytes', 'Resident memory size in bytes', fn=metrics.process_rss_bytes))
+
+# ─── WARM-UP ────────────────────────────────────────────────────────
+# ARF_WARMUP: 1 = โหลด + dummy forward ทุกโมเดลตอนเริ่ม (ค่าเริ่มต้น), 0 = ปิด,
+# หรือระบุรายชื่อเช่น "ffdnet,edsr"
+STARTED_AT = time.time()
+
+def _warmup_names() -> list:
+    spec = os.environ.get('ARF_WARMUP', '1').strip().lower()
+    if BACKEND != 'host' or spec in ('', '0', 'false'):
+        return []
+    if spec in ('1', 'true', 'all'):
+        return list(STAGES)
+    names = [n.strip() for n in spec.split(',') if n.strip()]
+    unknown = set(names) - set(STAGES)
+    if unknown:
+        raise ValueError(f"ARF_WARMUP: ไม่รู้จักโมเดล {sorted(unknown)}")
+    return names
+
+def start_warmup():
+    names = _warmup_names()
+    if names:
+        get_host().warmup(names)
 
 # ─── FLASK APP ──────────────────────────────────────────────────────
 app = Flask(
@@ -38,7 +169,7 @@ def spinner_svg():
     )
 
 # ─── serve uploaded images ──────────────────────────────────────────
-@app.route('/uploads/<filename>')
+@app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
     return send_from_directory(UPLOAD_FOLDER, filename)
 
@@ -47,6 +178,39 @@ def uploaded_file(filename):
 def index():
     return render_template('index.html')
 
+def _save_upload(file) -> str:
+    """
+    บันทึกไฟล์ต้นทางลง static/uploads โดยตั้งชื่อตาม SHA-256 ของเนื้อไฟล์
+    (ไม่ใช้ชื่อไฟล์จาก client → อัปโหลดชื่อซ้ำไม่ทับกัน) แล้วคืน path
+    """
+    return _save_bytes(file.read(), file.filename)
+
+def _save_bytes(data: bytes, original_name: str) -> str:
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    ext      = os.path.splitext(secure_filename(original_name or ''))[1].lower() or '.png'
+    filename = hashlib.sha256(data).hexdigest()[:16] + ext
+    inp_path = os.path.join(UPLOAD_FOLDER, filename)
+    if not os.path.exists(inp_path):
+        # เขียนลงไฟล์ชั่วคราวในโฟลเดอร์เดียวกันแล้ว os.replace (atomic) → request ที่อัปโหลด
+        # ไฟล์เดียวกันพร้อมกันไม่เห็นไฟล์ที่เขียนไม่เสร็จ และไม่เขียนทับกันกลางทาง
+        fd, tmp = tempfile.mkstemp(prefix='.upload_', suffix='.part', dir=UPLOAD_FOLDER)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, inp_path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return inp_path
+
+def _upload_key(inp_path: str) -> str:
+    """key ของ single-flight = SHA-256 ของเนื้อไฟล์ (ส่วนชื่อไฟล์ที่ _save_bytes ตั้งให้)"""
+    return os.path.splitext(os.path.basename(inp_path))[0]
+
+def _result_name(path: str) -> str:
+    """path ผลลัพธ์ → ชื่อที่ใช้กับ /uploads/<filename> (อาจอยู่ในโฟลเดอร์ย่อย cache/)"""
+    return os.path.relpath(path, UPLOAD_FOLDER).replace(os.sep, '/')
+
 # ─── PROCESS PIPELINE ───────────────────────────────────────────────
 @app.route('/process', methods=['POST'])
 def process_image():
@@ -56,14 +220,16 @@ def process_image():
         return "กรุณาเลือกไฟล์ภาพ", 400
 
     # 2) บันทึกไฟล์ต้นทาง
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    filename = file.filename
-    inp_path = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(inp_path)
+    inp_path = _save_upload(file)
 
-    # 3) รัน DEM → โมเดลทั้งหมด (apply_arf) แล้วได้ path ผลลัพธ์
-    out_path = apply_arf(inp_path)
-    out_name = os.path.basename(out_path)
+    # 3) รัน DEM → โมเดลทั้งหมด (apply_arf) บน worker pool แล้วรอผลลัพธ์
+    try:
+        job = jobs.wait(jobs.submit(inp_path, key=_upload_key(inp_path)))
+    except QueueFull:
+        return "ระบบกำลังประมวลผลงานจำนวนมาก กรุณาลองใหม่อีกครั้ง", 503
+    if job.status != 'done':
+        return f"ประมวลผลไม่สำเร็จ: {job.error}", 500
+    out_name = _result_name(job.result)
 
     # 4) แสดงผลลัพธ์บน result.html
     return render_template(
@@ -75,11 +241,174 @@ def process_image():
         processed=True
     )
 
+# ─── ASYNC JOB API ──────────────────────────────────────────────────
+def _job_json(job):
+    data = job.to_dict()
+    data.pop('input_path', None)
+    if job.result:
+        data['result'] = _result_name(job.result)
+        data['result_url'] = url_for('uploaded_file', filename=data['result'])
+    return data
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    file = request.files.get('image')
+    if not file:
+        return jsonify(error='missing file field "image"'), 400
+
+    try:
+        inp_path = _save_upload(file)
+        job = jobs.submit(inp_path, key=_upload_key(inp_path))
+    except QueueFull as e:
+        return jsonify(error=str(e)), 503
+    return jsonify(_job_json(job)), 202, {'Location': url_for('get_job', job_id=job.id)}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(error='job not found'), 404
+    return jsonify(_job_json(job))
+
+@app.route('/jobs', methods=['GET'])
+def job_stats():
+    return jsonify(dict(jobs.stats(), batching=get_host().batch_stats()))
+
+@app.route('/stages', methods=['GET'])
+def stage_stats():
+    stats = pipeline.stats()
+    if PLANNER_ENABLED:
+        stats['planner'] = get_planner().stats()
+    return jsonify(stats)
+
+# ─── HEALTH ─────────────────────────────────────────────────────────
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # liveness: process ยังตอบ request ได้
+    return jsonify(status='ok', uptime_s=round(time.time() - STARTED_AT, 1))
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # readiness: 200 เมื่อโมเดลที่สั่ง warm-up โหลดและรัน dummy forward เสร็จแล้ว
+    names  = _warmup_names()
+    models = get_host().status() if BACKEND == 'host' else {}
+    ready  = not names or get_host().ready()
+    return jsonify(ready=ready, backend=BACKEND, models=models), (200 if ready else 503)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(cache.stats())
+
+# ─── BATCH UPLOAD ───────────────────────────────────────────────────
+# POST /batch: อัปโหลดหลายไฟล์ (field "images") หรือไฟล์ zip → คืน zip ผลลัพธ์ + manifest.json
+IMAGE_EXTS      = {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp'}
+BULK_MAX_FILES  = int(os.environ.get('ARF_BULK_MAX_FILES', 500))
+BULK_WORKERS    = int(os.environ.get('ARF_BULK_WORKERS', 8))
+BULK_CHUNK      = int(os.environ.get('ARF_BULK_CHUNK', 16))
+# ขนาดหลังแตก zip (กัน zip bomb): ต่อไฟล์ และรวมทั้ง archive — ตรวจจาก header ก่อนอ่าน
+# (zipfile อ่านไม่เกิน file_size ใน header ถ้า header โกหก CRC จะไม่ตรง → BadZipFile)
+BULK_MAX_MEMBER = int(os.environ.get('ARF_BULK_MAX_FILE_MB', 100)) * 1024 * 1024
+BULK_MAX_BYTES  = int(os.environ.get('ARF_BULK_MAX_MB', 1024)) * 1024 * 1024
+# batch รันใน thread ของ request เอง (ไม่ผ่าน JobManager) → จำกัดจำนวน batch ที่รันพร้อมกัน
+# batch ที่เกินได้ 503 ทันทีเหมือนคิวของ /jobs เต็ม แทนการเปิด pool ใหม่ไม่จำกัด
+BULK_CONCURRENCY = int(os.environ.get('ARF_BULK_CONCURRENCY', 1))
+_bulk_slots      = threading.BoundedSemaphore(BULK_CONCURRENCY)
+
+def _batch_uploads() -> list:
+    """บันทึกไฟล์ทั้งหมดใน request (แตก zip ด้วย) คืน [(ชื่อไฟล์เดิม, path), ...]"""
+    items    = []
+    unpacked = 0   # ขนาดรวมของไฟล์ที่แตกจาก zip แล้ว
+    for file in request.files.getlist('images') + request.files.getlist('archive'):
+        if (file.filename or '').lower().endswith('.zip'):
+            with zipfile.ZipFile(file.stream) as zf:
+                for info in zf.infolist():
+                    name = info.filename
+                    if info.is_dir() or os.path.splitext(name)[1].lower() not in IMAGE_EXTS:
+                        continue
+                    if len(items) >= BULK_MAX_FILES:
+                        raise ValueError(f"เกิน {BULK_MAX_FILES} ไฟล์ต่อ batch")
+                    if info.file_size > BULK_MAX_MEMBER:
+                        raise ValueError(f"{name}: ใหญ่เกิน {BULK_MAX_MEMBER >> 20} MB หลังแตก zip")
+                    unpacked += info.file_size
+                    if unpacked > BULK_MAX_BYTES:
+                        raise ValueError(f"ขนาดรวมหลังแตก zip เกิน {BULK_MAX_BYTES >> 20} MB")
+                    items.append((name, _save_bytes(zf.read(info), name)))
+        elif file.filename:
+            if len(items) >= BULK_MAX_FILES:
+                raise ValueError(f"เกิน {BULK_MAX_FILES} ไฟล์ต่อ batch")
+            items.append((file.filename, _save_upload(file)))
+    return items
+
+@app.route('/batch', methods=['POST'])
+def batch_process():
+    if not _bulk_slots.acquire(blocking=False):
+        return jsonify(error=f'batch limit reached ({BULK_CONCURRENCY} running), try again later'), 503
+    try:
+        return _run_batch_request()
+    finally:
+        _bulk_slots.release()
+
+def _run_batch_request():
+    try:
+        items = _batch_uploads()
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify(error=str(e)), 400
+    if not items:
+        return jsonify(error='no images (use field "images" or a .zip in "archive")'), 400
+
+    # ดูแคชก่อน แล้วรัน batch เฉพาะไฟล์ที่ยังไม่มีผลลัพธ์ (ไฟล์ซ้ำรันครั้งเดียว)
+    keys    = [cache.key_for_file(path) for _, path in items]
+    outputs = {}
+    for key, (_, path) in zip(keys, items):
+        hit = cache.get(key)
+        if hit is not None:
+            outputs[key] = {'result': hit['path'], 'route': hit['route'], 'error': None, 'cached': True}
+    todo = {key: path for key, (_, path) in zip(keys, items) if key not in outputs}
+
+    for key, res in zip(todo, run_batch(list(todo.values()), BULK_WORKERS, BULK_CHUNK, _on_step)):
+        out = res['result']
+        if res['error'] is None:
+            out = cache.put(key, out, res['route'],
+                            move=(os.path.abspath(out) != os.path.abspath(todo[key])))
+        outputs[key] = {'result': out, 'route': res['route'], 'error': res['error'], 'cached': False}
+
+    # นับ route ทุกภาพที่ได้ผล ทั้งจากแคชและจาก pipeline (เหมือน restore() ของ /process)
+    for key in keys:
+        if outputs[key]['error'] is None:
+            route_total.inc(kind=_route_kind(outputs[key]['route']))
+
+    # เขียน zip ลงไฟล์ชั่วคราว (ผลลัพธ์หลายร้อยภาพไม่ควรค้างในหน่วยความจำ)
+    archive  = tempfile.TemporaryFile()
+    manifest = []
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zf:
+        for i, (key, (name, _)) in enumerate(zip(keys, items)):
+            out   = outputs[key]
+            entry = {'index': i, 'name': name, 'route': out['route'],
+                     'cached': out['cached'], 'result': None, 'error': out['error']}
+            if out['error'] is None:
+                stem = os.path.splitext(secure_filename(os.path.basename(name)) or 'image')[0]
+                entry['result'] = f"{i:04d}_{stem}_restored{os.path.splitext(out['result'])[1]}"
+                zf.write(out['result'], entry['result'])
+            manifest.append(entry)
+        zf.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+    archive.seek(0)
+    return send_file(archive, mimetype='application/zip', as_attachment=True,
+                     download_name='arf_batch.zip')
+
 # ─── DOWNLOAD ENDPOINT ─────────────────────────────────────────────
-@app.route('/download/<filename>')
+@app.route('/download/<path:filename>')
 def download_file(filename):
     return send_from_directory(UPLOAD_FOLDER, filename, as_attachment=True)
 
 # ─── MAIN ───────────────────────────────────────────────────────────
 if __name__ == '__main__':
+    # debug reloader: process แม่แค่เฝ้าไฟล์ → warm-up เฉพาะ process ลูกที่รับ request
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warmup()
     app.run(debug=True)
+else:
+    start_warmup()
@@ -0,0 +1,109 @@
+# orchestrator/batch.py
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.arf.run_arf import arf_steps
+from modules.dem.dem import analyze_file, learned_classifier, read_for_analysis
+
+# ลำดับ stage ใน pipeline — รอบหนึ่งจะรัน stage ที่อยู่ต้นสุดก่อน
+# ภาพทุกภาพในกลุ่มจึงไปถึง stage เดียวกันพร้อมกัน แล้วเรียกโมเดลทีเดียวทั้งกลุ่ม
+STAGE_ORDER = ('io', 'dem', 'ffdnet', 'deblurgan', 'edsr', 'fem')
+
+# กลุ่มที่ประมวลผลก่อน (ตาม DEM รอบแรก)
+ROUTE_ORDER = ('noise', 'blur', 'hr', 'clean')
+
+def analyze(paths, workers: int = 8, chunk: int = 16) -> list:
+    """
+    รัน DEM กับทุกภาพพร้อมกัน คืน [DEMReport หรือ None (อ่านไฟล์ไม่ได้), ...] ตามลำดับ paths
+    ARF_DEM_MODE=learned (มีไฟล์ weight): ถอดรหัสทีละ chunk ภาพแล้วทำนายทั้ง chunk
+    ด้วย DEMClassifier.analyze_many ครั้งเดียว ไม่เช่นนั้น analyze_file ทีละภาพ
+    """
+    clf = learned_classifier()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch-dem') as pool:
+        if clf is None:
+            return list(pool.map(lambda p: analyze_file(str(p)), paths))
+        reports = []
+        for start in range(0, len(paths), chunk):
+            grays = list(pool.map(lambda p: read_for_analysis(str(p), gray=True), paths[start:start + chunk]))
+            found = iter(clf.analyze_many([g for g in grays if g is not None], workers))
+            reports.extend(None if g is None else next(found) for g in grays)
+        return reports
+
+def _run_waves(jobs: list, pool, on_step=None):
+    """
+    รัน generator ของ arf_steps หลายตัวเป็นรอบ ๆ: แต่ละรอบเลือก stage แรกสุด
+    (ตาม STAGE_ORDER) ที่มีภาพรออยู่ แล้วรันทุกภาพของ stage นั้นพร้อมกัน
+    → คำขอเข้าโมเดลพร้อมกันทั้งกลุ่ม และ MicroBatcher รวมเป็น batch ให้
+    """
+    def _step(job):
+        stage, fn, args = job['step']
+        t0 = time.monotonic()
+        value, exc = None, None
+        try:
+            value = fn(*args)
+        except Exception as e:
+            exc = e
+        if on_step is not None:
+            on_step(stage, time.monotonic() - t0, exc is None)
+        return value, exc
+
+    def _advance(job, resume):
+        try:
+            job['step'] = resume()
+        except StopIteration as stop:
+            job['step'], job['result'] = None, stop.value
+        except Exception as e:
+            job['step'], job['error'] = None, f"{type(e).__name__}: {e}"
+
+    for job in jobs:
+        _advance(job, lambda: next(job['steps']))
+
+    while True:
+        pending = [j for j in jobs if j['step'] is not None]
+        if not pending:
+            return
+        stage = min((j['step'][0] for j in pending), key=STAGE_ORDER.index)
+        group = [j for j in pending if j['step'][0] == stage]
+        for job, (value, exc) in zip(group, pool.map(_step, group)):
+            if exc is None:
+                _advance(job, lambda: job['steps'].send(value))
+            else:
+                _advance(job, lambda: job['steps'].throw(exc))
+
+def run_batch(paths, workers: int = 8, chunk: int = 16, on_step=None) -> list:
+    """
+    ประมวลผลภาพหลายภาพแบบ batch:
+      1) DEM ทุกภาพพร้อมกัน
+      2) จัดกลุ่มตาม route ของ DEM รอบแรก (noise / blur / hr / clean)
+      3) ในแต่ละกลุ่ม รันทีละ chunk ภาพ (จำกัดจำนวนภาพที่ถอดรหัสค้างในหน่วยความจำ)
+         โดยทุกภาพใน chunk ผ่านแต่ละ stage พร้อมกัน
+    คืน list ตามลำดับ paths: {'input', 'kind', 'route', 'result', 'error'}
+    """
+    paths   = [str(p) for p in paths]
+    reports = analyze(paths, workers, chunk)
+
+    results = [
+        {'input': p, 'kind': r.kind if r else 'clean', 'route': [], 'result': None, 'error': None}
+        for p, r in zip(paths, reports)
+    ]
+    groups = {}
+    for i, res in enumerate(results):
+        groups.setdefault(res['kind'], []).append(i)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as pool:
+        for kind in sorted(groups, key=lambda k: ROUTE_ORDER.index(k) if k in ROUTE_ORDER else len(ROUTE_ORDER)):
+            idx = groups[kind]
+            for start in range(0, len(idx), chunk):
+                jobs = []
+                for i in idx[start:start + chunk]:
+                    # ส่ง DEMReport ที่วิเคราะห์แล้วเข้าไป → ไม่ต้องรัน DEM รอบแรกซ้ำ
+                    jobs.append({
+                        'steps': arf_steps(paths[i], route=results[i]['route'], report=reports[i]),
+                        'step': None, 'result': None, 'error': None, 'index': i,
+                    })
+                _run_waves(jobs, pool, on_step)
+                for job in jobs:
+                    results[job['index']]['result'] = job['result']
+                    results[job['index']]['error']  = job['error']
+    return results
@@ -0,0 +1,154 @@
+# orchestrator/cache.py
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from modules.arf.planner import PLANNER_ENABLED
+from modules.arf.run_arf import (FFDNET_SWEEP, GRAY_FAST_PATH, NOISE_MAP, TILE_MAX_FRACTION, TILE_MODE,
+                                 TILE_OVERLAP)
+from modules.dem.dem import THRESHOLDS
+from modules.dem.learned import MODEL_PATH as DEM_MODEL_PATH
+from modules.model_host import BACKEND, EDSR_SCALE, WEIGHT_FILES
+
+# ─── HASH HELPERS ───────────────────────────────────────────────────
+def file_sha256(path, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 ของเนื้อไฟล์"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def pipeline_fingerprint() -> str:
+    """
+    hash ของทุกอย่างที่มีผลต่อผลลัพธ์: threshold ของ DEM, EDSR scale, backend,
+    tile mode, noise map, sigma sweep, grayscale path, planner และ hash ของไฟล์ weight ทุกตัว
+    (คำนวณครั้งเดียวตอนสร้าง ResultCache เหมือนกับที่ ModelHost โหลด weight ครั้งเดียว)
+    """
+    config = {
+        'dem':        THRESHOLDS,
+        'edsr_scale': EDSR_SCALE,
+        'backend':    BACKEND,
+        'tiles':      [TILE_MODE, TILE_MAX_FRACTION, TILE_OVERLAP],
+        'noise_map':  NOISE_MAP,
+        'sweep':      FFDNET_SWEEP,
+        'gray':       GRAY_FAST_PATH,
+        'planner':    PLANNER_ENABLED,
+        'weights': {
+            name: [file_sha256(p) for p in paths if Path(p).exists()]
+            for name, paths in {**WEIGHT_FILES, 'dem': [DEM_MODEL_PATH]}.items()
+        },
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+# ─── RESULT CACHE ───────────────────────────────────────────────────
+class ResultCache:
+    """
+    เก็บผลลัพธ์ของ pipeline แบบ content-addressed:
+      key = SHA-256(ไฟล์อัปโหลด + pipeline_fingerprint())
+    ไฟล์ผลลัพธ์อยู่ใน root_dir/<key><ext> (เสิร์ฟผ่าน /uploads ได้)
+    ส่วน sidecar <key>.json (route ที่ใช้) อยู่ใน meta_dir แยกต่างหาก
+    → วาง meta_dir นอกโฟลเดอร์ที่ Flask เสิร์ฟ คนนอกอ่าน metadata ของแคชไม่ได้
+    จำกัดขนาดรวมที่ max_bytes แล้วลบรายการที่ไม่ได้ใช้นานที่สุดก่อน (LRU)
+    """
+
+    def __init__(self, root_dir, meta_dir=None, max_bytes: int = 2 << 30):
+        self.root_dir  = Path(root_dir)
+        self.meta_dir  = Path(meta_dir) if meta_dir is not None else self.root_dir
+        self.max_bytes = max_bytes
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        self.meta_dir.mkdir(parents=True, exist_ok=True)
+        self._entries  = OrderedDict()   # key → {'file', 'route', 'size'}
+        self._bytes    = 0
+        self._lock     = threading.Lock()
+        self._fingerprint = pipeline_fingerprint()
+        self.hits = self.misses = self.evictions = 0
+        self._load_index()
+
+    def key(self, upload_digest: str) -> str:
+        return hashlib.sha256(f'{upload_digest}:{self._fingerprint}'.encode()).hexdigest()
+
+    def key_for_file(self, path) -> str:
+        return self.key(file_sha256(path))
+
+    def get(self, key: str):
+        """คืน {'path', 'route'} ถ้ามีในแคช (และนับ hit/miss)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not (self.root_dir / entry['file']).exists():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return {'path': str(self.root_dir / entry['file']), 'route': list(entry['route'])}
+
+    def put(self, key: str, result_path, route, move: bool = True) -> str:
+        """
+        เก็บไฟล์ผลลัพธ์เข้าแคช คืน path ของไฟล์ในแคช
+        move=True จะย้ายไฟล์ (ไม่ต้องเก็บซ้ำสองที่) ไม่งั้นคัดลอก
+        """
+        src  = Path(result_path)
+        name = f'{key}{src.suffix.lower()}'
+        dest = self.root_dir / name
+        if move:
+            shutil.move(str(src), dest)
+        else:
+            shutil.copyfile(src, dest)
+        with open(self.meta_dir / f'{key}.json', 'w', encoding='utf-8') as f:
+            json.dump({'file': name, 'route': list(route)}, f)
+
+        with self._lock:
+            self._add(key, {'file': name, 'route': list(route), 'size': dest.stat().st_size})
+            self._evict()
+        return str(dest)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries':   len(self._entries),
+                'bytes':     self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits':      self.hits,
+                'misses':    self.misses,
+                'hit_rate':  round(self.hits / total, 4) if total else None,
+                'evictions': self.evictions,
+            }
+
+    # ─── internal ───────────────────────────────────────────────────
+    def _add(self, key, entry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old['size']
+        self._entries[key] = entry
+        self._bytes += entry['size']
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            self._bytes -= entry['size']
+            self.evictions += 1
+            for f in (self.root_dir / entry['file'], self.meta_dir / f'{key}.json'):
+                f.unlink(missing_ok=True)
+
+    def _load_index(self):
+        # sidecar เก่าที่เคยเขียนไว้ข้างไฟล์ผลลัพธ์ → ย้ายไป meta_dir
+        if self.meta_dir != self.root_dir:
+            for old in self.root_dir.glob('*.json'):
+                os.replace(old, self.meta_dir / old.name)
+        # โหลดรายการที่มีอยู่บนดิสก์ (เรียงตามเวลาแก้ไข เก่า → ใหม่)
+        metas = sorted(self.meta_dir.glob('*.json'), key=lambda p: p.stat().st_mtime)
+        for meta in metas:
+            try:
+                with open(meta, encoding='utf-8') as f:
+                    entry = json.load(f)
+                size = (self.root_dir / entry['file']).stat().st_size
+            except (OSError, ValueError, KeyError):
+                continue
+            self._add(meta.stem, {'file': entry['file'], 'route': entry['route'], 'size': size})
+        self._evict()
@@ -0,0 +1,143 @@
+# orchestrator/jobs.py
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class QueueFull(Exception):
+    """คิวงานเต็ม (จำนวนงานที่รออยู่ถึง max_queue แล้ว)"""
+
+class Job:
+    """สถานะของงาน 1 งาน: queued → running → done / failed"""
+
+    def __init__(self, input_path: str, key: str = None):
+        self.id           = uuid.uuid4().hex
+        self.input_path   = input_path
+        self.key          = key
+        self.waiters      = 1      # จำนวน request ที่รอผลของงานนี้ (รวมตัวที่สร้างงาน)
+        self.status       = 'queued'
+        self.route        = []
+        self.result       = None
+        self.error        = None
+        self.submitted_at = time.time()
+        self.started_at   = None
+        self.finished_at  = None
+        self.done_event   = threading.Event()
+
+    def to_dict(self) -> dict:
+        now = time.time()
+        queue_wait = (self.started_at or now) - self.submitted_at
+        run_time   = None
+        if self.started_at is not None:
+            run_time = (self.finished_at or now) - self.started_at
+        return {
+            'id':           self.id,
+            'status':       self.status,
+            'waiters':      self.waiters,
+            'route':        list(self.route),
+            'result':       self.result,
+            'error':        self.error,
+            'submitted_at': self.submitted_at,
+            'started_at':   self.started_at,
+            'finished_at':  self.finished_at,
+            'queue_wait_s': round(queue_wait, 3),
+            'run_time_s':   None if run_time is None else round(run_time, 3),
+        }
+
+class JobManager:
+    """
+    รันงาน pipeline บน worker pool ขนาดจำกัด แทนการรันใน request thread ของ Flask
+      - run_fn(input_path, route) → path ผลลัพธ์ (เช่น apply_arf)
+      - max_workers: จำนวนงานที่รันพร้อมกันได้
+      - max_queue:   จำนวนงานที่รอคิวได้สูงสุด เกินนี้ submit จะ raise QueueFull
+      - max_history: จำนวนงานที่จบแล้วที่เก็บสถานะไว้ให้ GET /jobs/<id>
+
+    single-flight: submit ที่ส่ง key (เช่น hash ของไฟล์อัปโหลด) ตรงกับงานที่ยังไม่จบ
+    จะได้ Job เดิมกลับไป (waiters + 1) แทนการสร้างงานใหม่ → ภาพเดียวกันที่อัปโหลด
+    พร้อมกันหลายครั้งรัน pipeline ครั้งเดียว
+    """
+
+    def __init__(self, run_fn, max_workers: int = 2, max_queue: int = 32,
+                 max_history: int = 1000):
+        self.run_fn      = run_fn
+        self.max_workers = max_workers
+        self.max_queue   = max_queue
+        self.max_history = max_history
+        self._executor   = ThreadPoolExecutor(max_workers=max_workers,
+                                              thread_name_prefix='arf-job')
+        self._jobs       = OrderedDict()
+        self._lock       = threading.Lock()
+        self._inflight   = {}   # key → Job ที่ยังไม่จบ
+        self._counts     = {'done': 0, 'failed': 0, 'coalesced': 0}
+
+    def submit(self, input_path: str, key: str = None) -> Job:
+        with self._lock:
+            job = self._inflight.get(key) if key is not None else None
+            if job is not None:
+                job.waiters += 1
+                self._counts['coalesced'] += 1
+                return job
+            if self._count('queued') >= self.max_queue:
+                raise QueueFull(f"คิวเต็ม ({self.max_queue} งาน)")
+            job = Job(input_path, key)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._inflight[key] = job
+            self._trim()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job: Job, timeout: float = None) -> Job:
+        job.done_event.wait(timeout)
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers':     self.max_workers,
+                'max_queue':   self.max_queue,
+                'queue_depth': self._count('queued'),
+                'running':     self._count('running'),
+                'done':        self._counts['done'],
+                'failed':      self._counts['failed'],
+                'inflight':    len(self._inflight),
+                # request ที่ผูกกับงานที่กำลังรันอยู่แล้ว (ไม่นับตัวที่สร้างงาน)
+                'waiters':     sum(j.waiters - 1 for j in self._inflight.values()),
+                'coalesced':   self._counts['coalesced'],
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    # ─── internal ───────────────────────────────────────────────────
+    def _run(self, job: Job):
+        job.status     = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = self.run_fn(job.input_path, job.route)
+            job.status = 'done'
+        except Exception as e:
+            job.error  = f"{type(e).__name__}: {e}"
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._counts[job.status] += 1
+                if self._inflight.get(job.key) is job:
+                    del self._inflight[job.key]
+            job.done_event.set()
+
+    def _count(self, status: str) -> int:
+        return sum(1 for j in self._jobs.values() if j.status == status)
+
+    def _trim(self):
+        # ลบงานที่จบแล้วที่เก่าที่สุดออก เมื่อเก็บเกิน max_history
+        finished = [k for k, j in self._jobs.items() if j.status in ('done', 'failed')]
+        for k in finished[:max(0, len(self._jobs) - self.max_history)]:
+            del self._jobs[k]
@@ -0,0 +1,138 @@
+# orchestrator/metrics.py
+
+import math
+import os
+import sys
+import threading
+
+# Prometheus text exposition format (version 0.0.4) แบบไม่ต้องพึ่ง prometheus_client
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS    = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+MEGAPIXEL_BUCKETS  = (0.1, 0.25, 0.5, 1, 2, 4, 8, 12, 16, 24, 48)
+
+def _fmt(v) -> str:
+    if v == math.inf:
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def _labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    esc = lambda s: str(s).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in pairs) + '}'
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name       = name
+        self.help       = help
+        self.labelnames = tuple(labelnames)
+        self._lock      = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self) -> list:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}', *self.samples()]
+
+class Counter(_Metric):
+    """ตัวนับที่เพิ่มขึ้นอย่างเดียว (หรืออ่านค่าจาก fn ตอน scrape)"""
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+        self._fn     = fn
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list:
+        if self._fn:
+            values = _collect(self._fn)
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [f'{self.name}{_labels(self.labelnames, k)} {_fmt(v)}' for k, v in values.items()]
+
+class Gauge(Counter):
+    """ค่าที่ขึ้นลงได้ ปกติอ่านจาก fn ตอน scrape (เช่น queue depth, RSS)"""
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    """histogram แบบ cumulative bucket (le) + _sum + _count"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}   # labels → [counts ต่อ bucket, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> list:
+        with self._lock:
+            snapshot = {k: (list(c), s, n) for k, (c, s, n) in self._series.items()}
+        lines = []
+        for key, (counts, total, n) in snapshot.items():
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", _fmt(bound))])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_fmt(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {n}')
+        return lines
+
+def _collect(fn) -> dict:
+    # fn คืนค่าเดียว หรือ dict {label value / tuple ของ label values: ค่า}
+    out = fn()
+    if not isinstance(out, dict):
+        return {(): out}
+    return {k if isinstance(k, tuple) else (k,): v for k, v in out.items()}
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics:
+            try:
+                lines.extend(m.render())
+            except Exception:
+                continue   # collector ตัวหนึ่งพังไม่ควรทำให้ /metrics ทั้งหน้าพัง
+        return '\n'.join(lines) + '\n'
+
+# ─── PROCESS ────────────────────────────────────────────────────────
+def process_rss_bytes() -> int:
+    """RSS ปัจจุบันของ process (Linux: /proc, อื่น ๆ: ค่าสูงสุดจาก getrusage)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
@@ -0,0 +1,134 @@
+# orchestrator/pipeline.py
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# จำนวน worker ต่อ stage (ค่าเริ่มต้น) — FFDNet/DeblurGAN/EDSR มี micro-batching อยู่หน้าโมเดล
+# จึงให้ worker มากกว่า 1 เพื่อให้มี request เข้า batch พร้อมกันได้
+DEFAULT_STAGE_WORKERS = {
+    'io':        2,
+    'dem':       2,
+    'ffdnet':    4,
+    'deblurgan': 2,
+    'edsr':      2,
+    'fem':       1,
+}
+
+def parse_stage_workers(spec: str) -> dict:
+    """'ffdnet=4,edsr=2' → {'ffdnet': 4, 'edsr': 2} (ใช้กับ ARF_STAGE_WORKERS)"""
+    workers = {}
+    for item in filter(None, (s.strip() for s in spec.split(','))):
+        name, _, n = item.partition('=')
+        if name.strip() not in DEFAULT_STAGE_WORKERS:
+            raise ValueError(f"ไม่รู้จัก stage '{name.strip()}'")
+        workers[name.strip()] = max(1, int(n))
+    return workers
+
+class _Stage:
+    """worker pool + ตัวนับของ stage เดียว"""
+
+    def __init__(self, name: str, workers: int):
+        self.name      = name
+        self.workers   = workers
+        self.executor  = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix=f'stage-{name}')
+        self.queued    = 0
+        self.active    = 0
+        self.completed = 0
+        self.failed    = 0
+        self.busy_s    = 0.0
+        self.lock      = threading.Lock()
+
+class StagedExecutor:
+    """
+    รัน pipeline แบบแยก stage: แต่ละ stage (DEM, FFDNet, DeblurGAN, EDSR, FEM, io)
+    มี worker pool และคิวของตัวเอง request หนึ่งอยู่ได้ทีละ stage แต่หลาย request
+    อยู่คนละ stage พร้อมกันได้ (A อยู่ใน EDSR ขณะที่ B อยู่ใน FFDNet และ C อยู่ใน DEM)
+
+    งานที่ส่งเข้ามาเป็น generator แบบ modules.arf.run_arf.arf_steps ซึ่ง yield
+    (stage, fn, args) → เมื่อ fn จบใน worker ของ stage นั้น จะ send ผลลัพธ์กลับ
+    แล้วส่งขั้นถัดไปเข้าคิวของ stage ถัดไปทันที
+    """
+
+    def __init__(self, workers: dict = None, on_step=None):
+        workers = {**DEFAULT_STAGE_WORKERS, **(workers or {})}
+        self.stages     = {name: _Stage(name, n) for name, n in workers.items()}
+        self.on_step    = on_step   # on_step(stage, seconds, ok) หลังรันแต่ละขั้น (เช่น metrics)
+        self.started_at = time.monotonic()
+
+    def submit(self, steps) -> Future:
+        """เริ่มรัน generator คืน Future ของค่าที่ generator return"""
+        future = Future()
+        self._advance(steps, future, lambda: next(steps))
+        return future
+
+    def run(self, steps, timeout: float = None):
+        return self.submit(steps).result(timeout)
+
+    def stats(self) -> dict:
+        """ตัวนับต่อ stage และ utilization = เวลาที่ worker ทำงาน / (เวลาทั้งหมด × จำนวน worker)"""
+        uptime = time.monotonic() - self.started_at
+        out = {}
+        for name, st in self.stages.items():
+            with st.lock:
+                done = st.completed + st.failed
+                out[name] = {
+                    'workers':     st.workers,
+                    'queued':      st.queued,
+                    'active':      st.active,
+                    'completed':   st.completed,
+                    'failed':      st.failed,
+                    'busy_s':      round(st.busy_s, 3),
+                    'avg_s':       round(st.busy_s / done, 4) if done else None,
+                    'utilization': round(st.busy_s / (uptime * st.workers), 4) if uptime > 0 else 0.0,
+                }
+        return out
+
+    def shutdown(self, wait: bool = True):
+        for st in self.stages.values():
+            st.executor.shutdown(wait=wait)
+
+    # ─── internal ───────────────────────────────────────────────────
+    def _advance(self, steps, future, resume):
+        # เดิน generator ไปขั้นถัดไป แล้วส่งเข้าคิวของ stage นั้น
+        try:
+            name, fn, args = resume()
+            st = self.stages[name]
+        except StopIteration as stop:
+            future.set_result(stop.value)
+            return
+        except BaseException as e:
+            steps.close()
+            future.set_exception(e)
+            return
+        with st.lock:
+            st.queued += 1
+        st.executor.submit(self._run, st, steps, future, fn, args)
+
+    def _run(self, st: _Stage, steps, future, fn, args):
+        with st.lock:
+            st.queued -= 1
+            st.active += 1
+        t0 = time.monotonic()
+        try:
+            value = fn(*args)
+        except Exception as e:
+            self._account(st, t0, ok=False)
+            # ส่ง exception กลับเข้า generator (ถ้าไม่จับไว้ Future จะ fail)
+            self._advance(steps, future, lambda: steps.throw(e))
+        else:
+            self._account(st, t0, ok=True)
+            self._advance(steps, future, lambda: steps.send(value))
+
+    def _account(self, st: _Stage, t0: float, ok: bool):
+        elapsed = time.monotonic() - t0
+        with st.lock:
+            st.active -= 1
+            st.busy_s += elapsed
+            if ok:
+                st.completed += 1
+            else:
+                st.failed += 1
+        if self.on_step is not None:
+            self.on_step(st.name, elapsed, ok)